@@ -25,13 +25,18 @@ of HTML files to an atlas/ subdirectory. Example usage:
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 # Standard library imports.
-from datetime import date, fromtimestamp
+from collections import defaultdict
 import os
-import sqlite3 as db
 import sys
 
+# Third-party imports.
+import numpy as np
+
 # Local imports.
+from autopos import jump_positions
+from dataloader import data_root, load_dataset, use_cache
 import naevdb
+from universe import Universe
 
 def scale_term(val, terms):
     '''Describe the relative scale or magnitude of a value.
@@ -79,7 +84,7 @@ def scale_term(val, terms):
         # Fell through without a match. Use the last one.
         return word
 
-def ssysdesc(ssys, out):
+def ssysdesc(ssys, out, autopos=None):
     '''Write a description of a star system to an output file.
 
     The output is in HTML format and includes hyperlinks to in-system
@@ -88,6 +93,9 @@ def ssysdesc(ssys, out):
     Keyword arguments:
         ssys -- The star system to describe. An instance of SSystem.
         out -- A file or file-like object, already opened for writing.
+        autopos -- A mapping of the names of the systems that
+            autopositioned jumps lead to, to the positions worked out
+            for those jumps (see autopos.py). Optional.
 
     '''
     # Start the HTML output.
@@ -133,7 +141,12 @@ def ssysdesc(ssys, out):
         print('    <li><a href="{0}.html">{0}</a>'.format(jumpname),
               file=out)
         if jump.x is None:
-            print('        (auto-positioned)', file=out)
+            if autopos and jumpname in autopos:
+                print('        @ ({:g}, {:g}) '
+                      '(auto-positioned)'.format(*autopos[jumpname]),
+                      file=out)
+            else:
+                print('        (auto-positioned)', file=out)
         else:
             print('        @ ({0.x}, {0.y})'.format(jump), file=out)
         if jump.exit_only:
@@ -219,10 +232,21 @@ def make_index(out):
 <html lang="en">''', file=out)
 
     # Set metadata.
-    print('<head>\n<title>Naev Atlas</title>\n</head>')
+    print('<head>\n<title>Naev Atlas</title>\n</head>', file=out)
+
+def main(dbfile, cache=True, naevroot=None):
+    '''Generate an atlas of the Naev universe.
 
-def main(dbfile):
-    '''Generate an atlas of the Naev universe.'''
+    Keyword arguments:
+        dbfile -- The name of the database file to read from.
+        cache -- Whether or not to use the persistent parse cache when
+            loading the assets. Defaults to True.
+        naevroot -- The root of the Naev source tree, or an archive of
+            its data, to load the assets from, as for
+            dataloader.datafiles(). If omitted, the current directory
+            is used.
+
+    '''
     atlasdir = os.path.join(os.curdir, 'atlas')
     ssysdir = os.path.join(atlasdir, 'ssys')
     assetdir = os.path.join(atlasdir, 'assets')
@@ -236,29 +260,37 @@ def main(dbfile):
     with open(os.path.join(atlasdir, 'index.html'), 'w') as f:
         make_index(f)
 
-    with db.connect(dbfile) as conn:
+    conn = naevdb.connect(dbfile)
+    try:
         ssystems = naevdb.get_ssystems(conn)
-
-    assets = {}
-    for assetfile in datafiles('Assets'):
-        # Parse each XML file into an Asset object.
-        asset = Asset(assetfile)
-        assets[asset.name] = (asset, [])
-
-    for ssys in ssystems:
-        for asset in ssys.assets:
-            assets[asset][1].append(ssys.name)
-
+    finally:
+        conn.close()
+    universe = Universe(ssystems, load_dataset('Assets', naevroot,
+                                                   cache=cache))
+
+    # Place the autopositioned jumps, all at once.
+    autopos = defaultdict(dict)
+    jump_x, jump_y = jump_positions(universe)
+    placed = np.flatnonzero(np.isnan(universe.jump_x) & ~np.isnan(jump_x))
+    for origin, dest, x, y in zip(universe.jump_from[placed].tolist(),
+                                  universe.jump_to[placed].tolist(),
+                                  jump_x[placed].tolist(),
+                                  jump_y[placed].tolist()):
+        autopos[origin][universe.ssys_names[dest]] = (x, y)
+
+    for i, ssys in enumerate(universe.ssystems):
         with open(os.path.join(ssysdir, ssys.name + '.html'), 'w') as f:
-            ssysdesc(ssys, f)
+            ssysdesc(ssys, f, autopos[i])
 
-    for assetname in assets:
-        asset, systems = assets[assetname]
-        with open(os.path.join(assetdir, assetname + '.html'), 'w') as f:
+    for asset in universe.assets:
+        systems = universe.asset_ssystems.get(asset.name, [])
+        with open(os.path.join(assetdir, asset.name + '.html'), 'w') as f:
             assetdesc(asset, systems, f)
 
 if __name__ == '__main__':
     # Get the name of the database file.
+    cache = use_cache(sys.argv)
+    naevroot = data_root(sys.argv)
     try:
         dbfile = sys.argv[1]
     except IndexError:
@@ -267,4 +299,4 @@ if __name__ == '__main__':
     if not os.path.exists(dbfile):
         raise IOError("database file '{}' does not exist".format(dbfile))
 
-    main(dbfile)
+    main(dbfile, cache, naevroot)
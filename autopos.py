@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+
+'''Positions of autopositioned jump points in the Naev universe.
+
+A jump point marked <autopos/> in its system's data file has no position
+of its own; Naev places it when the universe is loaded, on the edge of
+its system (at the system's radius from the centre) and in the direction
+of the system it leads to. The functions here work out those positions
+the same way, for every jump in the universe at once.
+
+'''
+
+# Copyright © 2012 Tim Pederick.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Third-party imports.
+import numpy as np
+
+def autopositions(from_x, from_y, radius, to_x, to_y):
+    '''Work out where autopositioned jump points lie.
+
+    All of the arguments may be arrays (of the same shape), to work out
+    many positions at once, or single numbers.
+
+    Keyword arguments:
+        from_x, from_y -- The position of the system each jump leads
+            out of.
+        radius -- The radius of that system.
+        to_x, to_y -- The position of the system each jump leads to.
+    Returns:
+        A 2-tuple of the x and y coordinates of each jump point,
+        relative to the centre of its system.
+
+    '''
+    # As in Naev's system_parseJumps(), in space.c.
+    angle = np.arctan2(np.subtract(to_y, from_y), np.subtract(to_x, from_x))
+    return radius * np.cos(angle), radius * np.sin(angle)
+
+def jump_positions(universe):
+    '''Get the position of every jump point in a universe.
+
+    Keyword arguments:
+        universe -- The universe.Universe holding the jumps.
+    Returns:
+        A 2-tuple of arrays of the x and y coordinates of each jump
+        point, in the same order as universe.jump_from. Jumps with a
+        position of their own keep it; autopositioned jumps are placed
+        as for autopositions(), except for any to an unknown system,
+        which are left as NaN.
+
+    '''
+    x, y = universe.jump_x.copy(), universe.jump_y.copy()
+    auto = np.isnan(x) & (universe.jump_to >= 0)
+    origins, dests = universe.jump_from[auto], universe.jump_to[auto]
+    x[auto], y[auto] = autopositions(universe.ssys_x[origins],
+                                     universe.ssys_y[origins],
+                                     universe.ssys_radius[origins],
+                                     universe.ssys_x[dests],
+                                     universe.ssys_y[dests])
+    return x, y
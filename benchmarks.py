@@ -0,0 +1,426 @@
+#!/usr/bin/env python3
+
+'''Performance benchmarks for the Naev data tools.
+
+Run this script from the root directory of your Naev source tree, with
+the name of the benchmark to run. It reports its results to standard
+output. Example usage:
+    user@home:~/naev/$ benchmarks memory
+
+'''
+
+# Copyright © 2012 Tim Pederick.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Standard library imports.
+import gc
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# Local imports.
+from dataloader import data_root, load_dataset
+from dbreader import DBReader
+from jumpgraph import JumpGraph
+import jumpgraph
+from naevdata import (Asset, Coords, Jump, Presence, Record, Services,
+                      SSystem)
+import naevdb
+from routes import distance_cost, RoutePlanner
+import snapshot
+from universe import Universe
+
+# Plain, dict-backed stand-ins for the record classes, made as needed by
+# _unslotted().
+_PLAIN_CLASSES = {}
+
+def _unslotted(value):
+    '''Copy loaded data into the form it took before records were slotted.
+
+    Each record becomes an instance of a plain class of the same name,
+    keeping its attributes in a per-instance __dict__, and every string
+    is a fresh copy rather than an interned, shared one. Containers are
+    copied with their contents.
+
+    '''
+    if isinstance(value, Record):
+        cls = type(value)
+        try:
+            plain = _PLAIN_CLASSES[cls]
+        except KeyError:
+            plain = _PLAIN_CLASSES[cls] = type(cls.__name__, (), {})
+        copy = plain()
+        for name, attr in value.__getstate__().items():
+            setattr(copy, name, _unslotted(attr))
+        return copy
+    if isinstance(value, str):
+        return ''.join(list(value))
+    if isinstance(value, dict):
+        return dict((_unslotted(key), _unslotted(item))
+                    for key, item in value.items())
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return type(value)(_unslotted(item) for item in value)
+    return value
+
+def bench_memory(naevroot=None):
+    '''Measure the memory held by the loaded data model.
+
+    Each dataset is parsed afresh (bypassing the parse cache) in this
+    process, and the memory still allocated once loading is finished
+    is reported per object loaded. The assets are measured both fully
+    and lazily loaded, along with the time taken to load them. For
+    comparison, the fully loaded data is also measured as copied into
+    unslotted, dict-backed objects with unshared strings, as the data
+    model used to be (see _unslotted()).
+
+    Keyword arguments:
+        naevroot -- The root of the Naev source tree. If omitted, the
+            current directory is used.
+
+    '''
+    for dataset, lazy in (('SSystems', False), ('Assets', False),
+                          ('Assets', True)):
+        # Time the load without tracing, which slows it down.
+        start = time.perf_counter()
+        load_dataset(dataset, naevroot, workers=1, cache=False, lazy=lazy)
+        elapsed = time.perf_counter() - start
+
+        gc.collect()
+        tracemalloc.start()
+        baseline = tracemalloc.get_traced_memory()[0]
+        loaded = load_dataset(dataset, naevroot, workers=1, cache=False,
+                              lazy=lazy)
+        gc.collect()
+        used = tracemalloc.get_traced_memory()[0] - baseline
+        unslotted = None
+        if not lazy:
+            copies = [_unslotted(obj) for obj in loaded]
+            gc.collect()
+            unslotted = (tracemalloc.get_traced_memory()[0] - baseline -
+                         used)
+            del copies
+        tracemalloc.stop()
+
+        count = max(len(loaded), 1)
+        print('{}{}: {} loaded in {:.3f} s, {} bytes, {:.0f} bytes '
+              'each{}.'.format(dataset, ' (lazy)' if lazy else '',
+                               len(loaded), elapsed, used, used / count,
+                               '' if unslotted is None else
+                               ' ({:.0f} each unslotted)'.format(
+                                   unslotted / count)))
+        del loaded
+
+def bench_snapshot(naevroot=None):
+    '''Compare loading the universe from the data files and a snapshot.
+
+    The data files are parsed afresh (bypassing the parse cache) and
+    compiled into a temporary snapshot, which is then mapped and turned
+    back into a universe. That universe builds its naevdata objects
+    only on demand, so building them is timed separately.
+
+    Keyword arguments:
+        naevroot -- The root of the Naev source tree. If omitted, the
+            current directory is used.
+
+    '''
+    start = time.perf_counter()
+    universe = Universe.load(naevroot, workers=1, cache=False)
+    parsed = time.perf_counter() - start
+
+    with tempfile.TemporaryDirectory() as tempdir:
+        filename = os.path.join(tempdir, 'naev.snap')
+        start = time.perf_counter()
+        snapshot.compile_snapshot(filename, naevroot, universe)
+        compiled = time.perf_counter() - start
+
+        start = time.perf_counter()
+        snap = snapshot.Snapshot(filename)
+        mapped = time.perf_counter() - start
+        start = time.perf_counter()
+        mapped_universe = snap.to_universe()
+        columns = time.perf_counter() - start
+        start = time.perf_counter()
+        mapped_universe.ssystems, mapped_universe.assets
+        built = time.perf_counter() - start
+        size = os.path.getsize(filename)
+        del mapped_universe
+        snap.close()
+
+    print('Snapshot: {} systems and {} assets parsed in {:.3f} s, compiled '
+          'in {:.3f} s ({} bytes), mapped in {:.6f} s, columns ready in '
+          '{:.6f} s, objects built in {:.3f} s.'.format(
+              len(universe), len(universe.assets), parsed, compiled, size,
+              mapped, columns, built))
+
+def synthetic_universe(size=5000, seed=0):
+    '''Build a large, random universe without reading any data files.
+
+    Each system has up to four jumps to its nearest neighbours in a
+    grid, one or two planets, and a share of a virtual asset.
+
+    Keyword arguments:
+        size -- The number of star systems. Defaults to 5000.
+        seed -- The seed for the random numbers. Defaults to 0, so that
+            the same universe is built every time.
+    Returns:
+        A universe.Universe instance.
+
+    '''
+    rng = random.Random(seed)
+    width = int(size ** 0.5) + 1
+    ssystems, assets = [], []
+    for i in range(size):
+        ssys = SSystem()
+        ssys.name = 'System {}'.format(i)
+        ssys.pos = Coords(100.0 * (i % width) + rng.uniform(-30, 30),
+                          100.0 * (i // width) + rng.uniform(-30, 30))
+        ssys.radius = rng.uniform(5000, 15000)
+        ssys.stars = rng.randrange(100, 600)
+        ssys.interference = rng.choice((0.0, 0.0, 0.0, 250.0))
+        for j in (i - 1, i + 1, i - width, i + width):
+            if 0 <= j < size and rng.random() < 0.8:
+                ssys.jumps['System {}'.format(j)] = Jump(
+                    (rng.uniform(-8000, 8000), rng.uniform(-8000, 8000))
+                    if rng.random() < 0.5 else (None, None))
+        for k in range(rng.randrange(1, 3)):
+            asset = Asset(None)
+            asset.name = 'Planet {}-{}'.format(i, k)
+            asset.virtual = False
+            asset.pos = Coords(rng.uniform(-5000, 5000),
+                               rng.uniform(-5000, 5000))
+            asset.gfx = {'space': 'D00.png', 'exterior': 'desert.png'}
+            asset.world_class = rng.choice('ABDHKLMO')
+            asset.population = rng.randrange(0, 10**9)
+            asset.presence = Presence('Faction {}'.format(i % 7),
+                                      rng.uniform(10, 200), rng.randrange(3))
+            asset.services = Services(land='any', refuel=True, bar='A bar.',
+                                      missions=True)
+            assets.append(asset)
+            ssys.assets.add(asset.name)
+        ssys.assets.add('Virtual {}'.format(i // 10))
+        ssystems.append(ssys)
+
+    for i in range(-(-size // 10)):
+        asset = Asset(None)
+        asset.name = 'Virtual {}'.format(i)
+        asset.presence = Presence('Faction {}'.format(i % 7), 50.0, 1)
+        assets.append(asset)
+    return Universe(ssystems, assets)
+
+def bench_db(naevroot=None, size=5000):
+    '''Measure how fast naevdb stores and reads back a universe.
+
+    A synthetic universe is used (see synthetic_universe()), so that
+    the results don't depend on the data files. It is stored both with
+    a bulk load and one row at a time, and then read back both all at
+    once and a chunk at a time.
+
+    Keyword arguments:
+        naevroot -- Not used. Accepted for consistency with the other
+            benchmarks.
+        size -- The number of star systems in the synthetic universe.
+            Defaults to 5000.
+
+    '''
+    universe = synthetic_universe(size)
+    for mode in ('bulk', 'row by row'):
+        with tempfile.TemporaryDirectory() as tempdir:
+            filename = os.path.join(tempdir, 'naev.db')
+            start = time.perf_counter()
+            with sqlite3.connect(filename) as conn:
+                if mode == 'bulk':
+                    naevdb.bulk_load(conn, universe)
+                else:
+                    naevdb.make_db(conn)
+                    naevdb.store_universe(conn, universe)
+            conn.close()
+            elapsed = time.perf_counter() - start
+
+            with sqlite3.connect(filename) as conn:
+                rows = sum(conn.execute('SELECT COUNT(*) FROM {}'.format(
+                    table)).fetchone()[0] for table in
+                           ('SSystems', 'Jumps', 'Assets', 'VirtualAssets',
+                            'SSysVAssets'))
+                start = time.perf_counter()
+                naevdb.get_ssystems(conn)
+                read_all = time.perf_counter() - start
+                start = time.perf_counter()
+                for ssys in naevdb.iter_ssystems(conn):
+                    pass
+                read_chunked = time.perf_counter() - start
+            conn.close()
+
+        print('Database ({}): {} systems, {} rows stored in {:.3f} s, '
+              '{:.0f} rows/s; read back in {:.3f} s ({:.3f} s in '
+              'chunks).'.format(mode, size, rows, elapsed, rows / elapsed,
+                                read_all, read_chunked))
+
+def bench_reader(naevroot=None, size=5000, lookups=20000):
+    '''Measure how fast star systems can be looked up in a database.
+
+    A synthetic universe (see synthetic_universe()) is stored, and then
+    random systems and their presences are looked up: first with a new
+    connection for each lookup, then through a DBReader, with its cache
+    both disabled and warmed up.
+
+    Keyword arguments:
+        naevroot -- Not used. Accepted for consistency with the other
+            benchmarks.
+        size -- The number of star systems in the synthetic universe.
+            Defaults to 5000.
+        lookups -- The number of lookups to make each way. Defaults to
+            20000.
+
+    '''
+    universe = synthetic_universe(size)
+    rng = random.Random(0)
+    # Look up a tenth of the systems, over and over.
+    names = rng.sample(universe.ssys_names, size // 10)
+    queries = [rng.choice(names) for i in range(lookups)]
+
+    def lookup_all(get_ssys, get_ssys_presence):
+        start = time.perf_counter()
+        for name in queries:
+            get_ssys(name)
+            get_ssys_presence(name)
+        return lookups / (time.perf_counter() - start)
+
+    with tempfile.TemporaryDirectory() as tempdir:
+        filename = os.path.join(tempdir, 'naev.db')
+        with sqlite3.connect(filename) as conn:
+            naevdb.bulk_load(conn, universe)
+        conn.close()
+
+        def fresh(accessor):
+            def lookup(name):
+                conn = naevdb.connect(filename)
+                try:
+                    return accessor(conn, name)
+                finally:
+                    conn.close()
+            return lookup
+        rates = [lookup_all(fresh(naevdb.get_ssys),
+                            fresh(naevdb.get_ssys_presence))]
+        for cache_size in (0, size):
+            with DBReader(filename, cache_size=cache_size) as reader:
+                # Warm up the cache (if any) first.
+                lookup_all(reader.get_ssys, reader.get_ssys_presence)
+                rates.append(lookup_all(reader.get_ssys,
+                                        reader.get_ssys_presence))
+
+    print('Lookups: {:.0f}/s with a connection each, {:.0f}/s pooled, '
+          '{:.0f}/s pooled and cached.'.format(*rates))
+
+def bench_graph(naevroot=None, size=5000, pairs=1000000):
+    '''Measure how fast jump distances can be found in a JumpGraph.
+
+    A synthetic universe (see synthetic_universe()) is made into a
+    JumpGraph, and its hop matrix is built, saved to a temporary cache
+    and memory-mapped back in. Then random pairs of systems are looked
+    up in it, and a few are found by breadth-first search for
+    comparison.
+
+    Keyword arguments:
+        naevroot -- Not used. Accepted for consistency with the other
+            benchmarks.
+        size -- The number of star systems in the synthetic universe.
+            Defaults to 5000.
+        pairs -- The number of pairs of systems to look up. Defaults to
+            1000000.
+
+    '''
+    graph = JumpGraph(synthetic_universe(size))
+    rng = random.Random(0)
+    origins = [rng.randrange(size) for i in range(pairs)]
+    dests = [rng.randrange(size) for i in range(pairs)]
+
+    cache_dir = jumpgraph.HOPS_CACHE_DIR
+    with tempfile.TemporaryDirectory() as tempdir:
+        jumpgraph.HOPS_CACHE_DIR = tempdir
+        try:
+            start = time.perf_counter()
+            graph.hop_matrix()
+            built = time.perf_counter() - start
+            start = time.perf_counter()
+            graph.hops(origins, dests)
+            looked_up = time.perf_counter() - start
+        finally:
+            jumpgraph.HOPS_CACHE_DIR = cache_dir
+
+    searches = 100
+    start = time.perf_counter()
+    for origin in origins[:searches]:
+        graph.bfs(origin)
+    searched = (time.perf_counter() - start) / searches
+
+    print('Hop matrix for {} systems: built in {:.2f} s. {} cached pairs '
+          'looked up in {:.2f} s; one search takes {:.2f} ms.'.format(
+            size, built, pairs, looked_up, searched * 1000))
+
+def bench_routes(naevroot=None, size=5000, queries=2000):
+    '''Measure how fast routes can be planned between star systems.
+
+    A synthetic universe (see synthetic_universe()) is made into a
+    JumpGraph, and the shortest routes between random pairs of systems
+    are found: one at a time, all at once (so that routes from the same
+    origin share a search), and again from memory.
+
+    Keyword arguments:
+        naevroot -- Not used. Accepted for consistency with the other
+            benchmarks.
+        size -- The number of star systems in the synthetic universe.
+            Defaults to 5000.
+        queries -- The number of routes to find. Defaults to 2000.
+
+    '''
+    graph = JumpGraph(synthetic_universe(size))
+    rng = random.Random(0)
+    # Start from a handful of systems, as a trader or a mission might.
+    origins = rng.sample(range(size), 20)
+    pairs = [(rng.choice(origins), rng.randrange(size))
+             for i in range(queries)]
+
+    rates = []
+    planner = RoutePlanner(graph, distance_cost, cache_size=0)
+    start = time.perf_counter()
+    for origin, dest in pairs:
+        planner.route(origin, dest)
+    rates.append(queries / (time.perf_counter() - start))
+    planner = RoutePlanner(graph, distance_cost, cache_size=queries)
+    for i in range(2):
+        start = time.perf_counter()
+        planner.routes(pairs)
+        rates.append(queries / (time.perf_counter() - start))
+
+    print('Routes: {:.0f}/s one at a time, {:.0f}/s in a batch, {:.0f}/s '
+          'remembered.'.format(*rates))
+
+# The available benchmarks, by name.
+BENCHMARKS = {'db': bench_db,
+              'graph': bench_graph,
+              'memory': bench_memory,
+              'reader': bench_reader,
+              'routes': bench_routes,
+              'snapshot': bench_snapshot}
+
+if __name__ == '__main__':
+    # Run the benchmarks named on the command line, or all of them.
+    naevroot = data_root(sys.argv)
+    for name in (sys.argv[1:] or sorted(BENCHMARKS)):
+        BENCHMARKS[name](naevroot)
@@ -6,6 +6,10 @@ The objects in this library abstract away the location of the various
 Naev data files, so that if they change in future only this library
 needs to be updated to match.
 
+The data files may be loose in a Naev source tree, or packed in a zip or
+tar archive (such as a Naev ndata file). Each kind of location has its
+own data source class, and data_source() picks the right one.
+
 '''
 
 # Copyright © 2012 Tim Pederick.
@@ -24,8 +28,21 @@ needs to be updated to match.
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 # Standard library imports.
-import glob
+from concurrent.futures import ProcessPoolExecutor
+import fnmatch
+import hashlib
 import os
+import sqlite3
+import struct
+import sys
+import tarfile
+import tempfile
+import time
+import zipfile
+
+# Local imports.
+import naevdata
+from parsecache import ParseCache, fingerprint
 
 # The main Naev data directory.
 DATA_ROOT = 'dat'
@@ -35,6 +52,244 @@ DATA_ROOT = 'dat'
 DATA_LOCS = {'SSystems': ('ssys', '*.xml'),
              'Assets': ('assets', '*.xml')}
 
+# The naevdata class that each type of data file is parsed into.
+DATA_CLASSES = {'SSystems': naevdata.SSystem,
+                'Assets': naevdata.Asset}
+
+# Datasets with fewer files than this are loaded serially, since starting up
+# a process pool would take longer than it saves.
+PARALLEL_THRESHOLD = 64
+
+# Data sources already set up, by location, so that an archive's index is
+# only read once.
+_sources = {}
+
+# The data source used by a worker process, set when the worker starts.
+_worker_source = None
+
+
+class DirectorySource:
+    '''Data files kept loose in a Naev source tree.
+
+    Data files are named by their path, e.g. './dat/ssys/sol.xml'.
+
+    Instance attributes:
+        root -- The root of the Naev source tree.
+
+    '''
+    def __init__(self, root):
+        '''Set up the data source.
+
+        Keyword arguments:
+            root -- As the instance attribute.
+
+        '''
+        self.root = root
+
+    def files(self, dat_dir, pattern):
+        '''List the data files in one data directory.
+
+        Keyword arguments:
+            dat_dir, pattern -- The directory (under DATA_ROOT) and
+                filename pattern, as given in DATA_LOCS.
+        Returns:
+            A list of the names of the matching data files.
+
+        '''
+        fulldir = os.path.join(self.root, DATA_ROOT, dat_dir)
+        try:
+            with os.scandir(fulldir) as entries:
+                # Like glob, skip hidden files.
+                return [entry.path for entry in entries
+                        if not entry.name.startswith('.') and
+                        fnmatch.fnmatch(entry.name, pattern) and
+                        entry.is_file()]
+        except (FileNotFoundError, NotADirectoryError):
+            raise IOError("could not find data directory at "
+                          "'{}'".format(fulldir))
+
+    def open(self, filename):
+        '''Open a data file for reading in binary mode.'''
+        return open(filename, 'rb')
+
+    def fingerprint(self, filename, hash_contents=False):
+        '''Fingerprint a data file, as for parsecache.fingerprint().'''
+        return fingerprint(filename, hash_contents)
+
+    def close(self):
+        '''Release any resources held. Directories don't hold any.'''
+        pass
+
+
+class ArchiveSource:
+    '''Data files packed in a zip or tar archive, such as Naev's ndata.
+
+    The archive's index (a zip file's central directory, or a tar file's
+    member headers) is read once, and each member is only read when it
+    is opened. Nothing is extracted to disk. The data directory may be
+    at the top of the archive, or inside a single containing directory.
+
+    Data files are named by joining the archive's location with the
+    member's name, e.g. 'ndata.zip/dat/ssys/sol.xml'.
+
+    Note that a compressed tar archive must be decompressed from the
+    start to reach each member, so zip files and uncompressed tar files
+    are much faster to read from.
+
+    Instance attributes:
+        path -- The location of the archive.
+
+    '''
+    def __init__(self, path):
+        '''Set up the data source. The archive isn't opened yet.
+
+        Keyword arguments:
+            path -- As the instance attribute.
+
+        '''
+        self.path = path
+        self._archive = None
+        self._members = None
+        self._stat = None
+
+    def __getstate__(self):
+        # Open archives can't be pickled (e.g. to send them to a worker
+        # process). The index can, and saves the worker from reading it.
+        state = self.__dict__.copy()
+        state['_archive'] = None
+        return state
+
+    def _open_archive(self):
+        '''Open the archive, if it isn't already.'''
+        if self._archive is None:
+            if zipfile.is_zipfile(self.path):
+                self._archive = zipfile.ZipFile(self.path)
+            else:
+                self._archive = tarfile.open(self.path)
+        return self._archive
+
+    def _index(self):
+        '''Get a mapping of data file names to archive members.
+
+        The index is read again if the archive has changed.
+
+        '''
+        stat = os.stat(self.path)
+        stat = (stat.st_mtime_ns, stat.st_size)
+        if self._members is not None and stat == self._stat:
+            return self._members
+
+        self.close()
+        archive = self._open_archive()
+        if isinstance(archive, zipfile.ZipFile):
+            members = [(info.filename, info) for info in archive.infolist()
+                       if not info.is_dir()]
+        else:
+            members = [(info.name, info) for info in archive.getmembers()
+                       if info.isfile()]
+        self._members = {}
+        for name, info in members:
+            if name.startswith('./'):
+                name = name[2:]
+            self._members[os.path.join(self.path, name)] = (name, info)
+        self._stat = stat
+        return self._members
+
+    def files(self, dat_dir, pattern):
+        '''List the data files in one data directory.
+
+        Keyword arguments:
+            dat_dir, pattern -- The directory (under DATA_ROOT) and
+                filename pattern, as given in DATA_LOCS.
+        Returns:
+            A list of the names of the matching data files.
+
+        '''
+        wanted = '/'.join((DATA_ROOT, dat_dir))
+        found = False
+        filenames = []
+        for filename, (name, info) in self._index().items():
+            head, _, base = name.rpartition('/')
+            if head != wanted and head.partition('/')[2] != wanted:
+                # Neither at the top nor inside a single directory.
+                continue
+            found = True
+            if not base.startswith('.') and fnmatch.fnmatch(base, pattern):
+                filenames.append(filename)
+        if not found:
+            raise IOError("could not find data directory '{}' in "
+                          "'{}'".format(wanted, self.path))
+        return filenames
+
+    def open(self, filename):
+        '''Open a data file for reading in binary mode.'''
+        try:
+            name, info = self._index()[filename]
+        except KeyError:
+            raise IOError("no data file '{}' in the archive".format(filename))
+        archive = self._open_archive()
+        if isinstance(archive, zipfile.ZipFile):
+            return archive.open(info)
+        return archive.extractfile(info)
+
+    def fingerprint(self, filename, hash_contents=False):
+        '''Fingerprint a data file, as for parsecache.fingerprint().
+
+        The archive's own record of each member is used, so nothing
+        needs to be read unless hash_contents is requested. Zip members
+        always carry a checksum, which is used as the digest.
+
+        '''
+        try:
+            name, info = self._index()[filename]
+        except KeyError:
+            raise IOError("no data file '{}' in the archive".format(filename))
+        if isinstance(info, zipfile.ZipInfo):
+            mtime = int(time.mktime(info.date_time + (0, 0, -1))) * 10**9
+            return mtime, info.file_size, struct.pack('>I', info.CRC)
+
+        digest = None
+        if hash_contents:
+            with self.open(filename) as f:
+                digest = hashlib.sha1(f.read()).digest()
+        return int(info.mtime) * 10**9, info.size, digest
+
+    def close(self):
+        '''Close the archive, if it is open.'''
+        if self._archive is not None:
+            self._archive.close()
+            self._archive = None
+
+def data_source(naevroot=None):
+    '''Get the data source for a Naev source tree or data archive.
+
+    Keyword arguments:
+        naevroot -- The root of the Naev source tree, or the location of
+            a zip or tar archive of its data (e.g. ndata.zip). If
+            omitted, the current directory is used. A data source
+            object may also be given, and is returned unchanged.
+    Returns:
+        A DirectorySource or ArchiveSource instance. The same instance
+        is returned every time for the same location.
+
+    '''
+    if naevroot is None:
+        naevroot = os.curdir
+    if not isinstance(naevroot, str):
+        # Already a data source.
+        return naevroot
+
+    try:
+        return _sources[naevroot]
+    except KeyError:
+        pass
+    if os.path.isfile(naevroot):
+        source = ArchiveSource(naevroot)
+    else:
+        source = DirectorySource(naevroot)
+    _sources[naevroot] = source
+    return source
+
 def datafiles(dataset, naevroot=None):
     '''Provide an iterator to run through data files.
 
@@ -43,19 +298,258 @@ def datafiles(dataset, naevroot=None):
             sets are listed in the DATA_LOCS mapping, and include
             'SSystems' (star systems) and 'Assets' (planets, stations,
             and virtual holdings).
-        naevroot -- The root of the Naev source tree. If omitted, the
-            current directory is used.
+        naevroot -- The root of the Naev source tree, or an archive of
+            its data, as for data_source(). If omitted, the current
+            directory is used.
 
     '''
-    if naevroot is None:
-        naevroot = os.curdir
-
     # If the dataset argument is not a known or valid data type, a KeyError
     # will result. Let it propagate upwards.
     dat_dir, dat_pattern = DATA_LOCS[dataset]
 
-    fulldir = os.path.join(naevroot, DATA_ROOT, dat_dir)
-    if not os.path.exists(fulldir):
-        raise IOError("could not find data directory at '{}'".format(fulldir))
+    return data_source(naevroot).files(dat_dir, dat_pattern)
+
+def temp_file(filename):
+    '''Create a temporary file to be renamed into place as another.
+
+    The temporary file is uniquely named, so that concurrent writers
+    can't clash, and is in the same directory as the file it will
+    replace, so that os.replace() can swap it in atomically. Unlike
+    with tempfile.mkstemp() alone, it gets the permissions that a newly
+    created file would (as set by the umask), since they are kept when
+    it is renamed.
+
+    Keyword arguments:
+        filename -- The name of the file the temporary file will
+            replace.
+    Returns:
+        A 2-tuple of an open OS-level file descriptor for the temporary
+        file, and its name.
+
+    '''
+    fd, tempname = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(filename)), suffix='.tmp')
+    try:
+        # The umask can only be read by setting it.
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(tempname, 0o666 & ~umask)
+    except BaseException:
+        os.close(fd)
+        os.remove(tempname)
+        raise
+    return fd, tempname
+
+def data_root(argv):
+    '''Check for, and remove, a --data option in a command line.
+
+    Keyword arguments:
+        argv -- A list of command-line arguments, e.g. sys.argv. If the
+            option is present, it and its value are removed from the
+            list.
+    Returns:
+        The value of the --data option (the root of a Naev source tree,
+        or an archive of its data), or None if it wasn't given. If the
+        option is given without a value, a usage message is printed and
+        the program exits.
+
+    '''
+    try:
+        index = argv.index('--data')
+    except ValueError:
+        return None
+    try:
+        root = argv[index + 1]
+    except IndexError:
+        program = os.path.splitext(os.path.basename(argv[0]))[0]
+        print('Usage: {} --data PATH'.format(program), file=sys.stderr)
+        sys.exit(2)
+    del argv[index:index + 2]
+    return root
+
+def _load_file(source, dataset, filename, options):
+    '''Parse one data file, capturing rather than raising any error.
+
+    The options argument is a mapping of keyword arguments to pass to
+    the naevdata class constructor.
+
+    Returns a 2-tuple of the parsed object and None on success, or of
+    None and the exception raised on failure.
+
+    '''
+    try:
+        with source.open(filename) as f:
+            return DATA_CLASSES[dataset](f, **options), None
+    except Exception as err:
+        return None, err
+
+def _init_worker(source):
+    '''Set up a worker process to read from a data source.'''
+    global _worker_source
+    _worker_source = source
+
+def _load_chunk(dataset, filenames, options):
+    '''Parse a list of data files in a worker process.'''
+    return [_load_file(_worker_source, dataset, filename, options)
+            for filename in filenames]
+
+def use_cache(argv):
+    '''Check for, and remove, a --no-cache option in a command line.
+
+    Keyword arguments:
+        argv -- A list of command-line arguments, e.g. sys.argv. If the
+            option is present, it is removed from the list.
+    Returns:
+        False if the --no-cache option was given, True otherwise.
+
+    '''
+    if '--no-cache' in argv:
+        argv.remove('--no-cache')
+        return False
+    return True
+
+def _parse_options(dataset, parser=None, lazy=False):
+    '''Get the constructor arguments for parsing a dataset's files.
+
+    Raises ValueError if the dataset can't be loaded lazily but lazy is
+    true.
+
+    '''
+    options = {'parser': parser}
+    if lazy:
+        if DATA_CLASSES[dataset] is not naevdata.Asset:
+            raise ValueError("dataset '{}' cannot be loaded "
+                             "lazily".format(dataset))
+        options['lazy'] = True
+    return options
+
+def parse_files(source, dataset, filenames, workers=None, parser=None,
+                lazy=False):
+    '''Parse a list of data files, in parallel if it's worthwhile.
+
+    Unlike load_dataset(), this parses exactly the files given, without
+    consulting the parse cache, and reports the files that fail to
+    parse alongside those that don't.
+
+    Keyword arguments:
+        source -- The data source to read the files from, as given by
+            data_source().
+        dataset -- The name of the dataset the files belong to (see
+            DATA_LOCS).
+        filenames -- A list of the names of the files, as given by
+            datafiles().
+        workers, parser, lazy -- As for load_dataset().
+    Returns:
+        A list of 2-tuples, in the same order as the filenames: the
+        parsed object and None for each file that parsed, or None and
+        the exception raised for each file that failed.
+
+    '''
+    options = _parse_options(dataset, parser, lazy)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = min(workers, len(filenames))
+
+    if workers <= 1 or len(filenames) < PARALLEL_THRESHOLD:
+        return [_load_file(source, dataset, filename, options)
+                for filename in filenames]
+
+    # Hand each worker a few contiguous chunks, to keep the pickling overhead
+    # down while still balancing the load.
+    chunk_size = -(-len(filenames) // (workers * 4))
+    chunks = [filenames[i:i + chunk_size]
+              for i in range(0, len(filenames), chunk_size)]
+    results = []
+    with ProcessPoolExecutor(workers, initializer=_init_worker,
+                             initargs=(source,)) as pool:
+        for chunk_results in pool.map(_load_chunk, [dataset] * len(chunks),
+                                      chunks, [options] * len(chunks)):
+            results.extend(chunk_results)
+    return results
+
+def load_dataset(dataset, naevroot=None, workers=None, parser=None,
+                 errors=None, cache=True, lazy=False, loaded_from=None):
+    '''Parse all of the data files in a dataset.
+
+    The files are spread across a pool of worker processes, unless there
+    are too few of them (see PARALLEL_THRESHOLD) or only one worker is
+    requested. Either way, the results come back in order of filename,
+    so that the output doesn't depend on how the work was shared out.
+
+    A file that fails to parse doesn't stop the others from loading; it
+    is just left out of the results.
+
+    Unless disabled, a persistent parse cache is consulted first, and
+    only files that are new or have changed since they were cached are
+    actually parsed.
+
+    Keyword arguments:
+        dataset, naevroot -- As for datafiles().
+        workers -- The number of worker processes to use. If omitted,
+            one per CPU is used.
+        parser -- The XML parser backend to use, as for the naevdata
+            classes. If omitted, the naevdata default is used.
+        errors -- A list to which a 2-tuple of filename and exception is
+            appended for each file that fails to parse. If omitted, the
+            failures are reported on standard error instead.
+        cache -- An open parsecache.ParseCache to use, True (the
+            default) to use one at the default location, or False to
+            parse every file regardless.
+        lazy -- Whether or not to load the objects lazily, as described
+            for naevdata.Asset. Only assets can be loaded lazily. The
+            default is False.
+        loaded_from -- A list to which the filename of each object
+            loaded is appended, in the same order as the objects. If
+            omitted, the filenames are not reported.
+    Returns:
+        A list of naevdata.SSystem or naevdata.Asset instances.
+
+    '''
+    # Check the options up front, even if every file turns out to be
+    # cached.
+    _parse_options(dataset, parser, lazy)
+    # Lazy and fully loaded objects are cached separately.
+    cache_key = dataset + ' (lazy)' if lazy else dataset
+    source = data_source(naevroot)
+    filenames = sorted(datafiles(dataset, source))
+
+    own_cache = cache is True
+    if own_cache:
+        try:
+            cache = ParseCache()
+        except (OSError, sqlite3.Error) as err:
+            print('Could not open the parse cache: {}. '
+                  'Continuing without it.'.format(err), file=sys.stderr)
+            own_cache = cache = False
+    try:
+        cached = ({} if not cache else
+                  cache.lookup(cache_key, filenames, source))
+        to_parse = [filename for filename in filenames
+                    if filename not in cached]
+        parsed = dict(zip(to_parse,
+                          parse_files(source, dataset, to_parse, workers,
+                                      parser, lazy)))
+        if cache:
+            cache.store(cache_key, ((filename, obj)
+                                  for filename, (obj, err) in parsed.items()
+                                  if err is None), source)
+    finally:
+        if own_cache:
+            cache.close()
 
-    return glob.glob(os.path.join(fulldir, dat_pattern))
+    loaded = []
+    for filename in filenames:
+        if filename in cached:
+            obj, err = cached[filename], None
+        else:
+            obj, err = parsed[filename]
+        if err is None:
+            loaded.append(obj)
+            if loaded_from is not None:
+                loaded_from.append(filename)
+        elif errors is None:
+            print("Could not load '{}': {}. Skipped!".format(filename, err),
+                  file=sys.stderr)
+        else:
+            errors.append((filename, err))
+    return loaded
@@ -7,6 +7,11 @@ reads the XML files in dat/ssys/ and dat/assets/ and gives details of
 the ranges of values for certain statistics. Example usage:
     user@home:~/naev/$ dataranges
 
+Parsed data files are cached between runs; pass --no-cache to bypass
+the cache and parse every file afresh. To read the data from an archive
+(such as ndata) or another Naev source tree, pass --data and its
+location.
+
 '''
 
 # Copyright © 2012 Tim Pederick, 2013 Johann Bryant.
@@ -25,20 +30,21 @@ the ranges of values for certain statistics. Example usage:
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 
 # Standard library imports.
+from collections import Counter
 import math
+import sys
+
+# Third-party imports.
+import numpy as np
 
 # Local imports.
-from dataloader import datafiles
-from naevdata import SSystem, Asset
+from dataloader import data_root, use_cache
+from snapshot import cached_universe
 
 def stats(iterable):
     '''Find the mean and standard deviation of a data set.'''
-    mean = sum(iterable) / len(iterable)
-    sq_dists = list((i - mean) ** 2 for i in iterable)
-    variance = sum(sq_dists) / len(sq_dists)
-    std_dev = math.sqrt(variance)
-
-    return mean, std_dev
+    values = np.asarray(iterable, dtype=float)
+    return values.mean(), values.std()
 
 def liststr(items):
     '''Format a list with commas and 'and'.'''
@@ -49,118 +55,88 @@ def liststr(items):
                 ' and ' + str(items[-1]))
 
 def hypot(x, y):
-    '''Find the straightline distance of an asset in space.'''
-    length = math.sqrt((x*x)+(y*y))
+    '''Find the straightline distance of an asset in space.
+
+    The coordinates may be given as arrays, to find many distances.
+
+    '''
+    length = np.sqrt((x*x)+(y*y))
 
     return length
 
-def main():
-    ssystems = []
-    for ssysfile in datafiles('SSystems'):
-        # Parse each XML file into a SSystem object.
-        ssystems.append(SSystem(ssysfile))
-
-    neb_densest_at, neb_density, neb_densities = [], 0.0, []
-    neb_worst_at, neb_volatility, neb_volatilities = [], 0.0, []
-    int_worst_at, interference, interferences = [], 0.0, []
-
-    largest_system, hi_radius, radii = [], 0.0, []
-    smallest_system, lo_radius = [], float('Inf')
-
-    most_stars_at, most_stars, stars = [], 0, []
-    least_stars_at, least_stars = [], float('Inf')
-
-    most_jumps_at, most_jumps, jumps = [], 0, []
-    least_jumps_at, least_jumps = [], float('Inf')
-    zero_jumps_at = []
-
-    most_planets_at, most_planets, planets = [], 0, []
-    least_planets_at, least_planets = [], float('Inf')
-    zero_planets_at = []
-
-    for ssys in ssystems:
-        neb_densities.append(ssys.nebula.density)
-        if ssys.nebula.density > neb_density:
-            neb_densest_at, neb_density = [ssys.name], ssys.nebula.density
-        elif ssys.nebula.density == neb_density:
-            neb_densest_at.append(ssys.name)
-        # ...else this isn't a candidate for the densest nebula.
-
-        neb_volatilities.append(ssys.nebula.volatility)
-        if ssys.nebula.volatility > neb_volatility:
-            neb_worst_at, neb_volatility = [ssys.name], ssys.nebula.volatility
-        elif ssys.nebula.volatility == neb_volatility:
-            neb_worst_at.append(ssys.name)
-        # ...else this isn't a candidate for the most dangerous nebula.
-
-        interferences.append(ssys.interference)
-        if ssys.interference > interference:
-            int_worst_at, interference = [ssys.name], ssys.interference
-        elif ssys.interference == interference:
-            int_worst_at.append(ssys.name)
-        # ...else this isn't a candidate for the highest interference.
-
-        radii.append(ssys.radius)
-        if ssys.radius > hi_radius:
-            largest_system, hi_radius = [ssys.name], ssys.radius
-        elif ssys.radius == hi_radius:
-            largest_system.append(ssys.name)
-        # ...else this isn't a candidate for the largest system.
-        if ssys.radius < lo_radius:
-            smallest_system, lo_radius = [ssys.name], ssys.radius
-        elif ssys.radius == lo_radius:
-            smallest_system.append(ssys.name)
-        # ...else this isn't a candidate for the smallest system.
-
-        stars.append(ssys.stars)
-        if ssys.stars > most_stars:
-            most_stars_at, most_stars = [ssys.name], ssys.stars
-        elif ssys.stars == most_stars:
-            most_stars_at.append(ssys.name)
-        # ...else this isn't a candidate for the starriest system.
-        if ssys.stars < least_stars:
-            least_stars_at, least_stars = [ssys.name], ssys.stars
-        elif ssys.stars == least_stars:
-            least_stars_at.append(ssys.name)
-        # ...else this isn't a candidate for the least starry system.
-
-        jump_num = len(ssys.jumps)
-        jumps.append(jump_num)
-        if jump_num > most_jumps:
-            most_jumps_at, most_jumps = [ssys.name], jump_num
-        elif jump_num == most_jumps:
-            most_jumps_at.append(ssys.name)
-        # ...else this isn't a candidate for the system with the most jumps.
-        if jump_num == 0:
-            zero_jumps_at.append(ssys.name)
-        # ...else this isn't a system with zero jumps.
-        else:
-            if jump_num < least_jumps:
-                least_jumps_at, least_jumps = [ssys.name], jump_num
-            elif jump_num == least_jumps:
-                least_jumps_at.append(ssys.name)
-        # ...else this isn't a candidate for the system with the least jumps.
-
-        planet_num = 0
-        for asset in ssys.assets:
-            if not (asset.find('Virtual') + 1):
-                planet_num = planet_num + 1
-        # ...else this asset is Virtual.
-        planets.append(planet_num)
-        if planet_num > most_planets:
-            most_planets_at, most_planets = [ssys.name], planet_num
-        elif planet_num == most_planets:
-            most_planets_at.append(ssys.name)
-        # ...else this isn't a candidate for the system with the most planets.
-        if planet_num == 0:
-            zero_planets_at.append(ssys.name)
-        # ...else this isn't a system with zero planets.
-        else:
-            if planet_num < least_planets:
-                least_planets_at, least_planets = [ssys.name], planet_num
-            elif planet_num == least_planets:
-                least_planets_at.append(ssys.name)
-        # ...else this isn't a candidate for the system with the least planets.
+def highest(values, names, floor=0):
+    '''Find the highest value in a column, and where it can be found.
+
+    Keyword arguments:
+        values -- An array of values.
+        names -- A sequence of the names corresponding to the values.
+        floor -- A value to report if none are higher. The default is 0.
+    Returns:
+        A 2-tuple of the highest value and a list of the names of all
+        entries that have it.
+
+    '''
+    peak = values.max() if len(values) else floor
+    if peak < floor:
+        return floor, []
+    return peak, [names[i] for i in np.flatnonzero(values == peak).tolist()]
+
+def lowest(values, names):
+    '''Find the lowest value in a column, and where it can be found.
+
+    Keyword arguments:
+        values -- An array of values.
+        names -- A sequence of the names corresponding to the values.
+    Returns:
+        A 2-tuple of the lowest value (infinity, if there are none) and
+        a list of the names of all entries that have it.
+
+    '''
+    if not len(values):
+        return float('Inf'), []
+    trough = values.min()
+    return trough, [names[i]
+                    for i in np.flatnonzero(values == trough).tolist()]
+
+def main(cache=True, naevroot=None):
+    universe = cached_universe(naevroot, cache)
+    names = universe.ssys_names
+
+    neb_densities = universe.ssys_nebula_density
+    neb_density, neb_densest_at = highest(neb_densities, names)
+    neb_volatilities = universe.ssys_nebula_volatility
+    neb_volatility, neb_worst_at = highest(neb_volatilities, names)
+    interferences = universe.ssys_interference
+    interference, int_worst_at = highest(interferences, names)
+
+    radii = universe.ssys_radius
+    hi_radius, largest_system = highest(radii, names)
+    lo_radius, smallest_system = lowest(radii, names)
+
+    stars = universe.ssys_stars
+    most_stars, most_stars_at = highest(stars, names)
+    least_stars, least_stars_at = lowest(stars, names)
+
+    jumps = universe.jump_counts()
+    most_jumps, most_jumps_at = highest(jumps, names)
+    # Systems with no jumps at all are listed separately.
+    has_jumps = jumps > 0
+    least_jumps, least_jumps_at = lowest(jumps[has_jumps],
+                                         list(np.array(names)[has_jumps]))
+    zero_jumps_at = [names[i] for i in np.flatnonzero(~has_jumps).tolist()]
+
+    # Count the assets in each system that aren't virtual.
+    is_planet = np.array(['Virtual' not in name
+                          for name in universe.member_names()], dtype=bool)
+    planets = np.bincount(universe.member_ssys[is_planet],
+                          minlength=len(universe))
+    most_planets, most_planets_at = highest(planets, names)
+    # Systems with no planets at all are listed separately.
+    has_planets = planets > 0
+    least_planets, least_planets_at = lowest(
+        planets[has_planets], list(np.array(names)[has_planets]))
+    zero_planets_at = [names[i]
+                       for i in np.flatnonzero(~has_planets).tolist()]
 
     print('Radius: μ={}, σ={}'.format(*stats(radii)))
     print('The largest system radius',
@@ -201,85 +177,37 @@ def main():
     print('There are zero planets in {} systems.'.format(len(zero_planets_at)))
     print()
 
-    assets = []
-    for assetsfile in datafiles('Assets'):
-        # Parse each XML file into a Asset object.
-        assets.append(Asset(assetsfile))
-
-    furthest, hi_orbit, orbits = [], 0.0, []
-    nearest, lo_orbit = [], float('Inf')
-
-    best_hidden, hi_hide, hides = [], 0.0, []
-    worst_hidden, lo_hide = [], float('Inf')
-    
-    most_pop, hi_pop, pops = [], 0.0, []
-    least_pop, lo_pop, total_pops = [], float('Inf'), []
-
-    world_classes, class_matches = dict(), dict()
-    
-    for asset in assets:
-        if not asset.virtual:
-            orbit = hypot(asset.pos.x, asset.pos.y)
-            orbits.append(orbit)
-            if orbit > hi_orbit:
-                furthest, hi_orbit = [asset.name], orbit
-            elif orbit == hi_orbit:
-                furthest.append(asset.name)
-            # ...else this isn't a candidate for the biggest orbit.
-            if orbit < lo_orbit:
-                nearest, lo_orbit = [asset.name], orbit
-            elif orbit == lo_orbit:
-                nearest.append(asset.name)
-            # ...else this isn't a candidate for the smallest orbit.
-
-            hides.append(asset.hide)
-            if asset.hide > hi_hide:
-                best_hidden, hi_hide = [asset.name], asset.hide
-            elif asset.hide == hi_hide:
-                best_hidden.append(asset.name)
-            # ...else this isn't a candidate for the best hidden.
-            if asset.hide < lo_hide:
-                worst_hidden, lo_hide = [asset.name], asset.hide
-            elif asset.hide == lo_hide:
-                worst_hidden.append(asset.name)
-            # ...else this isn't a candidate for the least hidden.
-
-            if asset.world_class in world_classes:
-                world_classes[asset.world_class] += 1
-            else:
-                world_classes.update({asset.world_class: 1,})
-            if asset.world_class.isalpha:
-                if asset.gfx['space'][0] == asset.world_class:
-                    if asset.world_class in class_matches:
-                        class_matches[asset.world_class] += 1
-                    else:
-                        class_matches.update({asset.world_class: 1,})
-                elif asset.gfx['space'][5] ==  asset.world_class:
-                    if asset.world_class in class_matches:
-                        class_matches[asset.world_class] += 1
-                    else:
-                        class_matches.update({asset.world_class: 1,})
-                elif asset.gfx['space'][0] == 'a': 
-                    if asset.gfx['space'][9] ==  asset.world_class:
-                        if asset.world_class in class_matches:
-                            class_matches[asset.world_class] += 1
-                        else:
-                            class_matches.update({asset.world_class: 1,})
-            # ...else world class doesn't match the planet, moon or asteroid space graphic
-
-            total_pops.append(asset.population)
-            if asset.population > 0:
-                pops.append(asset.population)
-                if asset.population > hi_pop:
-                    most_pop, hi_pop = [asset.name], asset.population
-                elif asset.population == hi_pop:
-                    most_pop.append(asset.name)
-                # ...else this isn't a candidate for the biggest population.
-                if asset.population < lo_pop:
-                    least_pop, lo_pop = [asset.name], asset.population
-                elif asset.population == lo_pop:
-                    least_pop.append(asset.name)
-                # ...else this isn't a candidate for the smallest population.
+    # Consider only the assets that aren't virtual.
+    real = ~universe.asset_virtual
+    asset_names = [name for name, is_real
+                   in zip(universe.asset_names, real.tolist()) if is_real]
+
+    orbits = hypot(universe.asset_x[real], universe.asset_y[real])
+    hi_orbit, furthest = highest(orbits, asset_names, 0.0)
+    lo_orbit, nearest = lowest(orbits, asset_names)
+
+    hides = universe.asset_hide[real]
+    hi_hide, best_hidden = highest(hides, asset_names, 0.0)
+    lo_hide, worst_hidden = lowest(hides, asset_names)
+
+    total_pops = universe.asset_population[real]
+    inhabited = total_pops > 0
+    pops = total_pops[inhabited]
+    inhabited_names = list(np.array(asset_names)[inhabited])
+    hi_pop, most_pop = highest(pops, inhabited_names, 0.0)
+    lo_pop, least_pop = lowest(pops, inhabited_names)
+
+    world_classes, class_matches = Counter(), Counter()
+    for world_class, gfx, is_real in zip(universe.asset_class,
+                                         universe.asset_gfx, real.tolist()):
+        if not is_real:
+            continue
+        world_classes[world_class] += 1
+        space = gfx['space']
+        if (space[0] == world_class or space[5] == world_class or
+            (space[0] == 'a' and space[9] == world_class)):
+            class_matches[world_class] += 1
+        # ...else world class doesn't match the planet, moon or asteroid space graphic
 
     print('Orbit: μ={}, σ={}'.format(*stats(orbits)))
     print('The biggest orbit',
@@ -329,4 +257,5 @@ def main():
     print()
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    cache = use_cache(sys.argv)
+    main(cache, data_root(sys.argv))
\ No newline at end of file
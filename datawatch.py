@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+
+'''Incremental reloading of Naev data files.
+
+The DataWatcher in this library keeps the parsed data files resident in
+memory and watches the data directories for changes. Only files that
+are added or modified are parsed again, and each change is reported as
+an event, so that tools can regenerate their outputs straight away.
+
+Run this script from the root directory of your Naev source tree to
+print the events as they happen. Example usage:
+    user@home:~/naev/$ datawatch
+
+The directories are polled for changes, unless the inotify_simple
+package <https://pypi.org/project/inotify_simple/> is installed, in
+which case inotify is used to wait for them instead.
+
+'''
+
+# Copyright © 2012 Tim Pederick.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Standard library imports.
+from collections import namedtuple
+import os
+import sys
+import time
+
+# Third-party imports.
+try:
+    import inotify_simple
+except ImportError:
+    inotify_simple = None
+
+# Local imports.
+from dataloader import (DATA_LOCS, DATA_ROOT, DirectorySource, data_root,
+                        data_source, datafiles, parse_files)
+from universe import Universe
+
+# The kinds of event.
+ADDED = 'add'
+UPDATED = 'update'
+REMOVED = 'remove'
+
+# A change to one data file. The kind is one of ADDED, UPDATED, or REMOVED;
+# obj is the newly parsed object, or the old one if the file was removed.
+Event = namedtuple('Event', 'kind dataset filename obj')
+
+# How long to wait after the first inotify event for any others that are
+# part of the same change (e.g. an editor writing several files), in
+# milliseconds.
+SETTLE_TIME = 50
+
+
+class DataWatcher:
+    '''Keeps the parsed data files up to date with those on disk.
+
+    Instance attributes:
+        naevroot -- The root of the Naev source tree, or an archive of
+            its data, as for dataloader.data_source().
+        datasets -- A sequence of the names of the datasets watched, as
+            for dataloader.datafiles().
+        objects -- A mapping of dataset names to mappings of filenames
+            to the objects parsed from them.
+
+    '''
+    def __init__(self, naevroot=None, datasets=('SSystems', 'Assets'),
+                 workers=None, parser=None, errors=None):
+        '''Set up the watcher. No files are read until the first scan.
+
+        Keyword arguments:
+            naevroot -- As the instance attribute. If omitted, the
+                current directory is used.
+            datasets -- As the instance attribute. Defaults to both star
+                systems and assets.
+            workers, parser, errors -- As for dataloader.load_dataset().
+
+        '''
+        self.naevroot = os.curdir if naevroot is None else naevroot
+        self._source = data_source(self.naevroot)
+        self.datasets = tuple(datasets)
+        self.objects = dict((dataset, {}) for dataset in self.datasets)
+        self._workers = workers
+        self._parser = parser
+        self._errors = errors
+        self._fingerprints = dict((dataset, {}) for dataset in self.datasets)
+        self._inotify = None
+
+    def close(self):
+        '''Stop waiting on inotify, if it was in use.'''
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def scan(self):
+        '''Check the data directories for changes, and act on them.
+
+        Added and modified files are parsed (in parallel, if there are
+        enough of them) and removed files are forgotten. A file that
+        fails to parse is treated as removed until it is fixed.
+
+        Returns:
+            A list of Event instances, in order of dataset and filename.
+            The first scan reports every file as added.
+
+        '''
+        events = []
+        for dataset in self.datasets:
+            known = self.objects[dataset]
+            fingerprints = self._fingerprints[dataset]
+            current = {}
+            for filename in datafiles(dataset, self._source):
+                try:
+                    current[filename] = self._source.fingerprint(filename)
+                except OSError:
+                    # Vanished since it was listed.
+                    continue
+
+            for filename in sorted(set(fingerprints) - set(current)):
+                del fingerprints[filename]
+                if filename in known:
+                    events.append(Event(REMOVED, dataset, filename,
+                                        known.pop(filename)))
+
+            changed = sorted(filename for filename, fprint in current.items()
+                             if fingerprints.get(filename) != fprint)
+            results = parse_files(self._source, dataset, changed,
+                                  self._workers, self._parser)
+            for filename, (obj, err) in zip(changed, results):
+                fingerprints[filename] = current[filename]
+                if err is None:
+                    events.append(Event(UPDATED if filename in known
+                                        else ADDED, dataset, filename, obj))
+                    known[filename] = obj
+                    continue
+
+                if self._errors is None:
+                    print("Could not load '{}': {}. Skipped!".format(filename,
+                                                                     err),
+                          file=sys.stderr)
+                else:
+                    self._errors.append((filename, err))
+                if filename in known:
+                    events.append(Event(REMOVED, dataset, filename,
+                                        known.pop(filename)))
+        events.sort(key=lambda event: (self.datasets.index(event.dataset),
+                                       event.filename))
+        return events
+
+    def loaded(self, dataset):
+        '''Get a list of the objects in a dataset, in filename order.'''
+        objects = self.objects[dataset]
+        return [objects[filename] for filename in sorted(objects)]
+
+    def universe(self):
+        '''Build a universe.Universe from the objects currently loaded.'''
+        return Universe(self.loaded('SSystems') if 'SSystems' in self.objects
+                        else (),
+                        self.loaded('Assets') if 'Assets' in self.objects
+                        else ())
+
+    def wait(self, interval=1.0):
+        '''Wait for the data directories to (possibly) change.
+
+        With inotify, this returns as soon as anything in the data
+        directories changes, or after the interval if nothing does.
+        Without it, or when watching an archive, this just sleeps for
+        the interval.
+
+        Keyword arguments:
+            interval -- The longest time to wait, in seconds. The
+                default is one second.
+
+        '''
+        if (inotify_simple is None or
+            not isinstance(self._source, DirectorySource)):
+            time.sleep(interval)
+            return
+
+        if self._inotify is None:
+            flags = inotify_simple.flags
+            mask = (flags.CLOSE_WRITE | flags.CREATE | flags.DELETE |
+                    flags.MOVED_FROM | flags.MOVED_TO)
+            self._inotify = inotify_simple.INotify()
+            for dataset in self.datasets:
+                self._inotify.add_watch(os.path.join(
+                    self.naevroot, DATA_ROOT, DATA_LOCS[dataset][0]), mask)
+        if self._inotify.read(timeout=int(interval * 1000)):
+            # Drain anything else that belongs to the same change.
+            while self._inotify.read(timeout=SETTLE_TIME):
+                pass
+
+    def watch(self, interval=1.0):
+        '''Generate batches of events as the data files change.
+
+        The first batch holds every file, as added. After that, a batch
+        is generated whenever a scan finds any changes.
+
+        Keyword arguments:
+            interval -- As for wait().
+
+        '''
+        yield self.scan()
+        while True:
+            self.wait(interval)
+            events = self.scan()
+            if events:
+                yield events
+
+if __name__ == '__main__':
+    # Report changes until interrupted.
+    with DataWatcher(data_root(sys.argv)) as watcher:
+        try:
+            for events in watcher.watch():
+                for event in events:
+                    print(event.kind, event.dataset, event.filename)
+                sys.stdout.flush()
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,524 @@
+#!/usr/bin/env python3
+
+'''Shared, cached read access to a Naev database.
+
+A DBReader holds a pool of read-only connections to a database built by
+naevdb.py, for any number of threads to share, and remembers the results
+of recent lookups until the database changes. It suits long-running
+programs that look up the same systems over and over, such as a web
+frontend. For programs built on asyncio, an AsyncNaevDB makes the same
+lookups without blocking the event loop.
+
+Run this script with the name of a database file and the names of some
+star systems to print the faction presences in them. Example usage:
+    user@home:~/naev/$ dbreader naev.db Sol Alteris
+
+'''
+
+# Copyright © 2012 Tim Pederick.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Standard library imports.
+import asyncio
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import os
+import sqlite3 as db
+import sys
+import threading
+from urllib.request import pathname2url
+
+# Local imports.
+from naevdb import (check_schema, get_asset_id, get_effective_presence,
+                    get_ssys, get_ssys_id, get_ssys_many, get_ssys_presence,
+                    get_ssystems)
+
+# The most connections a reader opens at once, by default.
+POOL_SIZE = 4
+# The most lookup results a reader remembers, by default.
+CACHE_SIZE = 1024
+# The number of compiled statements each connection keeps for reuse. The
+# accessors in naevdb use a few dozen distinct statements between them.
+STATEMENT_CACHE_SIZE = 128
+# The number of threads an AsyncNaevDB makes its lookups on, by default.
+ASYNC_WORKERS = 2
+
+# How to make each kind of lookup for several names at once. Each is called
+# with a connection and a list of names, and returns a list of results in
+# the same order.
+BATCHED = {
+    'ssys': get_ssys_many,
+    'presence': lambda conn, names: [get_ssys_presence(conn, name)
+                                     for name in names],
+    'effective_presence': lambda conn, names: [
+        get_effective_presence(conn, name) for name in names],
+    'ssys_id': lambda conn, names: [get_ssys_id(conn, name)
+                                    for name in names],
+    # This one takes no name; None stands in for it.
+    'ssystems': lambda conn, names: [get_ssystems(conn) for name in names],
+}
+
+
+class DBReader:
+    '''Thread-safe, cached, read-only access to a Naev database.
+
+    Connections are opened read-only as they are needed, up to the pool
+    size, and lent out to one thread at a time. Each lookup is made in
+    its own short read transaction, so that it sees the database in one
+    consistent state, and so that no transaction is left open to hold
+    up anyone writing to the database (or checkpointing its write-ahead
+    log). Rows are fetched as plain tuples, the fastest form sqlite3
+    offers, and each connection keeps its compiled statements for reuse.
+
+    Before each lookup, the version of the database file (its identity,
+    modification time and size, and those of its write-ahead log, if
+    any) is checked. If the database has been updated, the remembered
+    results are forgotten. If it has been replaced, as naevdb.build_db()
+    does, the connections to the old file are closed as well, and new
+    ones are opened (and their schema version checked) as needed.
+
+    The objects returned are shared with the cache, and should be
+    treated as read-only.
+
+    Instance attributes:
+        filename -- The name of the database file.
+        pool_size -- The most connections open at once.
+        cache_size -- The most lookup results remembered.
+        hits, misses -- The number of lookups answered from the cache,
+            and from the database, so far.
+
+    '''
+    def __init__(self, filename, pool_size=POOL_SIZE, cache_size=CACHE_SIZE):
+        '''Set up the reader. No connections are opened until needed.
+
+        Keyword arguments:
+            filename -- As the instance attribute.
+            pool_size -- As the instance attribute. Defaults to
+                POOL_SIZE.
+            cache_size -- As the instance attribute. Defaults to
+                CACHE_SIZE.
+
+        '''
+        if not os.path.exists(filename):
+            raise IOError("database file '{}' does not "
+                          "exist".format(filename))
+        self.filename = filename
+        self.pool_size = pool_size
+        self.cache_size = cache_size
+        self.hits = self.misses = 0
+        self._uri = 'file:{}?mode=ro'.format(
+            pathname2url(os.path.abspath(filename)))
+        # One lock guards the pool, the cache, and the file version.
+        self._lock = threading.Lock()
+        self._returned = threading.Condition(self._lock)
+        self._idle = []
+        self._open_count = 0
+        # Bumped whenever the file is replaced, to retire the connections
+        # to the old one.
+        self._generation = 0
+        self._cache = OrderedDict()
+        self._version = None
+        self._closed = False
+
+    def close(self):
+        '''Close the idle connections, and any others as they return.'''
+        with self._lock:
+            self._closed = True
+            self._retire()
+            self._cache.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _file_version(self):
+        '''Get a token that changes whenever the database file does.'''
+        stat = os.stat(self.filename)
+        version = (stat.st_dev, stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        try:
+            wal = os.stat(self.filename + '-wal')
+        except OSError:
+            return version
+        return version + (wal.st_mtime_ns, wal.st_size)
+
+    def _retire(self):
+        '''Close the idle connections, and retire the rest.
+
+        The lock must be held when calling this.
+
+        '''
+        self._generation += 1
+        for conn in self._idle:
+            conn.close()
+        self._open_count -= len(self._idle)
+        self._idle = []
+        self._returned.notify_all()
+
+    def _check_version(self):
+        '''Forget anything out of date, if the database has changed.
+
+        The lock must be held when calling this.
+
+        Returns:
+            The current version of the database file.
+
+        '''
+        version = self._file_version()
+        if version != self._version:
+            if self._version is not None and version[:2] != self._version[:2]:
+                # A different file now has the name.
+                self._retire()
+            self._cache.clear()
+            self._version = version
+        return version
+
+    def _connect(self):
+        '''Open a new read-only connection to the database.'''
+        conn = db.connect(self._uri, uri=True, check_same_thread=False,
+                          isolation_level=None,
+                          cached_statements=STATEMENT_CACHE_SIZE)
+        try:
+            conn.execute('PRAGMA query_only = ON')
+            check_schema(conn)
+        except BaseException:
+            conn.close()
+            raise
+        return conn
+
+    @contextmanager
+    def connection(self):
+        '''Borrow a connection from the pool, for use in a with block.
+
+        If every connection is in use, and the pool is full, this waits
+        for one to be returned.
+
+        '''
+        with self._lock:
+            while True:
+                if self._closed:
+                    raise db.ProgrammingError('the reader is closed')
+                if self._idle:
+                    conn = self._idle.pop()
+                    break
+                if self._open_count < self.pool_size:
+                    conn = None
+                    self._open_count += 1
+                    break
+                self._returned.wait()
+            generation = self._generation
+
+        if conn is None:
+            try:
+                conn = self._connect()
+            except BaseException:
+                with self._lock:
+                    self._open_count -= 1
+                    self._returned.notify()
+                raise
+
+        try:
+            yield conn
+        finally:
+            with self._lock:
+                if self._closed or generation != self._generation:
+                    conn.close()
+                    self._open_count -= 1
+                else:
+                    self._idle.append(conn)
+                self._returned.notify()
+
+    def _lookup(self, key, accessor, *args):
+        '''Look something up, through the cache.
+
+        Keyword arguments:
+            key -- The key to remember the result under.
+            accessor -- The naevdb function to call on a miss. It is
+                called with a connection and the remaining arguments.
+        Returns:
+            The result of the accessor.
+
+        '''
+        with self._lock:
+            version = self._check_version()
+            try:
+                result = self._cache[key]
+            except KeyError:
+                self.misses += 1
+            else:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return result
+
+        with self.connection() as conn:
+            # Make all of the lookup's queries in one read transaction, so
+            # that they see the same state of the database.
+            conn.execute('BEGIN')
+            try:
+                result = accessor(conn, *args)
+            finally:
+                conn.execute('COMMIT')
+
+        with self._lock:
+            self._remember(version, [(key, result)])
+        return result
+
+    def _remember(self, version, items):
+        '''Remember lookup results, evicting the least recently used.
+
+        The lock must be held when calling this.
+
+        Keyword arguments:
+            version -- The version of the database file the results came
+                from. If it has changed since, they aren't remembered.
+            items -- A sequence of 2-tuples of keys and results.
+
+        '''
+        if not self.cache_size or version != self._version:
+            return
+        for key, result in items:
+            self._cache[key] = result
+            self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def get_many(self, names, kind='ssys'):
+        '''Make one kind of lookup for several names at once.
+
+        Those not remembered are looked up together, in one transaction
+        on one connection. Star systems are read with get_ssys_many(),
+        in a handful of queries however many there are.
+
+        Keyword arguments:
+            names -- A sequence of the names to look up.
+            kind -- The kind of lookup, as named in BATCHED. The default
+                is 'ssys', for star systems.
+        Returns:
+            A list of the results, in the same order as the names.
+
+        '''
+        fetch = BATCHED[kind]
+        results = {}
+        with self._lock:
+            version = self._check_version()
+            for name in names:
+                key = (kind, name)
+                if key in self._cache:
+                    results[name] = self._cache[key]
+                    self._cache.move_to_end(key)
+                    self.hits += 1
+            missing = [name for name in dict.fromkeys(names)
+                       if name not in results]
+            self.misses += len(missing)
+
+        if missing:
+            with self.connection() as conn:
+                conn.execute('BEGIN')
+                try:
+                    fetched = fetch(conn, missing)
+                finally:
+                    conn.execute('COMMIT')
+            results.update(zip(missing, fetched))
+            with self._lock:
+                self._remember(version, [((kind, name), results[name])
+                                         for name in missing])
+        return [results[name] for name in names]
+
+    def clear_cache(self):
+        '''Forget all of the lookup results remembered.'''
+        with self._lock:
+            self._cache.clear()
+
+    def get_ssys(self, name):
+        '''Get the named star system, as for naevdb.get_ssys().'''
+        return self._lookup(('ssys', name), get_ssys, name)
+
+    def get_ssystems(self):
+        '''Get all of the star systems, as for naevdb.get_ssystems().'''
+        return self._lookup(('ssystems', None), get_ssystems)
+
+    def get_ssys_presence(self, name):
+        '''Get the faction presences in the named star system.'''
+        return self._lookup(('presence', name), get_ssys_presence, name)
+
+    def get_effective_presence(self, name):
+        '''Get the effective faction presences in the named star system.'''
+        return self._lookup(('effective_presence', name),
+                            get_effective_presence, name)
+
+    def get_ssys_id(self, name):
+        '''Get the ID of the named star system, or None if unknown.'''
+        return self._lookup(('ssys_id', name), get_ssys_id, name)
+
+    def get_asset_id(self, name, is_virtual=None):
+        '''Get the ID of the named asset, as for naevdb.get_asset_id().'''
+        return self._lookup(('asset_id', name, is_virtual), get_asset_id,
+                            name, is_virtual)
+
+
+
+class AsyncNaevDB:
+    '''asyncio access to a Naev database.
+
+    The lookups are made through a DBReader, on a small executor of the
+    database's own, so that they never block the event loop (nor wait
+    behind anything else using the loop's default executor).
+
+    Identical lookups share one result while it is on its way, and all
+    of the lookups of one kind requested before the event loop next
+    gets round to them are made together, with one call to the reader's
+    get_many(). A burst of hundreds of requests thus takes a handful of
+    trips to the executor and the database, not hundreds.
+
+    An instance should only be used from one event loop.
+
+    Instance attributes:
+        reader -- The DBReader making the lookups.
+
+    '''
+    def __init__(self, filename, workers=ASYNC_WORKERS,
+                 cache_size=CACHE_SIZE):
+        '''Set up the database access.
+
+        Keyword arguments:
+            filename -- The name of the database file.
+            workers -- The number of threads to make lookups on, and the
+                number of connections to open. Defaults to ASYNC_WORKERS.
+            cache_size -- As for DBReader.
+
+        '''
+        self.reader = DBReader(filename, pool_size=workers,
+                               cache_size=cache_size)
+        self._executor = ThreadPoolExecutor(workers,
+                                            thread_name_prefix='naevdb')
+        # The shared future for each lookup on its way, by kind and name.
+        self._in_flight = {}
+        # The names of each kind of lookup waiting to be made.
+        self._batches = {}
+
+    def close(self):
+        '''Wait for any lookups under way, then close the database.
+
+        This blocks until the lookups are done, so it shouldn't be
+        called from a running event loop; use aclose() there instead.
+
+        '''
+        self._executor.shutdown(wait=True)
+        self.reader.close()
+
+    async def aclose(self):
+        '''Wait for any lookups under way, then close the database.
+
+        Unlike close(), this leaves the event loop free to run while it
+        waits. Lookups requested while it waits are waited for too.
+
+        '''
+        while self._in_flight:
+            await asyncio.wait(list(self._in_flight.values()))
+        await asyncio.get_running_loop().run_in_executor(None, self.close)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.aclose()
+
+    def _request(self, kind, name):
+        '''Request a lookup, joining an identical one if under way.
+
+        Returns:
+            An awaitable for the result.
+
+        '''
+        key = (kind, name)
+        future = self._in_flight.get(key)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = self._in_flight[key] = loop.create_future()
+            batch = self._batches.get(kind)
+            if batch is None:
+                batch = self._batches[kind] = []
+                loop.call_soon(self._dispatch, loop, kind)
+            batch.append(name)
+        # One caller giving up shouldn't cancel the lookup for the rest.
+        return asyncio.shield(future)
+
+    def _dispatch(self, loop, kind):
+        '''Send a batch of lookups off to the executor.'''
+        names = self._batches.pop(kind)
+        job = loop.run_in_executor(self._executor, self.reader.get_many,
+                                   names, kind)
+        job.add_done_callback(lambda job: self._settle(kind, names, job))
+
+    def _settle(self, kind, names, job):
+        '''Pass the results of a batch of lookups on to their callers.'''
+        futures = [self._in_flight.pop((kind, name)) for name in names]
+        if job.cancelled():
+            for future in futures:
+                future.cancel()
+        elif job.exception() is not None:
+            for future in futures:
+                future.set_exception(job.exception())
+        else:
+            for future, result in zip(futures, job.result()):
+                future.set_result(result)
+
+    async def get_ssys(self, name):
+        '''Get the named star system, as for naevdb.get_ssys().'''
+        return await self._request('ssys', name)
+
+    async def get_ssystems(self):
+        '''Get all of the star systems, as for naevdb.get_ssystems().'''
+        return await self._request('ssystems', None)
+
+    async def get_ssys_presence(self, name):
+        '''Get the faction presences in the named star system.'''
+        return await self._request('presence', name)
+
+    async def get_effective_presence(self, name):
+        '''Get the effective faction presences in the named star system.'''
+        return await self._request('effective_presence', name)
+
+    async def get_ssys_id(self, name):
+        '''Get the ID of the named star system, or None if unknown.'''
+        return await self._request('ssys_id', name)
+
+    async def get_many(self, names, kind='ssys'):
+        '''Make one kind of lookup for several names at once.
+
+        Keyword arguments:
+            names, kind -- As for DBReader.get_many().
+        Returns:
+            A list of the results, in the same order as the names.
+
+        '''
+        return await asyncio.gather(*[self._request(kind, name)
+                                      for name in names])
+
+if __name__ == '__main__':
+    # Print the presences in the systems named on the command line.
+    try:
+        filename = sys.argv[1]
+    except IndexError:
+        filename = 'naev.db'
+    with DBReader(filename) as reader:
+        for name in sys.argv[2:]:
+            print(name)
+            presences = reader.get_ssys_presence(name)
+            for (faction, presence_range), value in sorted(presences.items()):
+                print('    {}: {:g} (range {})'.format(faction, value,
+                                                       presence_range))
@@ -0,0 +1,431 @@
+#!/usr/bin/env python3
+
+'''The jump network of the Naev universe, as a compact graph.
+
+The JumpGraph in this library holds the jumps between star systems as
+compressed sparse row (CSR) arrays of system indices: the jumps out of
+each system are a contiguous run of one array, found through another.
+Searches over it work on whole frontiers of systems at once, and the hop
+distance between every pair of systems can be worked out in one go and
+cached on disk.
+
+Run this script from the root directory of your Naev source tree to
+print a summary of the jump network. Example usage:
+    user@home:~/naev/$ jumpgraph
+
+'''
+
+# Copyright © 2012 Tim Pederick.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Standard library imports.
+import glob
+import hashlib
+import os
+import sys
+import tempfile
+
+# Third-party imports.
+import numpy as np
+
+# Local imports.
+from dataloader import data_root, use_cache
+from parsecache import DEFAULT_CACHE_FILE, DEFAULT_MAX_BYTES
+from snapshot import cached_universe
+from universe import Universe
+
+# Where hop matrices are cached.
+HOPS_CACHE_DIR = os.path.dirname(DEFAULT_CACHE_FILE)
+# The most space the cached hop matrices may take up, in bytes, as for the
+# parse cache. The most recently used matrix is always kept.
+HOPS_CACHE_MAX_BYTES = DEFAULT_MAX_BYTES
+
+# The value in a hop matrix for a system that can't be reached.
+UNREACHABLE = -1
+
+# The number of sources searched from at once when building a hop matrix,
+# one per bit of a bitset.
+_BLOCK = 64
+
+def _evict_hop_matrices(keep):
+    '''Delete the least recently used cached hop matrices.
+
+    Matrices are deleted, oldest first, until those left take up no more
+    than HOPS_CACHE_MAX_BYTES.
+
+    Keyword arguments:
+        keep -- The name of the cached matrix file just used, which is
+            never deleted.
+
+    '''
+    entries = []
+    for filename in glob.glob(os.path.join(HOPS_CACHE_DIR, 'hops-*.npy')):
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            # Deleted by someone else in the meantime.
+            continue
+        entries.append((filename != keep, -stat.st_mtime, stat.st_size,
+                        filename))
+    entries.sort()
+    total = 0
+    for evictable, _, size, filename in entries:
+        total += size
+        if evictable and total > HOPS_CACHE_MAX_BYTES:
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+            total -= size
+
+def _csr(count, origins, dests):
+    '''Sort edges into compressed sparse row form.
+
+    Keyword arguments:
+        count -- The number of nodes.
+        origins, dests -- Arrays of the origin and destination node of
+            each edge.
+    Returns:
+        A 3-tuple of the row pointer array (the edges out of node i are
+        those from indptr[i] up to indptr[i + 1]), the destination of
+        each edge in row order, and the order the edges were sorted into
+        (for sorting any edge attributes to match).
+
+    '''
+    order = np.lexsort((dests, origins))
+    indptr = np.zeros(count + 1, dtype=np.intp)
+    np.cumsum(np.bincount(origins, minlength=count), out=indptr[1:])
+    return indptr, dests[order].astype(np.intp), order
+
+def _gather(indptr, rows):
+    '''Get the indices of all of the edges out of the given nodes.'''
+    starts = indptr[rows]
+    counts = indptr[rows + 1] - starts
+    ends = np.cumsum(counts)
+    return (np.repeat(starts - ends + counts, counts) +
+            np.arange(ends[-1] if len(ends) else 0))
+
+
+class JumpGraph:
+    '''The jump network between star systems, in CSR form.
+
+    Systems are identified by their row index in the universe the graph
+    was built from; wherever a system is asked for, its name may be
+    given instead. Jumps to systems that aren't in the universe are
+    left out.
+
+    A jump is usable if it can be entered from its origin; exit-only
+    jumps are kept (with their direction) as edges, but searches only
+    follow usable ones.
+
+    Instance attributes:
+        universe -- The universe.Universe the graph was built from.
+        names -- A list of the system names, in index order.
+        indptr -- The CSR row pointer array: the jumps out of system i
+            are those from indptr[i] up to indptr[i + 1].
+        origins, dests -- Arrays of the origin and destination of each
+            jump, in row order.
+        hide -- An array of the hide value of each jump.
+        exit_only -- A boolean array, true for each exit-only jump.
+        usable_indptr, usable_dests -- The CSR arrays for the usable
+            jumps alone.
+
+    '''
+    def __init__(self, ssystems):
+        '''Build the graph.
+
+        Keyword arguments:
+            ssystems -- The star systems, either as a universe.Universe
+                or as a sequence of naevdata.SSystem instances.
+
+        '''
+        universe = (ssystems if isinstance(ssystems, Universe)
+                    else Universe(ssystems))
+        self.universe = universe
+        self.names = universe.ssys_names
+        self._index = dict((name, i) for i, name in enumerate(self.names))
+
+        known = universe.jump_to >= 0
+        origins = universe.jump_from[known]
+        self.indptr, self.dests, order = _csr(len(self.names), origins,
+                                              universe.jump_to[known])
+        self.origins = origins[order].astype(np.intp)
+        self.hide = universe.jump_hide[known][order]
+        self.exit_only = universe.jump_exit_only[known][order]
+
+        usable = ~self.exit_only
+        self.usable_indptr = np.zeros_like(self.indptr)
+        np.cumsum(np.bincount(self.origins[usable],
+                              minlength=len(self.names)),
+                  out=self.usable_indptr[1:])
+        self.usable_dests = self.dests[usable]
+
+    def __len__(self):
+        '''Get the number of star systems.'''
+        return len(self.names)
+
+    def node(self, ssys):
+        '''Get the index of a star system, given its name or index.'''
+        if isinstance(ssys, str):
+            try:
+                return self._index[ssys]
+            except KeyError:
+                raise KeyError("no star system named '{}'".format(ssys))
+        return int(ssys)
+
+    def nodes(self, ssystems):
+        '''Get an array of the indices of star systems, as for node().'''
+        indices = np.asarray(ssystems)
+        if indices.dtype.kind in 'iu':
+            return indices.astype(np.intp, copy=False)
+        return np.array([self.node(ssys) for ssys in ssystems],
+                        dtype=np.intp)
+
+    def neighbours(self, ssys, usable=True):
+        '''Get the indices of the systems one jump out of a system.
+
+        Keyword arguments:
+            ssys -- The system, by name or index.
+            usable -- Whether to follow only usable jumps (the default)
+                or exit-only ones too.
+
+        '''
+        indptr, dests = self._arrays(usable)
+        node = self.node(ssys)
+        return dests[indptr[node]:indptr[node + 1]]
+
+    def _arrays(self, usable):
+        '''Get the CSR arrays for all jumps or only the usable ones.'''
+        return ((self.usable_indptr, self.usable_dests) if usable else
+                (self.indptr, self.dests))
+
+    def bfs(self, source, max_hops=None, usable=True):
+        '''Find the fewest jumps from one system to every other.
+
+        Each step of the search takes the jumps out of the whole
+        frontier at once.
+
+        Keyword arguments:
+            source -- The system to start from, by name or index.
+            max_hops -- The furthest to search, in jumps. If omitted,
+                the search goes as far as it can.
+            usable -- As for neighbours().
+        Returns:
+            An array of the number of jumps to each system, with
+            UNREACHABLE for those that can't be reached.
+
+        '''
+        indptr, dests = self._arrays(usable)
+        hops = np.full(len(self), UNREACHABLE, dtype=np.int32)
+        frontier = np.array([self.node(source)], dtype=np.intp)
+        hops[frontier] = 0
+        hop = 0
+        while len(frontier) and (max_hops is None or hop < max_hops):
+            hop += 1
+            reached = dests[_gather(indptr, frontier)]
+            frontier = np.unique(reached[hops[reached] == UNREACHABLE])
+            hops[frontier] = hop
+        return hops
+
+    def reachable(self, source, usable=True):
+        '''Get a boolean array of the systems reachable from a system.
+
+        Keyword arguments:
+            source, usable -- As for bfs().
+
+        '''
+        return self.bfs(source, usable=usable) != UNREACHABLE
+
+    def components(self):
+        '''Label the connected components of the network.
+
+        Jumps are taken as connecting systems regardless of direction
+        (or of whether they are usable), so these are the weakly
+        connected components.
+
+        Returns:
+            An array of the component number of each system. Components
+            are numbered from 0, in order of their first system.
+
+        '''
+        count = len(self)
+        indptr, dests, order = _csr(count,
+                                    np.concatenate((self.origins,
+                                                    self.dests)),
+                                    np.concatenate((self.dests,
+                                                    self.origins)))
+        labels = np.full(count, -1, dtype=np.intp)
+        component = 0
+        for start in range(count):
+            if labels[start] >= 0:
+                continue
+            labels[start] = component
+            frontier = np.array([start], dtype=np.intp)
+            while len(frontier):
+                reached = dests[_gather(indptr, frontier)]
+                frontier = np.unique(reached[labels[reached] < 0])
+                labels[frontier] = component
+            component += 1
+        return labels
+
+    def fingerprint(self):
+        '''Get a digest that changes whenever the usable jumps do.'''
+        digest = hashlib.sha1()
+        digest.update('\0'.join(self.names).encode('utf-8'))
+        digest.update(self.usable_indptr.astype('<i8').tobytes())
+        digest.update(self.usable_dests.astype('<i8').tobytes())
+        return digest.hexdigest()
+
+    def hop_matrix(self, cache=True):
+        '''Find the fewest jumps between every pair of systems.
+
+        The systems are searched from _BLOCK at a time: each system
+        holds a bitset of the sources that have reached it, and each
+        step passes the newly reached bits along every usable jump at
+        once.
+
+        Keyword arguments:
+            cache -- Whether or not to keep the matrix on disk (under
+                HOPS_CACHE_DIR), keyed by the graph's fingerprint. A
+                cached matrix is memory-mapped rather than read in. The
+                least recently used matrices are deleted once they take
+                up more than HOPS_CACHE_MAX_BYTES. Defaults to True.
+        Returns:
+            A square array, indexed by origin then destination, of the
+            number of usable jumps between them, with UNREACHABLE for
+            pairs with no route.
+
+        '''
+        cachefile = None
+        if cache:
+            cachefile = os.path.join(HOPS_CACHE_DIR,
+                                     'hops-{}.npy'.format(self.fingerprint()))
+            try:
+                matrix = np.load(cachefile, mmap_mode='r')
+            except (OSError, ValueError):
+                pass
+            else:
+                try:
+                    # Mark it as recently used.
+                    os.utime(cachefile)
+                except OSError:
+                    pass
+                return matrix
+
+        count = len(self)
+        matrix = np.full((count, count), UNREACHABLE, dtype=np.int16)
+        # Sort the usable jumps by destination, so that each system's
+        # incoming bits can be combined with one reduceat().
+        by_dest = np.argsort(self.usable_dests, kind='stable')
+        sources = self.origins[~self.exit_only][by_dest]
+        dests, starts = np.unique(self.usable_dests[by_dest],
+                                  return_index=True)
+        bit_values = np.left_shift(np.uint64(1),
+                                   np.arange(_BLOCK, dtype=np.uint64))
+
+        for first in range(0, count, _BLOCK):
+            block = np.arange(first, min(first + _BLOCK, count))
+            seen = np.zeros(count, dtype=np.uint64)
+            seen[block] = bit_values[:len(block)]
+            frontier = seen.copy()
+            # The distances from this block, by destination then source.
+            distances = np.full((count, _BLOCK), UNREACHABLE,
+                                dtype=np.int16)
+            distances[block, block - first] = 0
+            hop = 0
+            while len(dests):
+                hop += 1
+                incoming = np.zeros(count, dtype=np.uint64)
+                incoming[dests] = np.bitwise_or.reduceat(frontier[sources],
+                                                         starts)
+                frontier = incoming & ~seen
+                reached = np.flatnonzero(frontier)
+                if not len(reached):
+                    break
+                seen |= frontier
+                # Unpack the bits of the newly reached systems.
+                bits = np.unpackbits(
+                    frontier[reached].astype('<u8').view(np.uint8),
+                    bitorder='little').reshape(len(reached), _BLOCK)
+                distances[reached] = np.where(bits, hop, distances[reached])
+            matrix[block] = distances[:, :len(block)].T
+
+        if cachefile is not None:
+            try:
+                os.makedirs(HOPS_CACHE_DIR, exist_ok=True)
+                # A uniquely named temporary file, so that concurrent
+                # builds can't write over each other.
+                fd, tempname = tempfile.mkstemp(dir=HOPS_CACHE_DIR,
+                                                suffix='.tmp')
+                try:
+                    with os.fdopen(fd, 'wb') as f:
+                        np.save(f, matrix)
+                    os.replace(tempname, cachefile)
+                except BaseException:
+                    os.unlink(tempname)
+                    raise
+                _evict_hop_matrices(cachefile)
+            except OSError as err:
+                print('Could not cache the hop matrix: {}. Continuing '
+                      'without it.'.format(err), file=sys.stderr)
+        return matrix
+
+    def hops(self, origins, dests, cache=True):
+        '''Look up the fewest jumps between many pairs of systems.
+
+        Keyword arguments:
+            origins, dests -- Sequences of the origin and destination
+                systems of each pair, by name or index.
+            cache -- As for hop_matrix().
+        Returns:
+            An array of the number of usable jumps between each pair,
+            with UNREACHABLE for pairs with no route.
+
+        '''
+        matrix = self.hop_matrix(cache)
+        return np.asarray(matrix[self.nodes(origins), self.nodes(dests)])
+
+def main(cache=True, naevroot=None):
+    '''Print a summary of the jump network.
+
+    Keyword arguments:
+        cache -- Whether or not to use the cached universe snapshot, as
+            for snapshot.cached_universe(), and the hop matrix cache.
+            Defaults to True.
+        naevroot -- The root of the Naev source tree, or an archive of
+            its data, as for dataloader.datafiles(). If omitted, the
+            current directory is used.
+
+    '''
+    graph = JumpGraph(cached_universe(naevroot, cache, assets=False))
+    labels = graph.components()
+    sizes = np.bincount(labels) if len(labels) else np.zeros(0, np.intp)
+    print('{} systems, {} jumps ({} exit-only).'.format(
+        len(graph), len(graph.dests), int(graph.exit_only.sum())))
+    print('{} connected component{}, of sizes: {}.'.format(
+        len(sizes), '' if len(sizes) == 1 else 's',
+        ', '.join(str(size) for size in sorted(sizes.tolist(),
+                                               reverse=True))))
+
+    matrix = graph.hop_matrix(cache)
+    routed = matrix[matrix != UNREACHABLE]
+    print('{} of {} ordered pairs of systems are connected; the longest '
+          'route takes {} jumps.'.format(len(routed), matrix.size,
+                                         int(routed.max()) if len(routed)
+                                         else 0))
+
+if __name__ == '__main__':
+    cache = use_cache(sys.argv)
+    main(cache, data_root(sys.argv))
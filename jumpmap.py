@@ -7,6 +7,20 @@ reads the XML files in dat/ssys/ and outputs an SVG map to standard
 output. Example usage:
     user@home:~/naev/$ jumpmap > map.svg
 
+Parsed data files are cached between runs; pass --no-cache to bypass
+the cache and parse every file afresh.
+
+To read the data from an archive (such as ndata) or another Naev source
+tree, pass --data and its location.
+
+Pass --output and a filename to write the map to that file instead. If
+the filename ends in .svgz, the map is compressed as it is written:
+    user@home:~/naev/$ jumpmap --output map.svgz
+
+Pass --watch and a filename to keep running, rewriting the map in that
+file whenever the data files change:
+    user@home:~/naev/$ jumpmap --watch map.svg
+
 '''
 
 # Copyright © 2012 Tim Pederick.
@@ -26,18 +40,76 @@ output. Example usage:
 
 # Standard library imports.
 from datetime import date
+import gzip
+import os
 import sys
 
+# Third-party imports.
+import numpy as np
+
 # Local imports.
-from naevdata import SSystem
-from dataloader import datafiles
+from dataloader import data_root, temp_file, use_cache
+from datawatch import DataWatcher
+from naevdata import Coords
+from snapshot import cached_universe
+from universe import Universe
+
+# The number of characters of SVG gathered up before each write.
+BUFFER_SIZE = 1 << 20
+
+# The gzip compression level for SVGZ maps. This is gzip's own default,
+# which makes files barely bigger than the highest level, twice as fast.
+COMPRESS_LEVEL = 6
+
+# The fixed parts of each map, with fields for the map's bounds and
+# appearance.
+SVG_HEADER = '''<?xml version="1.0"?>
+<svg xmlns="http://www.w3.org/2000/svg" version="1.2" \
+baseProfile="tiny" width="{2}px" height="{3}px" \
+viewBox="{0} {1} {2} {3}">
+<title>Naev universe map {date}</title>
+<defs>
+<marker id="arrow" orient="auto" viewBox="-1 -2 4 4"
+        markerWidth="8" markerHeight="8">
+    <path d="M 0,0 -1,-2 3,0 -1,2 Z" fill="{jump_colour}"/>
+</marker>
+<style type="text/css"><![CDATA[
+    g#jumps > path {{stroke: {jump_colour}; stroke-width: 1}}
+    g#jumps > path.oneway {{stroke-dasharray: 2,1;
+                           marker-mid: url(#arrow)}}
+    g#systems > circle {{stroke: none; fill: {ssystem_colour}}}
+    g#systems > text {{stroke: none; fill: {label_colour}; \
+font-family: {label_font}}}
+]]></style>
+</defs>
+
+<g id="jumps">
+'''
+SVG_SYSTEMS = '''</g>
+
+<g id="systems">
+'''
+SVG_FOOTER = '''</g>
+
+</svg>
+'''
+
+# The SVG for each jump and star system.
+SVG_JUMP = '    <path d="M{},{} {},{}"/>\n'
+SVG_ONEWAY_JUMP = ('    <path class="oneway"\n'
+                   '          d="M{0},{1} l{2},{3} {2},{3}"/>\n')
+SVG_SSYS = ('    <circle cx="{0}" cy="{1}" r="{2}"/>\n'
+            '    <text x="{3}" y="{4}" font-size="{5}"\n'
+            '    >{6}</text>\n')
+
 
 def mapdata(ssystems):
     '''Extract mappable data from a list of star systems.
 
     Keyword arguments:
-        ssystems -- A sequence object containing the star systems to be
-            mapped (instances of naevdata.SSystem).
+        ssystems -- The star systems to be mapped, either as a
+            universe.Universe or as a sequence object containing
+            instances of naevdata.SSystem.
     Returns:
         A 4-tuple containing:
         * the map boundaries (a 4-tuple of x-minimum, x-maximum,
@@ -51,48 +123,128 @@ def mapdata(ssystems):
           the two ends are ordered as origin then destination)
 
     '''
-    syslocs = {}
-    jumps_by_name = {}
-    jumps = []
-    jumps_oneway = []
+    universe = (ssystems if isinstance(ssystems, Universe)
+                else Universe(ssystems))
+
+    # Note down the system names and locations.
+    locs = [Coords(x, y) for x, y in zip(universe.ssys_x.tolist(),
+                                         universe.ssys_y.tolist())]
+    syslocs = dict(zip(universe.ssys_names, locs))
+
+    # Track the outermost systems (and the origin, which is always mapped).
     xmin = xmax = ymin = ymax = 0
+    if len(universe):
+        sys_xmin, sys_xmax, sys_ymin, sys_ymax = universe.bounds()
+        xmin, xmax = min(xmin, sys_xmin), max(xmax, sys_xmax)
+        ymin, ymax = min(ymin, sys_ymin), max(ymax, sys_ymax)
+
+    # Note down the jumps. Ignore any that can't be entered from their
+    # origin; they'll be recorded in the system at the other end.
+    usable = ~universe.jump_exit_only & (universe.jump_to >= 0)
+    origins = universe.jump_from[usable]
+    dests = universe.jump_to[usable]
+    # A jump is two-way if the reverse jump is usable too. Encode each
+    # origin-destination pair as a single integer to find the reverses.
+    ssys_count = len(universe)
+    twoway = np.isin(dests * ssys_count + origins,
+                     origins * ssys_count + dests)
 
-    # Extract the data.
-    for ssys in ssystems:
-        # Note down the system name and location.
-        syslocs[ssys.name] = ssys.pos
-        # Note down any jumps it has. Ignore any that can't be entered from
-        # here; they'll be recorded in the system at the other end.
-        jumps_by_name[ssys.name] = list(dest for dest in ssys.jumps
-                                        if not ssys.jumps[dest].exit_only)
-        # Track the outermost systems.
-        xmin = min(xmin, ssys.pos.x)
-        xmax = max(xmax, ssys.pos.x)
-        ymin = min(ymin, ssys.pos.y)
-        ymax = max(ymax, ssys.pos.y)
-
-    # Convert the jump data to a series of coordinates.
-    for origin in jumps_by_name:
-        for dest in jumps_by_name[origin]:
-            if dest in jumps_by_name and origin in jumps_by_name[dest]:
-                # Two-way jump.
-                jumps.append((syslocs[origin], syslocs[dest]))
-                # Don't duplicate jumps.
-                jumps_by_name[dest].remove(origin)
-            else:
-                # One-way jump.
-                jumps_oneway.append((syslocs[origin], syslocs[dest]))
+    # Convert the jump data to a series of coordinates. Don't duplicate
+    # two-way jumps; keep them only from whichever end comes first.
+    keep = twoway & (origins < dests)
+    jumps = [(locs[origin], locs[dest]) for origin, dest
+             in zip(origins[keep].tolist(), dests[keep].tolist())]
+    jumps_oneway = [(locs[origin], locs[dest]) for origin, dest
+                    in zip(origins[~twoway].tolist(),
+                           dests[~twoway].tolist())]
 
     return ((xmin, xmax, ymin, ymax), syslocs, jumps, jumps_oneway)
 
+
+class SVGWriter:
+    '''Gathers up pieces of SVG and writes them out in large blocks.
+
+    Writing a map a piece at a time costs a call (and, for an
+    unbuffered file, a system call) per piece. This joins the pieces up
+    in memory instead, and only writes them to the file once there are
+    BUFFER_SIZE characters or so. It can be used as a context manager,
+    which flushes it on leaving.
+
+    Instance attributes:
+        file -- The file-like object, opened for writing text, that the
+            SVG is written to.
+        buffer_size -- The number of characters to gather up before
+            writing.
+
+    '''
+    def __init__(self, file, buffer_size=BUFFER_SIZE):
+        '''Set up the writer.
+
+        Keyword arguments:
+            file -- As the instance attribute.
+            buffer_size -- As the instance attribute. Defaults to
+                BUFFER_SIZE.
+
+        '''
+        self.file = file
+        self.buffer_size = buffer_size
+        self._pieces = []
+        self._size = 0
+
+    def write(self, piece):
+        '''Add a piece of SVG, writing out the buffer if it's full.'''
+        self._pieces.append(piece)
+        self._size += len(piece)
+        if self._size >= self.buffer_size:
+            self.flush()
+
+    def writelines(self, pieces):
+        '''Add many pieces of SVG, as for write().'''
+        for piece in pieces:
+            self.write(piece)
+
+    def flush(self):
+        '''Write out all of the pieces added so far.'''
+        if self._pieces:
+            self.file.write(''.join(self._pieces))
+            self._pieces = []
+            self._size = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()
+
+def open_map(filename, compress=None):
+    '''Open a file to write an SVG map to.
+
+    Keyword arguments:
+        filename -- The name of the file.
+        compress -- Whether to compress the map with gzip (at
+            COMPRESS_LEVEL), as an SVGZ file. If omitted, it is
+            compressed if the filename ends in ".svgz".
+    Returns:
+        A file object, opened for writing text.
+
+    '''
+    if compress is None:
+        compress = filename.lower().endswith('.svgz')
+    if compress:
+        return gzip.open(filename, 'wt', compresslevel=COMPRESS_LEVEL,
+                         encoding='utf-8')
+    return open(filename, 'w', encoding='utf-8')
+
 def makemap(ssystems, margin=10, sys_size=5, ssystem_colour="orange",
             jump_colour="grey", label_colour="black", label_font="serif",
             file=sys.stdout):
     '''Create an SVG map from a list of star systems.
 
+    The map is put together from the pieces of SVG in this module, and
+    written out through an SVGWriter, in a few large writes.
+
     Keyword arguments:
-        ssystems -- A sequence object containing the star systems to be
-            mapped (instances of naevdata.SSystem).
+        ssystems -- The star systems to be mapped, as for mapdata().
         margin -- The margin width (in pixels) to put around the edges
             of the map. The default value is 10.
         sys_size -- The radius of the dot representing each star system.
@@ -100,8 +252,8 @@ def makemap(ssystems, margin=10, sys_size=5, ssystem_colour="orange",
         ssystem_colour, jump_colour, label_colour, label_font -- Control
             the appearance of the SVG output. The default appearance has
             orange star systems, grey jumps, and labels in black serif.
-        file -- A file-like object to output the SVG to. Defaults to
-            standard output.
+        file -- A file-like object to output the SVG to, such as one
+            from open_map(). Defaults to standard output.
 
     '''
     (xmin, xmax, ymin, ymax), systems, jumps, jumps_oneway = mapdata(ssystems)
@@ -111,83 +263,117 @@ def makemap(ssystems, margin=10, sys_size=5, ssystem_colour="orange",
                   xmax - xmin + 2 * margin + LABEL_SPACE,
                   ymax - ymin + 2 * margin)
 
-    # Output the SVG file.
-    print('<?xml version="1.0"?>')
-    print('<svg xmlns="http://www.w3.org/2000/svg" version="1.2" '
-          'baseProfile="tiny" width="{2}px" height="{3}px" '
-          'viewBox="{0} {1} {2} {3}">'.format(*svg_bounds), file=file)
-    print('<title>Naev universe map {}</title>'.format(date.today()),
-          file=file)
-##    print('<!-- {} -->'.format((xmin, xmax, ymin, ymax)))
-
-    # Style the map.
-    print('<defs>', file=file)
-    print('<marker id="arrow" orient="auto" viewBox="-1 -2 4 4"', file=file)
-    print('        markerWidth="8" markerHeight="8">', file=file)
-    print('    <path d="M 0,0 -1,-2 3,0 -1,2 Z" '
-          'fill="{}"/>'.format(jump_colour), file=file)
-    print('</marker>', file=file)
-    print('<style type="text/css"><![CDATA[', file=file)
-    print('    g#jumps > path {{stroke: {}; '
-          'stroke-width: 1}}'.format(jump_colour), file=file)
-    print('    g#jumps > path.oneway {stroke-dasharray: 2,1;', file=file)
-    print('                           marker-mid: url(#arrow)}', file=file)
-    print('    g#systems > circle {{stroke: none; '
-          'fill: {}}}'.format(ssystem_colour), file=file)
-    print('    g#systems > text {{stroke: none; '
-          'fill: {}; font-family: {}}}'.format(label_colour, label_font),
-          file=file)
-    print(']]></style>', file=file)
-    print('</defs>', file=file)
-    print(file=file)
-
-    # Output the jumps first, so they're underneath the system markers.
-    print('<g id="jumps">', file=file)
-    for jump in jumps:
-        print('    <path d="M{},{} {},{}"/>'.format(jump[0].x, -jump[0].y,
-                                                    jump[1].x, -jump[1].y),
-              file=file)
-    for jump in jumps_oneway:
-        print('    <path class="oneway"', file=file)
-        print('          d="M{0},{1} l{2},{3} {2},{3}"'
-              '/>'.format(jump[0].x,
-                          -jump[0].y,
-                          (jump[1].x - jump[0].x) // 2,
-                          -(jump[1].y - jump[0].y) // 2),
-              file=file)
-    print('</g>', file=file)
-    print(file=file)
-
-    # Output the system markers.
-    print('<g id="systems">', file=file)
-    for name in systems:
-        x, y = systems[name].coords
-        print('    <circle cx="{}" cy="{}" r="{}"/>'.format(x, -y, sys_size),
-              file=file)
-        print('    <text x="{}" y="{}" font-size="{}"'.format(x + 2 * sys_size,
-                                                              -y + sys_size,
-                                                              3 * sys_size),
-              file=file)
-        print('    >{}</text>'.format(name), file=file)
-    print('</g>', file=file)
-    print(file=file)
-
-    # And we're done!
-    print('</svg>', file=file)
-
-def main():
+    with SVGWriter(file) as out:
+        out.write(SVG_HEADER.format(*svg_bounds, date=date.today(),
+                                    ssystem_colour=ssystem_colour,
+                                    jump_colour=jump_colour,
+                                    label_colour=label_colour,
+                                    label_font=label_font))
+
+        # Output the jumps first, so they're underneath the system markers.
+        out.writelines(SVG_JUMP.format(start.x, -start.y, end.x, -end.y)
+                       for start, end in jumps)
+        out.writelines(SVG_ONEWAY_JUMP.format(start.x, -start.y,
+                                              (end.x - start.x) // 2,
+                                              -(end.y - start.y) // 2)
+                       for start, end in jumps_oneway)
+
+        # Output the system markers.
+        out.write(SVG_SYSTEMS)
+        out.writelines(SVG_SSYS.format(loc.x, -loc.y, sys_size,
+                                       loc.x + 2 * sys_size,
+                                       -loc.y + sys_size, 3 * sys_size, name)
+                       for name, loc in systems.items())
+
+        # And we're done!
+        out.write(SVG_FOOTER)
+    file.flush()
+
+def watchmap(filename, interval=1.0, naevroot=None):
+    '''Keep an SVG map up to date with the data files.
+
+    The map is written to the given file, and rewritten (atomically)
+    every time any system is added, changed, or removed. Only the
+    changed data files are parsed again. This runs until interrupted.
+
+    Keyword arguments:
+        filename -- The file to write the map to. As for open_map(), it
+            is compressed if the filename ends in ".svgz".
+        interval -- How often to check the data files for changes, in
+            seconds. The default is one second.
+        naevroot -- The root of the Naev source tree, or an archive of
+            its data, as for dataloader.datafiles(). If omitted, the
+            current directory is used.
+
+    '''
+    compress = filename.lower().endswith('.svgz')
+    with DataWatcher(naevroot, datasets=('SSystems',)) as watcher:
+        for events in watcher.watch(interval):
+            # Write each map to a temporary file of its own, so that
+            # nothing else writing the same map can clash with it.
+            fd, tempname = temp_file(filename)
+            os.close(fd)
+            try:
+                with open_map(tempname, compress) as f:
+                    makemap(watcher.universe(), file=f)
+                os.replace(tempname, filename)
+            except BaseException:
+                os.remove(tempname)
+                raise
+            print('Map updated ({} change{}).'.format(
+                len(events), '' if len(events) == 1 else 's'),
+                  file=sys.stderr)
+
+def main(cache=True, watch=None, naevroot=None, output=None):
     '''Generate an SVG map and print it to standard output.
 
-    The data files are assumed to be in ./dat/ssys/, relative to the
-    current path, so this should be run from the root of the Naev
-    source directory.
+    Unless otherwise specified, the data files are assumed to be in
+    ./dat/ssys/, relative to the current path, so this should be run
+    from the root of the Naev source directory.
+
+    Keyword arguments:
+        cache -- Whether or not to use the cached universe snapshot, as
+            for snapshot.cached_universe(). Defaults to True.
+        watch -- If given, a file to keep the map up to date in, as
+            described for watchmap(), instead of printing it once.
+        naevroot -- The root of the Naev source tree, or an archive of
+            its data, as for dataloader.datafiles(). If omitted, the
+            current directory is used.
+        output -- If given, a file to write the map to instead of
+            printing it, as for open_map().
 
     '''
-    ssystems = []
-    for ssysfile in datafiles('SSystems'):
-        # Parse each XML file into a SSystem object.
-        ssystems.append(SSystem(ssysfile))
-    makemap(ssystems)
+    if watch is not None:
+        try:
+            watchmap(watch, naevroot=naevroot)
+        except KeyboardInterrupt:
+            pass
+        return
+
+    universe = cached_universe(naevroot, cache, assets=False)
+    if output is None:
+        makemap(universe)
+    else:
+        with open_map(output) as f:
+            makemap(universe, file=f)
 
 if __name__ == '__main__':
-    main()
+    cache = use_cache(sys.argv)
+    naevroot = data_root(sys.argv)
+    try:
+        watch = sys.argv[sys.argv.index('--watch') + 1]
+    except ValueError:
+        # No --watch option.
+        watch = None
+    except IndexError:
+        print('Usage: jumpmap --watch FILENAME', file=sys.stderr)
+        sys.exit(2)
+    try:
+        output = sys.argv[sys.argv.index('--output') + 1]
+    except ValueError:
+        # No --output option.
+        output = None
+    except IndexError:
+        print('Usage: jumpmap --output FILENAME', file=sys.stderr)
+        sys.exit(2)
+    main(cache, watch, naevroot, output)
@@ -0,0 +1,380 @@
+#!/usr/bin/env python3
+
+'''Structural analysis of the Naev jump network.
+
+Run this script from the root directory of your Naev source tree. It
+reads the star systems in dat/ssys/ and reports on the shape of the jump
+network between them: its chokepoints (the systems and jumps whose loss
+would cut it in two), the groups of systems that can all reach one
+another, and the systems that most routes pass through. Example usage:
+    user@home:~/naev/$ jumpstats
+
+Working out which systems most routes pass through takes a search from
+every system. To estimate it from a random sample of systems instead,
+pass --samples and the number of systems to search from.
+
+Parsed data files are cached between runs; pass --no-cache to bypass
+the cache and parse every file afresh. To read the data from an archive
+(such as ndata) or another Naev source tree, pass --data and its
+location.
+
+'''
+
+# Copyright © 2012 Tim Pederick.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Standard library imports.
+from concurrent.futures import ProcessPoolExecutor
+import os
+import random
+import sys
+
+# Third-party imports.
+import numpy as np
+
+# Local imports.
+from dataloader import data_root, use_cache
+from dataranges import liststr
+from jumpgraph import JumpGraph
+from snapshot import cached_universe
+
+# The fewest searches worth spreading across worker processes when working
+# out betweenness; fewer than this are done in this process.
+PARALLEL_THRESHOLD = 256
+
+# The number of systems listed as those most routes pass through.
+TOP_COUNT = 10
+
+def _adjacency(graph, undirected=False):
+    '''Get lists of the systems one usable jump away from each system.
+
+    Keyword arguments:
+        graph -- The jumpgraph.JumpGraph.
+        undirected -- Whether to count jumps in either direction, as
+            sorted lists without repeats. Defaults to False.
+
+    '''
+    indptr, dests = graph.usable_indptr.tolist(), graph.usable_dests
+    if not undirected:
+        dests = dests.tolist()
+        return [dests[indptr[i]:indptr[i + 1]] for i in range(len(graph))]
+    origins = graph.origins[~graph.exit_only]
+    adjacency = [set() for i in range(len(graph))]
+    for origin, dest in zip(origins.tolist(), dests.tolist()):
+        if origin != dest:
+            adjacency[origin].add(dest)
+            adjacency[dest].add(origin)
+    return [sorted(neighbours) for neighbours in adjacency]
+
+def chokepoints(graph):
+    '''Find the articulation points and bridges of the jump network.
+
+    The network is taken as undirected here: two systems are linked if
+    there is a usable jump between them, in either direction. Removing
+    an articulation point (a system) or a bridge (a link) leaves some
+    systems that were linked, however indirectly, no longer so. Both
+    are found together by one depth-first search, in linear time, after
+    Hopcroft and Tarjan.
+
+    Keyword arguments:
+        graph -- The jumpgraph.JumpGraph to analyse.
+    Returns:
+        A 2-tuple of a sorted list of the indices of the articulation
+        points, and a sorted list of the bridges as 2-tuples of system
+        indices (the lower first).
+
+    '''
+    adjacency = _adjacency(graph, undirected=True)
+    count = len(graph)
+    found = [-1] * count
+    low = [0] * count
+    parent = [-1] * count
+    cut, bridges = set(), []
+    clock = 0
+    for root in range(count):
+        if found[root] >= 0:
+            continue
+        found[root] = low[root] = clock
+        clock += 1
+        root_children = 0
+        # The search stack holds each system and the position of the next
+        # of its neighbours to visit, in place of recursion.
+        stack = [[root, 0]]
+        while stack:
+            top = stack[-1]
+            node = top[0]
+            neighbours = adjacency[node]
+            if top[1] < len(neighbours):
+                nxt = neighbours[top[1]]
+                top[1] += 1
+                if found[nxt] < 0:
+                    parent[nxt] = node
+                    found[nxt] = low[nxt] = clock
+                    clock += 1
+                    stack.append([nxt, 0])
+                    if node == root:
+                        root_children += 1
+                elif nxt != parent[node]:
+                    low[node] = min(low[node], found[nxt])
+                continue
+            stack.pop()
+            if node == root:
+                continue
+            above = parent[node]
+            low[above] = min(low[above], low[node])
+            if low[node] > found[above]:
+                bridges.append((min(above, node), max(above, node)))
+            if above != root and low[node] >= found[above]:
+                cut.add(above)
+        if root_children > 1:
+            cut.add(root)
+    return sorted(cut), sorted(bridges)
+
+def strong_components(graph):
+    '''Label the strongly connected components of the jump network.
+
+    Systems are in the same component if each can be reached from the
+    other by usable jumps. They are found by one depth-first search, in
+    linear time, after Tarjan.
+
+    Keyword arguments:
+        graph -- The jumpgraph.JumpGraph to analyse.
+    Returns:
+        An array of the component number of each system. Components are
+        numbered in the order they are completed, which is a reverse
+        topological order: no jump leads from a component to a higher
+        numbered one.
+
+    '''
+    adjacency = _adjacency(graph)
+    count = len(graph)
+    order = [-1] * count
+    low = [0] * count
+    labels = [-1] * count
+    on_stack = [False] * count
+    stack = []
+    clock = component = 0
+    for root in range(count):
+        if order[root] >= 0:
+            continue
+        order[root] = low[root] = clock
+        clock += 1
+        stack.append(root)
+        on_stack[root] = True
+        work = [[root, 0]]
+        while work:
+            top = work[-1]
+            node = top[0]
+            neighbours = adjacency[node]
+            if top[1] < len(neighbours):
+                nxt = neighbours[top[1]]
+                top[1] += 1
+                if order[nxt] < 0:
+                    order[nxt] = low[nxt] = clock
+                    clock += 1
+                    stack.append(nxt)
+                    on_stack[nxt] = True
+                    work.append([nxt, 0])
+                elif on_stack[nxt]:
+                    low[node] = min(low[node], order[nxt])
+                continue
+            work.pop()
+            if work:
+                above = work[-1][0]
+                low[above] = min(low[above], low[node])
+            if low[node] == order[node]:
+                while True:
+                    member = stack.pop()
+                    on_stack[member] = False
+                    labels[member] = component
+                    if member == node:
+                        break
+                component += 1
+    return np.array(labels, dtype=np.intp)
+
+def _dependencies(adjacency, sources):
+    '''Sum the dependencies of every system on the searches from some.
+
+    This is the accumulation step of Brandes' algorithm: a breadth-first
+    search from each source counts the shortest routes to every system,
+    and then the systems are revisited in reverse, each crediting those
+    before it with its share of the routes.
+
+    Keyword arguments:
+        adjacency -- The usable jumps out of each system, as from
+            _adjacency().
+        sources -- A sequence of the indices of the systems to search
+            from.
+    Returns:
+        A list of the summed dependencies of each system.
+
+    '''
+    count = len(adjacency)
+    totals = [0.0] * count
+    for source in sources:
+        routes = [0] * count
+        routes[source] = 1
+        hops = [-1] * count
+        hops[source] = 0
+        order = [source]
+        for node in order:
+            next_hop = hops[node] + 1
+            for nxt in adjacency[node]:
+                if hops[nxt] < 0:
+                    hops[nxt] = next_hop
+                    order.append(nxt)
+                if hops[nxt] == next_hop:
+                    routes[nxt] += routes[node]
+
+        dependency = [0.0] * count
+        for node in reversed(order):
+            next_hop = hops[node] + 1
+            share = 0.0
+            for nxt in adjacency[node]:
+                if hops[nxt] == next_hop:
+                    share += (1 + dependency[nxt]) / routes[nxt]
+            dependency[node] = routes[node] * share
+        dependency[source] = 0.0
+        for node in order:
+            totals[node] += dependency[node]
+    return totals
+
+def _init_worker(adjacency):
+    '''Set up a worker process to work out betweenness.'''
+    global _worker_adjacency
+    _worker_adjacency = adjacency
+
+def _dependencies_chunk(sources):
+    '''Sum the dependencies on some searches in a worker process.'''
+    return _dependencies(_worker_adjacency, sources)
+
+def betweenness(graph, samples=None, seed=0, workers=1):
+    '''Work out the betweenness centrality of each system.
+
+    The betweenness of a system is the number of shortest routes (by
+    usable jumps) between other systems that pass through it, with each
+    route counting as its share of all of the shortest routes between
+    the same two systems. It is found by Brandes' algorithm: one
+    breadth-first search from each system, or from a random sample of
+    them, whose results are scaled up to estimate the whole.
+
+    Keyword arguments:
+        graph -- The jumpgraph.JumpGraph to analyse.
+        samples -- The number of systems to search from. If omitted (or
+            no fewer than the number of systems), every system is
+            searched from, for exact results.
+        seed -- The seed for choosing the sample. Defaults to 0, so that
+            the same sample is chosen every time.
+        workers -- The number of worker processes to share the searches
+            between, or None for one per CPU. Defaults to 1, for no
+            worker processes. Fewer than PARALLEL_THRESHOLD searches are
+            never shared out.
+    Returns:
+        An array of the betweenness of each system.
+
+    '''
+    adjacency = _adjacency(graph)
+    count = len(graph)
+    if samples is None or samples >= count:
+        sources = list(range(count))
+    else:
+        sources = sorted(random.Random(seed).sample(range(count), samples))
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = min(workers, len(sources))
+
+    if workers <= 1 or len(sources) < PARALLEL_THRESHOLD:
+        totals = np.array(_dependencies(adjacency, sources))
+    else:
+        # As in dataloader, hand each worker a few contiguous chunks.
+        chunk_size = -(-len(sources) // (workers * 4))
+        chunks = [sources[i:i + chunk_size]
+                  for i in range(0, len(sources), chunk_size)]
+        totals = np.zeros(count)
+        with ProcessPoolExecutor(workers, initializer=_init_worker,
+                                 initargs=(adjacency,)) as pool:
+            for chunk_totals in pool.map(_dependencies_chunk, chunks):
+                totals += chunk_totals
+    if sources and len(sources) < count:
+        totals *= count / len(sources)
+    return totals
+
+def main(cache=True, naevroot=None, samples=None):
+    '''Report on the structure of the jump network.
+
+    Keyword arguments:
+        cache -- Whether or not to use the cached universe snapshot, as
+            for snapshot.cached_universe(). Defaults to True.
+        naevroot -- The root of the Naev source tree, or an archive of
+            its data, as for dataloader.datafiles(). If omitted, the
+            current directory is used.
+        samples -- The number of systems to search from when working out
+            betweenness, as for betweenness(). If omitted, every system
+            is searched from.
+
+    '''
+    graph = JumpGraph(cached_universe(naevroot, cache, assets=False))
+    names = graph.names
+
+    cut, bridges = chokepoints(graph)
+    print('There are {} systems whose loss would split the jump '
+          'network.'.format(len(cut)))
+    if cut:
+        print('They are {}.'.format(liststr([names[i] for i in cut])))
+    print('There are {} links whose loss would split the jump '
+          'network.'.format(len(bridges)))
+    for origin, dest in bridges:
+        print('    {} - {}'.format(names[origin], names[dest]))
+    print()
+
+    labels = strong_components(graph)
+    sizes = np.bincount(labels) if len(labels) else np.zeros(0, np.intp)
+    print('The systems fall into {} groups that can all reach one '
+          'another.'.format(len(sizes)))
+    if len(sizes) > 1:
+        largest = int(sizes.argmax())
+        print('The largest group has {} systems. The others are:'.format(
+            int(sizes[largest])))
+        for component in range(len(sizes)):
+            if component != largest:
+                members = np.flatnonzero(labels == component).tolist()
+                print('    {}'.format(liststr([names[i] for i in members])))
+    print()
+
+    scores = betweenness(graph, samples, workers=None)
+    estimate = ''
+    if samples is not None and samples < len(graph):
+        estimate = ' (estimated from {} systems)'.format(samples)
+    print('The systems that the most shortest routes pass '
+          'through{} are:'.format(estimate))
+    for i in np.argsort(-scores, kind='stable')[:TOP_COUNT].tolist():
+        print('    {} ({:.1f})'.format(names[i], scores[i]))
+
+if __name__ == '__main__':
+    cache = use_cache(sys.argv)
+    naevroot = data_root(sys.argv)
+    samples = None
+    if '--samples' in sys.argv:
+        index = sys.argv.index('--samples')
+        try:
+            samples = int(sys.argv[index + 1])
+        except (IndexError, ValueError):
+            samples = 0
+        if samples < 1:
+            print('Usage: jumpstats --samples COUNT (a positive whole '
+                  'number)', file=sys.stderr)
+            sys.exit(2)
+        del sys.argv[index:index + 2]
+    main(cache, naevroot, samples)
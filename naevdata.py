@@ -17,13 +17,148 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+# Standard library imports.
+from functools import lru_cache
+import io
+import sys
 import xml.dom.minidom
+import xml.parsers.expat
+
+# The XML parser backend used when none is specified. 'expat' streams each
+# file through an event-driven parser without building a document tree;
+# 'minidom' is the original DOM-walking implementation, kept as a reference.
+PARSER = 'expat'
 
 # Shortcut function to extract the text content from an element.
 nodetext = lambda elem: ''.join(c.data for c in elem.childNodes
                                 if c.nodeType == c.TEXT_NODE)
 
-class Coords:
+def expat_parse(f, start, end):
+    '''Stream an XML file through expat, tracking the element path.
+
+    Each element is identified by its path: a tuple of tag names from
+    the document element down to the element itself. The text content
+    passed to the end handler matches what nodetext() gives for the
+    same element in a DOM tree -- i.e. only text directly inside the
+    element, excluding CDATA sections.
+
+    Keyword arguments:
+        f -- A file object, opened in binary mode, holding the XML data.
+        start -- A callable taking an element path and a mapping of
+            the element's attributes, called at each start tag.
+        end -- A callable taking an element path and the element's
+            text content, called at each end tag.
+
+    '''
+    path = []
+    text = []
+    in_cdata = False
+
+    def start_element(name, attrs):
+        path.append(name)
+        text.append([])
+        start(tuple(path), attrs)
+    def end_element(name):
+        end(tuple(path), ''.join(text.pop()))
+        path.pop()
+    def char_data(data):
+        if not in_cdata and text:
+            text[-1].append(data)
+    def start_cdata():
+        nonlocal in_cdata
+        in_cdata = True
+    def end_cdata():
+        nonlocal in_cdata
+        in_cdata = False
+
+    parser = xml.parsers.expat.ParserCreate()
+    parser.buffer_text = True
+    parser.StartElementHandler = start_element
+    parser.EndElementHandler = end_element
+    parser.CharacterDataHandler = char_data
+    parser.StartCdataSectionHandler = start_cdata
+    parser.EndCdataSectionHandler = end_cdata
+    parser.ParseFile(f)
+
+def datafile(filename):
+    '''Open a data file for reading in binary mode.
+
+    If the argument is already a file object (i.e. it has a read()
+    method), it is returned unchanged.
+
+    '''
+    if hasattr(filename, 'read'):
+        return filename
+    return open(filename, 'rb')
+
+def interned(value):
+    '''Intern a string, or the strings in a set or mapping's keys.
+
+    Strings of other kinds of value are left alone, as are values that
+    are not strings, sets, or mappings.
+
+    '''
+    if isinstance(value, str):
+        return sys.intern(value)
+    elif isinstance(value, set):
+        return set(sys.intern(item) if isinstance(item, str) else item
+                   for item in value)
+    elif isinstance(value, dict):
+        return dict((sys.intern(key) if isinstance(key, str) else key, val)
+                    for key, val in value.items())
+    else:
+        return value
+
+@lru_cache(maxsize=None)
+def _slot_names(cls):
+    '''Get the names of all slots of a class, including inherited ones.'''
+    return tuple(name for klass in reversed(cls.__mro__)
+                 for name in klass.__dict__.get('__slots__', ()))
+
+
+class Record:
+    '''Base class for the compact data records that model Naev data.
+
+    Records keep their attributes in __slots__ rather than a per-instance
+    dictionary, which matters when many thousands of them are loaded at
+    once. Attributes named in a subclass's _interned tuple hold names
+    that recur throughout the data (factions, commodities, and the like)
+    and are interned, so that every record shares the one copy.
+
+    '''
+    __slots__ = ()
+    _interned = ()
+
+    def _intern(self):
+        '''Intern the strings held in the attributes named by _interned.'''
+        for name in self._interned:
+            try:
+                value = object.__getattribute__(self, name)
+            except AttributeError:
+                # Unset slot.
+                continue
+            setattr(self, name, interned(value))
+
+    def __getstate__(self):
+        state = {}
+        for name in _slot_names(type(self)):
+            try:
+                # Bypass any __getattr__, so that unset slots stay unset.
+                state[name] = object.__getattribute__(self, name)
+            except AttributeError:
+                # Unset slot.
+                pass
+        return state
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+        # Strings come back from a pickle as fresh copies, so share them
+        # again.
+        self._intern()
+
+
+class Coords(Record):
     '''Represents an x-y coordinate pair.
 
     Instance attributes:
@@ -31,6 +166,8 @@ class Coords:
         coords -- A shorthand for both coordinates as a 2-tuple.
 
     '''
+    __slots__ = ('x', 'y')
+
     def __init__(self, x=None, y=None):
         '''Extract x-y coordinates from their XML representation.
 
@@ -71,6 +208,8 @@ class Jump(Coords):
         exit_only -- Whether or not this jump point forbids entry.
 
     '''
+    __slots__ = ('hide', 'exit_only')
+
     def __init__(self, pos, hide=1.25, exit_only=False, dest='ignored'):
         '''Construct the jump point.
 
@@ -87,7 +226,7 @@ class Jump(Coords):
         self.exit_only = bool(exit_only)
 
 
-class Nebula:
+class Nebula(Record):
     '''Represents the nebula presence in a star system.
 
     Instance attributes:
@@ -95,6 +234,8 @@ class Nebula:
         volatility -- How damaging the nebula is to ships in the system.
 
     '''
+    __slots__ = ('density', 'volatility')
+
     def __init__(self, density=0.0, volatility=0.0):
         '''Create the nebula presence data.
 
@@ -107,7 +248,7 @@ class Nebula:
         self.volatility = float(volatility)
 
 
-class Presence:
+class Presence(Record):
     '''Represents the faction holding a planet, station, or other asset.
 
     Instance attributes:
@@ -118,6 +259,9 @@ class Presence:
             spill out into neighbouring systems.
 
     '''
+    __slots__ = ('faction', 'value', 'range')
+    _interned = ('faction',)
+
     def __init__(self, faction=None, value=100.0, range_=0.0):
         '''Create the faction presence data.
 
@@ -127,12 +271,12 @@ class Presence:
                 0.0, respectively.
 
         '''
-        self.faction = faction
+        self.faction = faction if faction is None else sys.intern(faction)
         self.value = float(value)
         self.range = int(range_)
 
 
-class Services:
+class Services(Record):
     '''Represents the services available on a planet or station.
 
     Instance attributes:
@@ -147,6 +291,10 @@ class Services:
             buying and selling of ships) are available at this location.
 
     '''
+    __slots__ = ('bar', 'commodities', 'land', 'missions', 'outfits',
+                 'refuel', 'shipyard')
+    _interned = ('commodities', 'land')
+
     def __init__(self, bar=None, commodity=None, land=None, missions=False,
                  outfits=False, refuel=False, shipyard=False):
         '''Create the service availability data.
@@ -170,9 +318,10 @@ class Services:
         self.outfits = bool(outfits)
         self.refuel = bool(refuel)
         self.shipyard = bool(shipyard)
+        self._intern()
 
 
-class Asset:
+class Asset(Record):
     '''Represents a planet, moon, station, or virtual holding.
 
     A "virtual" asset represents a faction's stake in a system without
@@ -201,14 +350,41 @@ class Asset:
             characteristics. All stations are class 0, while planets
             and moons have letter designations.
 
+    An asset may be loaded lazily, in which case only its name,
+    position, virtual-ness, and faction presence are read up front. Its
+    XML source is kept as a single bytes object, and the remaining
+    attributes are decoded from it the first time any of them is used.
+
     '''
-    def __init__(self, filename):
+    __slots__ = ('description', 'gfx', 'hide', 'name', 'population', 'pos',
+                 'presence', 'services', 'techs', 'virtual', 'world_class',
+                 '_source')
+    _interned = ('name', 'techs', 'world_class')
+
+    # The attributes that a lazily loaded asset doesn't read up front.
+    _LAZY = frozenset(('description', 'gfx', 'hide', 'population',
+                       'services', 'techs', 'world_class'))
+
+    # The types of the simple children of <general>, by tag. Any others are
+    # not part of the model, and are ignored.
+    _GENERAL_TYPES = {'class': str,
+                      'description': str,
+                      'hide': float,
+                      'population': int}
+
+    def __init__(self, filename, parser=None, lazy=False):
         '''Construct the asset from an XML file.
 
         Keyword arguments:
-            filename -- The filename of the XML asset data. If None, a
-                virtual asset without any interesting attributes is
-                created.
+            filename -- The filename of the XML asset data, or a
+                binary file object to read it from (which is closed
+                afterwards). If None, a virtual asset without any
+                interesting attributes is created.
+            parser -- The name of the XML parser backend to use, either
+                'expat' or 'minidom'. If omitted, the module-level
+                PARSER setting is used.
+            lazy -- Whether or not to load the asset lazily, as
+                described above. Defaults to False.
 
         '''
         if filename is None:
@@ -222,114 +398,275 @@ class Asset:
             self.services = Services()
             self.virtual = True
             self.world_class = None
+        elif lazy:
+            # Read just the identity of the asset, keeping the rest for
+            # later.
+            with datafile(filename) as f:
+                source = f.read()
+            self._load_identity(source)
+            self._source = source
         else:
             # Read the asset from the given file.
-            with open(filename) as f:
-                # Grab the elements we want.
-                doc = xml.dom.minidom.parse(f)
-                # Don't try and index into any of these NodeLists yet (they
-                # may not exist).
-                general = doc.getElementsByTagName('general')
-                gfx = doc.getElementsByTagName('GFX')
-                pos = doc.getElementsByTagName('pos')
-                presence = doc.getElementsByTagName('presence')
-                techs = doc.getElementsByTagName('tech')
-                virtual = doc.getElementsByTagName('virtual')
-
-                self.name = doc.documentElement.getAttribute('name')
-
-                # Set the asset's position, graphics, and virtual-ness.
-                self.pos = (Coords() if not pos else Coords(pos[0]))
-                self.gfx = ({} if not gfx else
-                            dict((child.tagName, nodetext(child))
-                                  for child in gfx[0].childNodes
-                                  if child.nodeType == child.ELEMENT_NODE))
-                self.virtual = bool(virtual)
-
-                # Extract the faction presence data.
-                pres_data = ({} if not presence else
-                             dict(('range_' if child.tagName == 'range'
-                                   else child.tagName, nodetext(child))
-                                  for child in presence[0].childNodes
-                                  if child.nodeType == child.ELEMENT_NODE))
-                self.presence = Presence(**pres_data)
-
-                # Extract the list of technologies, each of which is an <item>
-                # under the <tech> element.
-                self.techs = set()
-                if techs:
-                    for tech in techs[0].getElementsByTagName('item'):
-                        self.techs.add(nodetext(tech))
-
-                # Extract the <general> information. Initialise each one just
-                # in case it (or the whole of <general>) is absent.
-                bar_desc = None
-                commodities = None
-                self.description = ''
-                self.hide = 0.0
-                self.population = 0
-                self.services = None
-                self.world_class = None
-
-                # Do we even have a <general> element?
-                if general:
-                    for child in general[0].childNodes:
-                        # We're only interested in child elements.
-                        if child.nodeType != child.ELEMENT_NODE:
-                            continue
+            with datafile(filename) as f:
+                self._load(f, parser)
+
+    def __getattr__(self, name):
+        # This is only called if the attribute wasn't found normally --
+        # i.e. it is an unset slot, or doesn't exist at all.
+        if name in self._LAZY and getattr(self, '_source', None) is not None:
+            self._load(io.BytesIO(self._source))
+            self._source = None
+            return getattr(self, name)
+        raise AttributeError("'{}' object has no attribute "
+                             "'{}'".format(type(self).__name__, name))
+
+    def _load(self, f, parser=None):
+        '''Read the asset in full from an XML file object.'''
+        # Initialise the <general> information just in case it (or the whole
+        # of <general>) is absent.
+        self.description = ''
+        self.hide = 0.0
+        self.population = 0
+        self.services = None
+        self.world_class = None
+
+        # If the parser argument is not a known backend, a KeyError will
+        # result. Let it propagate upwards.
+        load = {'expat': self._load_expat,
+                'minidom': self._load_minidom}[parser or PARSER]
+        bar_desc, commodities = load(f)
+
+        # Finalise the list of services.
+        if self.services is None:
+            self.services = Services()
+        else:
+            # Put the bar description into the services -- if there is a bar
+            # there! If there isn't, the text is discarded.
+            if bar_desc is not None and self.services.bar is not None:
+                self.services.bar = bar_desc
+            # Put the commodities list into the services -- again, only if
+            # there are commodities traded here.
+            if (commodities is not None and
+                self.services.commodities is not None):
+                self.services.commodities = interned(commodities)
+        self._intern()
+
+    def _load_identity(self, source):
+        '''Read just the name, position, virtual-ness, and presence of the
+        asset from its XML source.
+
+        This is a cut-down version of _load_expat(), which only collects
+        text where it's needed.
 
-                        if child.tagName == 'bar':
-                            bar_desc = nodetext(child)
-                        elif child.tagName == 'commodities':
-                            # Get the set of child <commodity> nodes' content.
-                            c_nodes = child.getElementsByTagName('commodity')
-                            commodities = set(nodetext(c) for c in c_nodes)
-                        elif child.tagName == 'services':
-                            # Find which service type elements are present and
-                            # get their content (if any -- most will be empty).
-                            services = {}
-                            for service in child.childNodes:
-                                if service.nodeType != service.ELEMENT_NODE:
-                                    continue
-                                services[service.tagName] = nodetext(service)
-
-                            # An empty <land> tag means anyone can land.
-                            try:
-                                if services['land'] == '':
-                                    services['land'] = 'any'
-                            except KeyError:
-                                # An absent <land> tag means no-one can land.
-                                pass
-
-                            # Build the Services object.
-                            self.services = Services(**services)
-                        else:
-                            # Everything else is just defined by its content.
-                            try:
-                                child_type = {'population': int,
-                                              'hide': float}[child.tagName]
-                            except KeyError:
-                                child_type = str
-                            self.__setattr__('world_class'
-                                             if child.tagName == 'class'
-                                             else child.tagName,
-                                             child_type(nodetext(child)))
-                # Finalise the list of services.
-                if self.services is None:
-                    self.services = Services()
+        '''
+        parser = xml.parsers.expat.ParserCreate()
+        parser.buffer_text = True
+        depth = 0
+        section = None
+        text = []
+        pos = {}
+        pres_data = {}
+        self.virtual = False
+
+        def char_data(data):
+            if depth == 3:
+                text.append(data)
+        def start_element(name, attrs):
+            nonlocal depth, section
+            depth += 1
+            if depth == 1:
+                self.name = attrs.get('name', '')
+            elif depth == 2:
+                section = name
+                if name == 'virtual':
+                    self.virtual = True
+                elif name in ('pos', 'presence'):
+                    # Only these sections' text is of interest.
+                    parser.CharacterDataHandler = char_data
+            elif depth == 3:
+                del text[:]
+        def end_element(name):
+            nonlocal depth
+            if depth == 2:
+                parser.CharacterDataHandler = None
+            elif depth == 3:
+                if section == 'pos':
+                    pos[name] = ''.join(text)
+                elif section == 'presence':
+                    pres_data['range_' if name == 'range'
+                              else name] = ''.join(text)
+            depth -= 1
+
+        parser.StartElementHandler = start_element
+        parser.EndElementHandler = end_element
+        parser.Parse(source, True)
+
+        self.pos = (Coords() if 'x' not in pos else
+                    Coords(pos['x'], pos['y']))
+        self.presence = Presence(**pres_data)
+        self._intern()
+
+    def _set_general(self, tag, content):
+        '''Set an asset attribute from a simple child of <general>.'''
+        try:
+            child_type = self._GENERAL_TYPES[tag]
+        except KeyError:
+            # Not something we keep track of.
+            return
+        self.__setattr__('world_class' if tag == 'class' else tag,
+                         child_type(content))
+
+    @staticmethod
+    def _make_services(services):
+        '''Build a Services object from a mapping of service tags.'''
+        # An empty <land> tag means anyone can land.
+        try:
+            if services['land'] == '':
+                services['land'] = 'any'
+        except KeyError:
+            # An absent <land> tag means no-one can land.
+            pass
+        return Services(**services)
+
+    def _load_minidom(self, f):
+        '''Read the asset data from a file using a minidom tree.
+
+        Returns the bar description and the set of commodities traded,
+        either of which may be None, for the caller to finalise.
+
+        '''
+        # Grab the elements we want.
+        doc = xml.dom.minidom.parse(f)
+        # Don't try and index into any of these NodeLists yet (they may not
+        # exist).
+        general = doc.getElementsByTagName('general')
+        gfx = doc.getElementsByTagName('GFX')
+        pos = doc.getElementsByTagName('pos')
+        presence = doc.getElementsByTagName('presence')
+        techs = doc.getElementsByTagName('tech')
+        virtual = doc.getElementsByTagName('virtual')
+
+        self.name = doc.documentElement.getAttribute('name')
+
+        # Set the asset's position, graphics, and virtual-ness.
+        self.pos = (Coords() if not pos else Coords(pos[0]))
+        self.gfx = ({} if not gfx else
+                    dict((child.tagName, nodetext(child))
+                          for child in gfx[0].childNodes
+                          if child.nodeType == child.ELEMENT_NODE))
+        self.virtual = bool(virtual)
+
+        # Extract the faction presence data.
+        pres_data = ({} if not presence else
+                     dict(('range_' if child.tagName == 'range'
+                           else child.tagName, nodetext(child))
+                          for child in presence[0].childNodes
+                          if child.nodeType == child.ELEMENT_NODE))
+        self.presence = Presence(**pres_data)
+
+        # Extract the list of technologies, each of which is an <item> under
+        # the <tech> element.
+        self.techs = set()
+        if techs:
+            for tech in techs[0].getElementsByTagName('item'):
+                self.techs.add(nodetext(tech))
+
+        # Extract the <general> information.
+        bar_desc = None
+        commodities = None
+        # Do we even have a <general> element?
+        if general:
+            for child in general[0].childNodes:
+                # We're only interested in child elements.
+                if child.nodeType != child.ELEMENT_NODE:
+                    continue
+
+                if child.tagName == 'bar':
+                    bar_desc = nodetext(child)
+                elif child.tagName == 'commodities':
+                    # Get the set of child <commodity> nodes' content.
+                    c_nodes = child.getElementsByTagName('commodity')
+                    commodities = set(nodetext(c) for c in c_nodes)
+                elif child.tagName == 'services':
+                    # Find which service type elements are present and get
+                    # their content (if any -- most will be empty).
+                    services = {}
+                    for service in child.childNodes:
+                        if service.nodeType != service.ELEMENT_NODE:
+                            continue
+                        services[service.tagName] = nodetext(service)
+                    self.services = self._make_services(services)
                 else:
-                    # Put the bar description into the services -- if there is
-                    # a bar there! If there isn't, the text is discarded.
-                    if bar_desc is not None and self.services.bar is not None:
-                        self.services.bar = bar_desc
-                    # Put the commodities list into the services -- again, only
-                    # if there are commodities traded here.
-                    if (commodities is not None and
-                        self.services.commodities is not None):
-                        self.services.commodities = commodities
-
-
-class SSystem:
+                    # Everything else is just defined by its content.
+                    self._set_general(child.tagName, nodetext(child))
+
+        return bar_desc, commodities
+
+    def _load_expat(self, f):
+        '''Read the asset data from a file by streaming it through expat.
+
+        Returns the bar description and the set of commodities traded,
+        either of which may be None, for the caller to finalise.
+
+        '''
+        pos = {}
+        pres_data = {}
+        general = {'bar': None, 'commodities': None, 'services': None}
+        self.gfx = {}
+        self.techs = set()
+        self.virtual = False
+
+        def start(path, attrs):
+            depth = len(path)
+            if depth == 1:
+                self.name = attrs.get('name', '')
+            elif depth == 2 and path[1] == 'virtual':
+                self.virtual = True
+            elif depth == 3 and path[1] == 'general':
+                # Containers whose contents arrive as child elements.
+                if path[2] == 'commodities':
+                    general['commodities'] = set()
+                elif path[2] == 'services':
+                    general['services'] = {}
+
+        def end(path, content):
+            depth = len(path)
+            if depth == 3:
+                section, tag = path[1], path[2]
+                if section == 'pos':
+                    pos[tag] = content
+                elif section == 'GFX':
+                    self.gfx[tag] = content
+                elif section == 'presence':
+                    pres_data['range_' if tag == 'range' else tag] = content
+                elif section == 'tech':
+                    if tag == 'item':
+                        self.techs.add(content)
+                elif section == 'general':
+                    if tag == 'bar':
+                        general['bar'] = content
+                    elif tag == 'services':
+                        self.services = self._make_services(
+                            general['services'])
+                    elif tag != 'commodities':
+                        # Everything else is just defined by its content.
+                        self._set_general(tag, content)
+            elif depth == 4 and path[1] == 'general':
+                if path[2] == 'commodities' and path[3] == 'commodity':
+                    general['commodities'].add(content)
+                elif path[2] == 'services':
+                    general['services'][path[3]] = content
+
+        expat_parse(f, start, end)
+
+        self.pos = (Coords() if 'x' not in pos else
+                    Coords(pos['x'], pos['y']))
+        self.presence = Presence(**pres_data)
+
+        return general['bar'], general['commodities']
+
+
+class SSystem(Record):
     '''Represents a star system.
 
     Instance attributes:
@@ -353,13 +690,27 @@ class SSystem:
             is supposed to represent.
 
     '''
-    def __init__(self, filename=None):
+    __slots__ = ('assets', 'interference', 'jumps', 'name', 'nebula', 'pos',
+                 'radius', 'stars')
+    _interned = ('assets', 'jumps', 'name')
+
+    # The types of the simple children of <general>, by tag. Any others are
+    # not part of the model, and are ignored.
+    _GENERAL_TYPES = {'interference': float,
+                      'radius': float,
+                      'stars': int}
+
+    def __init__(self, filename=None, parser=None):
         '''Construct the star system from an XML file.
 
         Keyword arguments:
-            filename -- The filename of the XML system data. If omitted,
-                a zero-size system without any interesting attributes is
-                created.
+            filename -- The filename of the XML system data, or a
+                binary file object to read it from (which is closed
+                afterwards). If omitted, a zero-size system without any
+                interesting attributes is created.
+            parser -- The name of the XML parser backend to use, either
+                'expat' or 'minidom'. If omitted, the module-level
+                PARSER setting is used.
 
         '''
         if filename is None:
@@ -373,59 +724,184 @@ class SSystem:
             self.radius = 0.0
             self.stars = 0
         else:
-            # Read the star system from the given file.
-            with open(filename) as f:
-                # Grab the elements we want.
-                doc = xml.dom.minidom.parse(f)
-                assets = doc.getElementsByTagName('asset')
-                general = doc.getElementsByTagName('general')[0]
-                jumps = doc.getElementsByTagName('jump')
-                pos = doc.getElementsByTagName('pos')[0]
-
-                self.name = doc.documentElement.getAttribute('name')
-
-                # Get the system's position, assets (planets and stations and
-                # such), and jump points.
-                self.pos = Coords(pos)
-                self.assets = set(nodetext(asset) for asset in assets)
-
-                self.jumps = {}
-                for jump in jumps:
-                    autopos = jump.getElementsByTagName('autopos')
-                    exit_only = jump.getElementsByTagName('exitonly')
-                    # We don't index the NodeList of <pos> tags yet because it
-                    # might be empty, if <autopos/> is present.
-                    pos = jump.getElementsByTagName('pos')
-                    jump_pos = ((None, None) if autopos
-                                else (pos[0].getAttribute('x'),
-                                      pos[0].getAttribute('y')))
-                    hide = nodetext(jump.getElementsByTagName('hide')[0])
-
-                    self.jumps[jump.getAttribute('target')] = Jump(jump_pos,
-                                                                   hide,
-                                                                   exit_only)
-
-                # Extract the <general> information. Initialise each one just
-                # in case it's missing.
-                self.interference = 0.0
-                self.nebula = None
-                self.radius = 0.0
-                self.stars = 0
-                for child in general.childNodes:
-                    # We're only interested in child elements.
-                    if child.nodeType != child.ELEMENT_NODE:
-                        continue
-
-                    content = nodetext(child)
-                    if child.tagName == 'nebula':
+            # Read the star system from the given file. If the parser
+            # argument is not a known backend, a KeyError will result. Let
+            # it propagate upwards.
+            load = {'expat': self._load_expat,
+                    'minidom': self._load_minidom}[parser or PARSER]
+            with datafile(filename) as f:
+                load(f)
+            # And just in case <nebula> was absent...
+            if self.nebula is None:
+                self.nebula = Nebula()
+            self._intern()
+
+    def _set_general(self, tag, content):
+        '''Set a system attribute from a simple child of <general>.'''
+        try:
+            child_type = self._GENERAL_TYPES[tag]
+        except KeyError:
+            # Not something we keep track of.
+            return
+        self.__setattr__(tag, child_type(content))
+
+    def _load_minidom(self, f):
+        '''Read the star system data from a file using a minidom tree.'''
+        # Grab the elements we want.
+        doc = xml.dom.minidom.parse(f)
+        assets = doc.getElementsByTagName('asset')
+        general = doc.getElementsByTagName('general')[0]
+        jumps = doc.getElementsByTagName('jump')
+        pos = doc.getElementsByTagName('pos')[0]
+
+        self.name = doc.documentElement.getAttribute('name')
+
+        # Get the system's position, assets (planets and stations and such),
+        # and jump points.
+        self.pos = Coords(pos)
+        self.assets = set(nodetext(asset) for asset in assets)
+
+        self.jumps = {}
+        for jump in jumps:
+            autopos = jump.getElementsByTagName('autopos')
+            exit_only = jump.getElementsByTagName('exitonly')
+            # We don't index the NodeList of <pos> tags yet because it might
+            # be empty, if <autopos/> is present.
+            pos = jump.getElementsByTagName('pos')
+            jump_pos = ((None, None) if autopos
+                        else (pos[0].getAttribute('x'),
+                              pos[0].getAttribute('y')))
+            hide = nodetext(jump.getElementsByTagName('hide')[0])
+
+            self.jumps[jump.getAttribute('target')] = Jump(jump_pos, hide,
+                                                           exit_only)
+
+        # Extract the <general> information. Initialise each one just in
+        # case it's missing.
+        self.interference = 0.0
+        self.nebula = None
+        self.radius = 0.0
+        self.stars = 0
+        for child in general.childNodes:
+            # We're only interested in child elements.
+            if child.nodeType != child.ELEMENT_NODE:
+                continue
+
+            content = nodetext(child)
+            if child.tagName == 'nebula':
+                # The <nebula> tag has a couple of bits of info.
+                self.nebula = Nebula(content,
+                                     child.getAttribute('volatility'))
+            else:
+                # Everything else is just a single piece of content.
+                self._set_general(child.tagName, content)
+
+    def _load_expat(self, f):
+        '''Read the star system data from a file by streaming it through
+        expat.'''
+        pos = {}
+        # Attributes of the element being read, where they're needed at the
+        # end tag, and the jump point currently being read.
+        attrs_for = {}
+        jump = {}
+
+        self.assets = set()
+        self.jumps = {}
+        self.interference = 0.0
+        self.nebula = None
+        self.radius = 0.0
+        self.stars = 0
+
+        def start(path, attrs):
+            depth = len(path)
+            if depth == 1:
+                self.name = attrs.get('name', '')
+            elif depth == 3:
+                if path[1] == 'jumps' and path[2] == 'jump':
+                    jump.clear()
+                    jump['target'] = attrs.get('target', '')
+                elif path[1] == 'general' and path[2] == 'nebula':
+                    attrs_for['nebula'] = attrs
+            elif depth == 4 and path[1] == 'jumps':
+                if path[3] == 'pos':
+                    jump['pos'] = (attrs.get('x', ''), attrs.get('y', ''))
+                else:
+                    jump[path[3]] = True
+
+        def end(path, content):
+            depth = len(path)
+            if depth == 3:
+                section, tag = path[1], path[2]
+                if section == 'pos':
+                    pos[tag] = content
+                elif section == 'assets':
+                    if tag == 'asset':
+                        self.assets.add(content)
+                elif section == 'jumps':
+                    if tag == 'jump':
+                        jump_pos = ((None, None) if 'autopos' in jump
+                                    else jump['pos'])
+                        self.jumps[jump['target']] = Jump(
+                            jump_pos, jump['hide'], 'exitonly' in jump)
+                elif section == 'general':
+                    if tag == 'nebula':
                         # The <nebula> tag has a couple of bits of info.
-                        self.nebula = Nebula(content,
-                                             child.getAttribute('volatility'))
+                        volatility = attrs_for['nebula'].get('volatility', '')
+                        self.nebula = Nebula(content, volatility)
                     else:
                         # Everything else is just a single piece of content.
-                        # <stars> is an int; the rest are floats.
-                        child_type = int if child.tagName == 'stars' else float
-                        self.__setattr__(child.tagName, child_type(content))
-                # And just in case <nebula> was absent...
-                if self.nebula is None:
-                    self.nebula = Nebula()
+                        self._set_general(tag, content)
+            elif depth == 4 and path[1] == 'jumps' and path[3] == 'hide':
+                jump['hide'] = content
+
+        expat_parse(f, start, end)
+
+        self.pos = Coords(pos['x'], pos['y'])
+
+
+def _state(obj):
+    '''Reduce a data object to plain values, for comparing objects.'''
+    if isinstance(obj, Record):
+        return (type(obj).__name__, _state(obj.__getstate__()))
+    elif isinstance(obj, dict):
+        return dict((key, _state(val)) for key, val in obj.items())
+    else:
+        return obj
+
+def check_parity(naevroot=None, out=sys.stdout):
+    '''Check that the parser backends agree on every data file.
+
+    Each star system and asset file is loaded once with each backend,
+    and any file whose resulting objects differ is reported.
+
+    Keyword arguments:
+        naevroot -- The root of the Naev source tree, or an archive of
+            its data, as for dataloader.datafiles(). If omitted, the
+            current directory is used.
+        out -- A file-like object to report mismatches to. Defaults to
+            standard output.
+    Returns:
+        The number of files checked and the number of mismatches, as a
+        2-tuple.
+
+    '''
+    # Imported here so that the data model doesn't depend on the loaders.
+    from dataloader import data_source, datafiles
+
+    source = data_source(naevroot)
+    checked = mismatches = 0
+    for dataset, cls in (('SSystems', SSystem), ('Assets', Asset)):
+        for filename in datafiles(dataset, source):
+            checked += 1
+            reference = _state(cls(source.open(filename), parser='minidom'))
+            streamed = _state(cls(source.open(filename), parser='expat'))
+            if streamed != reference:
+                mismatches += 1
+                print('Parser mismatch in {}'.format(filename), file=out)
+    return checked, mismatches
+
+if __name__ == '__main__':
+    # Run from the root of the Naev source tree to compare the backends.
+    checked, mismatches = check_parity()
+    print('{} files checked, {} mismatches.'.format(checked, mismatches))
+    sys.exit(1 if mismatches else 0)
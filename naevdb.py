@@ -1,6 +1,31 @@
 #!/usr/bin/env python3
 
-'''Store and retrieve Naev data in a SQLite database.'''
+'''Store and retrieve Naev data in a SQLite database.
+
+Run this script from the root directory of your Naev source tree, with
+the name of the database file to create. Example usage:
+    user@home:~/naev/$ naevdb naev.db
+
+Each build is written to a temporary file, checked, and only then
+moved into place, so that programs reading the database never see it
+half-built. Pass --rebuild to build afresh over an existing database.
+
+Pass --update to bring an existing database up to date instead. Only
+the data files changed since it was built (or last updated) are read
+again, and the star systems and assets keep their IDs:
+    user@home:~/naev/$ naevdb --update naev.db
+
+Pass --autopos to store the in-game positions of autopositioned jump
+points too (see autopos.py). An update keeps doing so for a database
+built that way.
+
+Pass --check-plans to check that none of the accessors in this library
+falls back to a full table scan. The check is run against a database of
+a random universe, built for the purpose, or against an existing
+database file if one is named. The exit status is 1 if any of the
+accessors does fall back.
+
+'''
 
 # Copyright © 2012 Tim Pederick.
 #
@@ -20,12 +45,19 @@
 # Standard library imports.
 from collections import defaultdict
 import os
+import re
 import sqlite3 as db
 import sys
 
+# Third-party imports.
+import numpy as np
+
 # Local imports.
-from dataloader import datafiles
-from naevdata import Asset, Jump, SSystem
+from autopos import autopositions
+from dataloader import (data_root, data_source, datafiles, load_dataset,
+                        parse_files, temp_file, use_cache)
+from naevdata import Jump, SSystem
+from universe import Universe
 
 def adapt_boolean(boolean):
     '''Adapt (i.e. map from Python to SQLite3) boolean values.'''
@@ -37,12 +69,161 @@ def convert_boolean(bool_column):
     return bool(bool_column)
 db.register_converter('BOOLEAN', convert_boolean)
 
-def make_db(conn):
-    '''Create an empty database.'''
+# The version of the database schema, stamped into each database as its
+# user_version. Databases built before versioning are version 0.
+SCHEMA_VERSION = 4
+
+# Secondary indexes, created once the tables are filled. Each entry is a
+# 2-tuple of the index name and its definition. Between them and the
+# UNIQUE constraints on names, every lookup by name or by foreign key (in
+# either direction, for the sake of cascading deletes) is indexed.
+INDEXES = (('JumpsByFromID', 'Jumps (JumpFromID)'),
+           ('JumpsByToID', 'Jumps (JumpToID)'),
+           ('AssetsBySSysID', 'Assets (SSysID)'),
+           ('SSysVAssetsByVAssetID', 'SSysVAssets (VAssetID)'),
+           ('SSysPresenceByFaction', 'SSysPresence (Faction, Presence)'))
+
+# PRAGMA settings used while bulk loading a new database. They trade safety
+# against crashes for speed, which costs nothing when a failed build would
+# just be started again.
+BULK_PRAGMAS = (('journal_mode', 'MEMORY'),
+                ('synchronous', 'OFF'),
+                ('cache_size', -64 * 1024),
+                ('temp_store', 'MEMORY'))
+
+# The data files the database was built from, so that it can be updated
+# when they change. Name is the name of the star system or asset in the
+# file, or NULL if it could not be loaded.
+SOURCE_FILES_TABLE = '''CREATE TABLE IF NOT EXISTS SourceFiles (
+                          Path TEXT PRIMARY KEY
+                        , Dataset TEXT NOT NULL
+                        , MTime INTEGER NOT NULL
+                        , Size INTEGER NOT NULL
+                        , Digest BLOB
+                        , Name TEXT
+                        )'''
+
+# The R-tree spatial indexes of positions. Each entry is a 6-tuple of the
+# index name, and the table, ID column, name column, and X and Y position
+# columns it indexes. Each position is indexed as a box with no size.
+RTREES = (('SSysRTree', 'SSystems', 'SSysID', 'SSysName',
+           'SSysPosX', 'SSysPosY'),
+          ('AssetRTree', 'Assets', 'AssetID', 'AssetName',
+           'AssetPosX', 'AssetPosY'))
+
+# How far around a point to look for its nearest neighbours at first.
+NEAREST_RADIUS = 500
+
+# The effective presence of each faction in each system, counting that
+# spilled over from nearby systems. Filled in by store_presence().
+PRESENCE_TABLE = '''CREATE TABLE IF NOT EXISTS SSysPresence (
+                      SSysID INTEGER NOT NULL
+                      REFERENCES SSystems
+                        ON DELETE CASCADE
+                    , Faction TEXT NOT NULL
+                    , Presence REAL NOT NULL
+                    , PRIMARY KEY (SSysID, Faction)
+                    )'''
+
+# The statements used to store each kind of row. The ID column is given
+# explicitly when bulk loading, or left as None to be assigned by SQLite.
+SSYS_INSERT = '''INSERT INTO SSystems (
+                   SSysID, SSysName, SSysPosX, SSysPosY, SSysRadius, SSysStars
+                 , SSysInterference, SSysNebulaDensity, SSysNebulaVolatility
+                 ) VALUES (
+                   ?, ?, ?, ?, ?, ?
+                 , ?, ?, ?
+                 )'''
+JUMP_INSERT = '''INSERT INTO Jumps (
+                   JumpFromID, JumpToID, JumpPosX, JumpPosY,
+                   JumpHide, JumpIsExitOnly, JumpIsAutoPos
+                 ) VALUES (
+                   ?, ?, ?, ?
+                 , ?, ?, ?
+                 )'''
+ASSET_INSERT = '''INSERT INTO Assets (
+                    AssetID, AssetName, SSysID, AssetSpaceGfx, AssetExteriorGfx
+                  , AssetPosX, AssetPosY
+                  , AssetFaction, AssetPresence, AssetPresenceRange
+                  , AssetClass, AssetPopulation, AssetHide
+                  , AssetLandingRights, AssetHasRefuel, AssetBarDesc
+                  , AssetHasMissions, AssetHasOutfits, AssetHasShipyard
+                  ) VALUES (
+                    ?, ?, ?, ?, ?
+                  , ?, ?
+                  , ?, ?, ?
+                  , ?, ?, ?
+                  , ?, ?, ?
+                  , ?, ?, ?
+                  )'''
+VASSET_INSERT = '''INSERT INTO VirtualAssets (
+                     VAssetID, VAssetName, VAssetFaction
+                   , VAssetPresence, VAssetPresenceRange
+                   ) VALUES (
+                     ?, ?, ?
+                   , ?, ?
+                   )'''
+VASSET_LOCATION_INSERT = '''INSERT INTO SSysVAssets (SSysID, VAssetID)
+                            VALUES (?, ?)'''
+SOURCE_INSERT = '''INSERT OR REPLACE INTO SourceFiles (
+                     Path, Dataset, MTime, Size, Digest, Name
+                   ) VALUES (
+                     ?, ?, ?, ?, ?, ?
+                   )'''
+
+# The statements used to update rows in place, keeping their IDs. Each
+# takes the columns of the corresponding insert, less the ID and name,
+# followed by the ID.
+SSYS_UPDATE = '''UPDATE SSystems SET
+                   SSysPosX = ?, SSysPosY = ?, SSysRadius = ?, SSysStars = ?
+                 , SSysInterference = ?, SSysNebulaDensity = ?
+                 , SSysNebulaVolatility = ?
+                 WHERE SSysID = ?'''
+JUMP_UPDATE = '''UPDATE Jumps SET
+                   JumpPosX = ?, JumpPosY = ?
+                 , JumpHide = ?, JumpIsExitOnly = ?, JumpIsAutoPos = ?
+                 WHERE JumpID = ?'''
+ASSET_UPDATE = '''UPDATE Assets SET
+                    SSysID = ?, AssetSpaceGfx = ?, AssetExteriorGfx = ?
+                  , AssetPosX = ?, AssetPosY = ?
+                  , AssetFaction = ?, AssetPresence = ?, AssetPresenceRange = ?
+                  , AssetClass = ?, AssetPopulation = ?, AssetHide = ?
+                  , AssetLandingRights = ?, AssetHasRefuel = ?
+                  , AssetBarDesc = ?, AssetHasMissions = ?
+                  , AssetHasOutfits = ?, AssetHasShipyard = ?
+                  WHERE AssetID = ?'''
+VASSET_UPDATE = '''UPDATE VirtualAssets SET
+                     VAssetFaction = ?
+                   , VAssetPresence = ?, VAssetPresenceRange = ?
+                   WHERE VAssetID = ?'''
+
+# The datasets that go into the database, in the order they are loaded.
+SOURCE_DATASETS = ('SSystems', 'Assets')
+
+# The columns read to build a star system, in the order _ssys_from_row()
+# expects them.
+SSYS_COLUMNS = '''SSysID, SSysName, SSysPosX, SSysPosY, SSysRadius
+                , SSysStars, SSysInterference, SSysNebulaDensity
+                , SSysNebulaVolatility'''
+
+# The number of star systems read at a time by iter_ssystems().
+SSYS_CHUNK_SIZE = 256
+
+def make_db(conn, indexes=True):
+    '''Create an empty database.
+
+    Keyword arguments:
+        conn -- An open connection to the (empty) database.
+        indexes -- Whether or not to create the secondary indexes (and
+            spatial indexes) too. Defaults to True. If False,
+            make_indexes() and make_rtrees() should be called once the
+            tables are filled.
+
+    '''
     cur = conn.cursor()
     cur.execute('''CREATE TABLE SSystems (
                      SSysID INTEGER PRIMARY KEY AUTOINCREMENT
-                   , SSysName TEXT NOT NULL
+                   , SSysName TEXT UNIQUE NOT NULL
                    , SSysPosX REAL NOT NULL
                    , SSysPosY REAL NOT NULL
                    , SSysRadius REAL NOT NULL
@@ -63,6 +244,7 @@ def make_db(conn):
                    , JumpPosY REAL
                    , JumpHide REAL NOT NULL
                    , JumpIsExitOnly BOOLEAN NOT NULL
+                   , JumpIsAutoPos BOOLEAN NOT NULL
                    )''')
     cur.execute('''CREATE TABLE Assets (
                      AssetID INTEGER PRIMARY KEY AUTOINCREMENT
@@ -103,81 +285,385 @@ def make_db(conn):
                        ON DELETE CASCADE
                    , PRIMARY KEY (SSysID, VAssetID)
                    )''')
+    cur.execute(SOURCE_FILES_TABLE)
+    cur.execute(PRESENCE_TABLE)
+    cur.execute('PRAGMA user_version = {}'.format(SCHEMA_VERSION))
+    if indexes:
+        make_indexes(conn)
+        make_rtrees(conn)
 
-def store_ssys(conn, ssys):
-    '''Store a star system in an open database.'''
+def make_indexes(conn, indexes=INDEXES):
+    '''Create the secondary indexes in a database.
+
+    Keyword arguments:
+        conn -- An open database connection.
+        indexes -- The indexes to create, as for INDEXES. Defaults to
+            all of them.
+
+    '''
     cur = conn.cursor()
-    cur.execute('''INSERT INTO SSystems (
-                     SSysName, SSysPosX, SSysPosY, SSysRadius, SSysStars
-                   , SSysInterference, SSysNebulaDensity, SSysNebulaVolatility
-                   ) VALUES (
-                     ?, ?, ?, ?, ?
-                   , ?, ?, ?
-                   )''', (ssys.name, ssys.pos.x, ssys.pos.y, ssys.radius,
-                          ssys.stars, ssys.interference, ssys.nebula.density,
-                          ssys.nebula.volatility))
-
-def store_jumps(conn, ssys):
-    '''Store a star system's jump points in an open database.'''
+    for name, definition in indexes:
+        cur.execute('CREATE INDEX IF NOT EXISTS {} ON {}'.format(name,
+                                                                 definition))
+
+def make_rtrees(conn):
+    '''Create the spatial indexes in a database.
+
+    Each R-tree is filled from the rows already in its table, and kept
+    up to date by triggers from then on.
+
+    '''
     cur = conn.cursor()
-    from_id = get_ssys_id(conn, ssys.name)
-    for jumpdest, jump in ssys.jumps.items():
-        to_id = get_ssys_id(conn, jumpdest)
-        cur.execute('''INSERT INTO Jumps (
-                         JumpFromID, JumpToID, JumpPosX, JumpPosY,
-                         JumpHide, JumpIsExitOnly
-                       ) VALUES (
-                         ?, ?, ?, ?
-                       , ?, ?
-                       )''', (from_id, to_id, jump.x, jump.y,
-                              jump.hide, jump.exit_only))
-
-def store_asset(conn, asset, ssys=None):
-    '''Store an asset (virtual or not) in an open database.'''
+    for name, table, id_col, name_col, x_col, y_col in RTREES:
+        spec = {'name': name, 'table': table, 'id': id_col,
+                'x': x_col, 'y': y_col}
+        cur.execute('''CREATE VIRTUAL TABLE IF NOT EXISTS {name}
+                       USING rtree({id}, MinX, MaxX, MinY, MaxY)'''.format(
+                           **spec))
+        cur.execute('''INSERT OR REPLACE INTO {name}
+                       SELECT {id}, {x}, {x}, {y}, {y}
+                       FROM {table}'''.format(**spec))
+        cur.execute('''CREATE TRIGGER IF NOT EXISTS {name}Insert
+                       AFTER INSERT ON {table}
+                       BEGIN
+                         INSERT INTO {name} VALUES (
+                           new.{id}, new.{x}, new.{x}, new.{y}, new.{y}
+                         );
+                       END'''.format(**spec))
+        cur.execute('''CREATE TRIGGER IF NOT EXISTS {name}Update
+                       AFTER UPDATE OF {x}, {y} ON {table}
+                       BEGIN
+                         INSERT OR REPLACE INTO {name} VALUES (
+                           new.{id}, new.{x}, new.{x}, new.{y}, new.{y}
+                         );
+                       END'''.format(**spec))
+        cur.execute('''CREATE TRIGGER IF NOT EXISTS {name}Delete
+                       AFTER DELETE ON {table}
+                       BEGIN
+                         DELETE FROM {name} WHERE {id} = old.{id};
+                       END'''.format(**spec))
+
+def _migrate_0(conn):
+    '''Migrate a database from before versioning to version 1.
+
+    Such a database may lack the secondary indexes (including the one
+    on star system names, from their UNIQUE constraint), and lacks the
+    SourceFiles table. With no data files recorded, the next update
+    relinks the whole database.
+
+    '''
+    conn.execute(SOURCE_FILES_TABLE)
+    # Only the indexes there were as of version 1.
+    make_indexes(conn, INDEXES[:4])
+    indexed = [conn.execute('PRAGMA index_info({})'.format(row[1])).fetchall()
+               for row in conn.execute('PRAGMA index_list(SSystems)')]
+    if not any(len(columns) == 1 and columns[0][2] == 'SSysName'
+               for columns in indexed):
+        conn.execute('''CREATE UNIQUE INDEX SSystemsByName
+                        ON SSystems (SSysName)''')
+
+def _migrate_1(conn):
+    '''Migrate a database from version 1 to version 2.
+
+    Version 2 adds the SSysPresence table.
+
+    '''
+    conn.execute(PRESENCE_TABLE)
+    make_indexes(conn, INDEXES[4:5])
+    store_presence(conn)
+
+def _migrate_2(conn):
+    '''Migrate a database from version 2 to version 3.
+
+    Version 3 adds the R-tree spatial indexes.
+
+    '''
+    make_rtrees(conn)
+
+def _migrate_3(conn):
+    '''Migrate a database from version 3 to version 4.
+
+    Version 4 marks autopositioned jumps with JumpIsAutoPos, so that
+    their positions can be stored too. Until now, they were the jumps
+    without a position.
+
+    '''
+    conn.execute('''ALTER TABLE Jumps
+                    ADD COLUMN JumpIsAutoPos BOOLEAN NOT NULL DEFAULT 0''')
+    conn.execute('''UPDATE Jumps SET JumpIsAutoPos = 1
+                    WHERE JumpPosX IS NULL''')
+
+# The migrations from each old schema version to the next.
+MIGRATIONS = {0: _migrate_0,
+              1: _migrate_1,
+              2: _migrate_2,
+              3: _migrate_3}
+
+
+class SchemaError(db.DatabaseError):
+    '''Raised for a database with the wrong schema version.'''
+    pass
+
+def schema_version(conn):
+    '''Get the schema version of an open database.'''
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+def check_schema(conn, migrate=False):
+    '''Check that an open database has the current schema version.
+
+    The version is kept in the database header, so checking it is cheap
+    enough to do every time a database is opened.
+
+    Keyword arguments:
+        conn -- An open database connection.
+        migrate -- Whether to migrate a database with an old schema to
+            the current one (which needs write access), rather than
+            refusing it. The default is False.
+    Raises:
+        SchemaError -- If the database has the wrong schema version and
+            can't (or shouldn't) be migrated.
+
+    '''
+    version = schema_version(conn)
+    if version == SCHEMA_VERSION:
+        return
+    if version > SCHEMA_VERSION:
+        raise SchemaError('database schema version {} is newer than this '
+                          'naevdb supports ({})'.format(version,
+                                                        SCHEMA_VERSION))
+    if version == 0 and conn.execute(
+        '''SELECT 1 FROM sqlite_master
+           WHERE type = 'table' AND name = 'SSystems' ''').fetchone() is None:
+        raise SchemaError('not a Naev database')
+    if not migrate:
+        raise SchemaError('database schema version {} is out of date (the '
+                          'current version is {}); update or rebuild '
+                          'it'.format(version, SCHEMA_VERSION))
+
+    # Migrate in a single transaction, so that a failed migration leaves
+    # the database as it was.
+    isolation_level = conn.isolation_level
+    conn.isolation_level = None
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # Check again, in case another connection got here first.
+            version = schema_version(conn)
+            while version < SCHEMA_VERSION:
+                MIGRATIONS[version](conn)
+                version += 1
+            conn.execute('PRAGMA user_version = {}'.format(version))
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+    finally:
+        conn.isolation_level = isolation_level
+
+def connect(filename, migrate=False):
+    '''Open an existing Naev database, checking its schema version.
+
+    Keyword arguments:
+        filename -- The name of the database file.
+        migrate -- As for check_schema().
+    Returns:
+        An open sqlite3.Connection to the database.
+
+    '''
+    if not os.path.exists(filename):
+        raise IOError("database file '{}' does not exist".format(filename))
+    conn = db.connect(filename)
+    try:
+        check_schema(conn, migrate)
+    except BaseException:
+        conn.close()
+        raise
+    return conn
+
+def verify_db(conn):
+    '''Check the integrity of an open database.
+
+    This reads the whole database, so it is meant for checking a new
+    build before it is put to use.
+
+    Raises:
+        sqlite3.DatabaseError -- If the database is corrupt, or any row
+            refers to a row that doesn't exist.
+        SchemaError -- If the database has the wrong schema version.
+
+    '''
+    problems = [row[0] for row in conn.execute('PRAGMA integrity_check')]
+    if problems != ['ok']:
+        raise db.DatabaseError('integrity check failed: ' +
+                               '; '.join(problems))
+    orphans = conn.execute('PRAGMA foreign_key_check').fetchall()
+    if orphans:
+        raise db.DatabaseError('{} rows refer to missing rows (the first '
+                               'in table {})'.format(len(orphans),
+                                                     orphans[0][0]))
+    check_schema(conn)
+
+def _ssys_row(ssys, ssys_id=None):
+    '''Get the SSystems row for a star system.'''
+    return (ssys_id, ssys.name, ssys.pos.x, ssys.pos.y, ssys.radius,
+            ssys.stars, ssys.interference, ssys.nebula.density,
+            ssys.nebula.volatility)
+
+def _jump_row(from_id, to_id, jump):
+    '''Get the Jumps row for a jump point.'''
+    return (from_id, to_id, jump.x, jump.y, jump.hide, jump.exit_only,
+            jump.x is None)
+
+def _asset_row(asset, ssys_id, asset_id=None):
+    '''Get the Assets or VirtualAssets row for an asset.'''
+    if asset.virtual:
+        return (asset_id, asset.name, asset.presence.faction,
+                asset.presence.value, asset.presence.range)
+    return (asset_id, asset.name, ssys_id,
+            asset.gfx.get('space'), asset.gfx.get('exterior'),
+            asset.pos.x, asset.pos.y, asset.presence.faction,
+            asset.presence.value, asset.presence.range,
+            asset.world_class, asset.population, asset.hide,
+            asset.services.land, asset.services.refuel,
+            asset.services.bar, asset.services.missions,
+            asset.services.outfits, asset.services.shipyard)
+
+class IDMap:
+    '''Maps the names of star systems and assets to their database IDs.
+
+    Passing an IDMap to the store_*() and get_*_id() functions saves
+    them from querying the database for every ID they need. The map is
+    filled in as rows are stored through it, and can be preloaded from
+    an existing database with one query per table. A name missing from
+    the map is looked up in the database (in case it was stored some
+    other way) and remembered if it is found.
+
+    Instance attributes:
+        ssystems -- A mapping of star system names to their IDs.
+        assets -- A mapping of concrete asset names to their IDs.
+        vassets -- A mapping of virtual asset names to their IDs.
+
+    '''
+    # The table and columns behind each mapping.
+    _TABLES = {'ssystems': ('SSystems', 'SSysName', 'SSysID'),
+               'assets': ('Assets', 'AssetName', 'AssetID'),
+               'vassets': ('VirtualAssets', 'VAssetName', 'VAssetID')}
+
+    def __init__(self, conn=None):
+        '''Create the map.
+
+        Keyword arguments:
+            conn -- An open database connection to preload the IDs
+                from. If omitted, the map starts empty.
+
+        '''
+        self.ssystems = {}
+        self.assets = {}
+        self.vassets = {}
+        if conn is not None:
+            self.preload(conn)
+
+    def preload(self, conn):
+        '''Load all of the IDs from an open database.'''
+        for attr, (table, name_col, id_col) in self._TABLES.items():
+            # If a name appears more than once, the lowest ID wins, as it
+            # would for a one-off query.
+            setattr(self, attr, dict(conn.execute(
+                'SELECT {}, {} FROM {} ORDER BY {} DESC'.format(
+                    name_col, id_col, table, id_col))))
+
+    def lookup(self, conn, attr, name):
+        '''Get the ID for a name in one of the mappings.
+
+        Keyword arguments:
+            conn -- An open database connection, to search if the name
+                isn't in the mapping.
+            attr -- The name of the mapping: 'ssystems', 'assets', or
+                'vassets'.
+            name -- The name to look up.
+        Returns:
+            The ID, or None if there is no such name in the database.
+
+        '''
+        ids = getattr(self, attr)
+        try:
+            return ids[name]
+        except KeyError:
+            pass
+        row = _query_id(conn, self._TABLES[attr], name)
+        if row is not None:
+            ids[name] = row
+        return row
+
+def _query_id(conn, table_spec, name):
+    '''Look up one ID in the database.'''
+    table, name_col, id_col = table_spec
+    cur = conn.cursor()
+    cur.execute('SELECT {} FROM {} WHERE {} = ?'.format(id_col, table,
+                                                        name_col), (name,))
+    row = cur.fetchone()
+    return (None if row is None else row[0])
+
+def store_ssys(conn, ssys, ids=None):
+    '''Store a star system in an open database.
+
+    If an IDMap is given, the new system's ID is added to it.
+
+    '''
+    cur = conn.cursor()
+    cur.execute(SSYS_INSERT, _ssys_row(ssys))
+    if ids is not None:
+        ids.ssystems[ssys.name] = cur.lastrowid
+
+def store_jumps(conn, ssys, ids=None):
+    '''Store a star system's jump points in an open database.
+
+    If an IDMap is given, the systems' IDs are found through it.
+
+    '''
+    cur = conn.cursor()
+    from_id = get_ssys_id(conn, ssys.name, ids)
+    cur.executemany(JUMP_INSERT, [_jump_row(from_id,
+                                            get_ssys_id(conn, jumpdest, ids),
+                                            jump)
+                                  for jumpdest, jump in ssys.jumps.items()])
+
+def store_asset(conn, asset, ssys=None, ids=None):
+    '''Store an asset (virtual or not) in an open database.
+
+    If an IDMap is given, the system's ID is found through it, and the
+    new asset's ID is added to it.
+
+    '''
     cur = conn.cursor()
     if asset.virtual:
-        cur.execute('''INSERT INTO VirtualAssets (
-                         VAssetName, VAssetFaction
-                       , VAssetPresence, VAssetPresenceRange
-                       ) VALUES (
-                         ?, ?, ?, ?
-                       )''', (asset.name, asset.presence.faction,
-                              asset.presence.value, asset.presence.range))
+        cur.execute(VASSET_INSERT, _asset_row(asset, None))
+        if ids is not None:
+            ids.vassets[asset.name] = cur.lastrowid
     else:
-        cur.execute('''INSERT INTO Assets (
-                         AssetName, SSysID, AssetSpaceGfx, AssetExteriorGfx
-                       , AssetPosX, AssetPosY
-                       , AssetFaction, AssetPresence, AssetPresenceRange
-                       , AssetClass, AssetPopulation, AssetHide
-                       , AssetLandingRights, AssetHasRefuel, AssetBarDesc
-                       , AssetHasMissions, AssetHasOutfits, AssetHasShipyard
-                       ) VALUES (
-                         ?, ?, ?, ?
-                       , ?, ?
-                       , ?, ?, ?
-                       , ?, ?, ?
-                       , ?, ?, ?
-                       , ?, ?, ?
-                       )''',
-                    (asset.name, get_ssys_id(conn, ssys),
-                     asset.gfx.get('space'), asset.gfx.get('exterior'),
-                     asset.pos.x, asset.pos.y, asset.presence.faction,
-                     asset.presence.value, asset.presence.range,
-                     asset.world_class, asset.population, asset.hide,
-                     asset.services.land, asset.services.refuel,
-                     asset.services.bar, asset.services.missions,
-                     asset.services.outfits, asset.services.shipyard))
-
-def store_vasset_location(conn, ssys, vasset):
-    '''Record a location of a virtual asset in an open database.'''
+        cur.execute(ASSET_INSERT, _asset_row(asset,
+                                             get_ssys_id(conn, ssys, ids)))
+        if ids is not None:
+            ids.assets[asset.name] = cur.lastrowid
+
+def store_vasset_location(conn, ssys, vasset, ids=None):
+    '''Record a location of a virtual asset in an open database.
+
+    If an IDMap is given, the IDs are found through it.
+
+    '''
     assert vasset.virtual
     cur = conn.cursor()
-    cur.execute('''INSERT INTO SSysVAssets (SSysID, VAssetID)
-                   VALUES (?, ?)''', (get_ssys_id(conn, ssys),
-                                      get_asset_id(conn, vasset)))
+    cur.execute(VASSET_LOCATION_INSERT, (get_ssys_id(conn, ssys, ids),
+                                         get_asset_id(conn, vasset,
+                                                      ids=ids)))
+
+def get_ssys_id(conn, ssys, ids=None):
+    '''Get the database ID for the given star system.
 
-def get_ssys_id(conn, ssys):
-    '''Get the database ID for the given star system.'''
+    If an IDMap is given, it is consulted before the database.
+
+    '''
     try:
         # Get the name of the star system.
         name = ssys.name
@@ -185,13 +671,16 @@ def get_ssys_id(conn, ssys):
         # We were given just a name, not an SSystem object.
         name = ssys
 
-    cur = conn.cursor()
-    cur.execute('SELECT SSysID FROM SSystems WHERE SSysName = ?', (name,))
-    row = cur.fetchone()
-    return (None if row is None else row[0])
+    if ids is not None:
+        return ids.lookup(conn, 'ssystems', name)
+    return _query_id(conn, IDMap._TABLES['ssystems'], name)
 
-def get_asset_id(conn, asset, is_virtual=None):
-    '''Get the database ID for the given asset.'''
+def get_asset_id(conn, asset, is_virtual=None, ids=None):
+    '''Get the database ID for the given asset.
+
+    If an IDMap is given, it is consulted before the database.
+
+    '''
     try:
         # Get the name of the asset.
         name = asset.name
@@ -202,103 +691,193 @@ def get_asset_id(conn, asset, is_virtual=None):
         # If we have an Asset object, ignore the is_virtual argument.
         is_virtual = asset.virtual
 
-    cur = conn.cursor()
+    if ids is None:
+        lookup = lambda attr, name: _query_id(conn, IDMap._TABLES[attr], name)
+    else:
+        lookup = lambda attr, name: ids.lookup(conn, attr, name)
+
     if is_virtual or is_virtual is None:
         # Try to find it in the virtual assets.
-        cur.execute('SELECT VAssetID FROM VirtualAssets WHERE VAssetName = ?',
-                    (name,))
-        row = cur.fetchone()
-        if row is not None:
-            return row[0]
+        asset_id = lookup('vassets', name)
+        if asset_id is not None:
+            return asset_id
 
     # To have gotten to this point, either the we know the asset is not
     # virtual, or we don't know whether it is or not BUT we didn't find it in
     # the virtual assets, or we thought it was virtual BUT, again, we couldn't
     # find it. In any case, try to find it in the concrete assets.
-    cur.execute('SELECT AssetID FROM Assets WHERE AssetName = ?', (name,))
-    row = cur.fetchone()
-    return (None if row is None else row[0])
+    return lookup('assets', name)
+
+def _ssys_from_row(row):
+    '''Build a star system (without jumps or assets) from a row.
+
+    The row holds the columns in SSYS_COLUMNS, in order.
+
+    '''
+    ssys = SSystem()
+    (ssys_id, ssys.name, ssys.pos.x, ssys.pos.y, ssys.radius, ssys.stars,
+     ssys.interference, ssys.nebula.density, ssys.nebula.volatility) = row
+    return ssys
+
+def _hydrate(conn, ssystems, first_id=None, last_id=None):
+    '''Fill in the jumps and assets of a run of star systems.
+
+    Three queries are made, however many systems there are: one each
+    for the jumps, the concrete assets, and the virtual assets.
+
+    Keyword arguments:
+        conn -- An open database connection.
+        ssystems -- A mapping of IDs to SSystem objects, holding every
+            system with an ID from first_id to last_id inclusive.
+        first_id, last_id -- The range of system IDs to fill in. If
+            omitted, the systems in the mapping are picked out by ID
+            instead, so they needn't be a run of consecutive IDs.
+
+    '''
+    if first_id is None:
+        condition = 'IN ({})'.format(', '.join('?' * len(ssystems)))
+        params = list(ssystems)
+    else:
+        condition = 'BETWEEN ? AND ?'
+        params = (first_id, last_id)
 
-def _get_ssys_extras(conn, ssys, ssys_id):
-    '''Get star system data from outside the SSystems table.'''
-    # Get the system jump data.
     cur = conn.cursor()
+    # Get the system jump data.
     cur.execute('''SELECT
-                     s.SSysName
+                     j.JumpFromID, s.SSysName
                    , j.JumpPosX, j.JumpPosY, j.JumpHide, j.JumpIsExitOnly
+                   , j.JumpIsAutoPos
                    FROM
-                     SSystems s JOIN
-                     Jumps j ON s.SSysID = j.JumpToID
-                   WHERE j.JumpFromID = ?''', (ssys_id,))
+                     Jumps j JOIN
+                     SSystems s ON s.SSysID = j.JumpToID
+                   WHERE j.JumpFromID {}
+                   ORDER BY j.JumpFromID, j.JumpID'''.format(condition),
+                params)
     for row in cur:
-        ssys.jumps[row[0]] = Jump((row[1], row[2]), row[3], row[4])
+        # An autopositioned jump may have had its position stored by
+        # store_autopos(), but it is still autopositioned.
+        pos = (None, None) if row[6] else (row[2], row[3])
+        ssystems[row[0]].jumps[row[1]] = Jump(pos, row[4], row[5])
 
     # Get the system asset data.
-    cur.execute('SELECT AssetName FROM Assets WHERE SSysID = ?', (ssys_id,))
+    cur.execute('''SELECT SSysID, AssetName
+                   FROM Assets
+                   WHERE SSysID {}'''.format(condition), params)
     for row in cur:
-        ssys.assets.add(row[0])
-    cur.execute('''SELECT v.VAssetName
-                   FROM VirtualAssets v JOIN
-                        SSysVAssets sv ON v.VAssetID = sv.VAssetID
-                   WHERE sv.SSysID = ?''', (ssys_id,))
+        ssystems[row[0]].assets.add(row[1])
+    cur.execute('''SELECT sv.SSysID, v.VAssetName
+                   FROM SSysVAssets sv JOIN
+                        VirtualAssets v ON v.VAssetID = sv.VAssetID
+                   WHERE sv.SSysID {}'''.format(condition), params)
     for row in cur:
-        ssys.assets.add(row[0])
+        ssystems[row[0]].assets.add(row[1])
 
-def get_ssystems(conn):
-    '''Get all star systems from an open database.'''
-    ssystems = []
-    cur = conn.cursor()
-    cur.execute('''SELECT
-                     SSysID, SSysPosX, SSysPosY, SSysRadius, SSysStars
-                   , SSysInterference, SSysNebulaDensity, SSysNebulaVolatility
-                   FROM SSystems''')
-    for row in cur:
-        ssys = SSystem()
-        ssys.pos.x, ssys.pos.y = row['SSysPosX'], row['SSysPosY']
-        ssys.radius, ssys.stars = row['SSysRadius'], row['SSysStars']
-        ssys.interference = row['SSysInterference']
-        ssys.nebula.density = row['SSysNebulaDensity']
-        ssys.nebula.volatility = row['SSysNebulaDensity']
+    for ssys in ssystems.values():
+        ssys._intern()
 
-        ssys_id = row['SSysID']
-        _get_ssys_extras(conn, ssys, ssys_id)
+def iter_ssystems(conn, chunk_size=SSYS_CHUNK_SIZE):
+    '''Generate all star systems from an open database.
 
-        ssystems.append(ssys)
+    The systems are read a chunk at a time, in order of ID, so that
+    only one chunk needs to be held in memory at once. Each chunk takes
+    four queries, however many systems it holds.
 
-    return ssystems
+    Keyword arguments:
+        conn -- An open database connection.
+        chunk_size -- The number of systems to read at a time, or None
+            to read them all at once. Defaults to SSYS_CHUNK_SIZE.
+
+    '''
+    cur = conn.cursor()
+    last_id = 0
+    while True:
+        cur.execute('''SELECT {}
+                       FROM SSystems
+                       WHERE SSysID > ?
+                       ORDER BY SSysID
+                       LIMIT ?'''.format(SSYS_COLUMNS),
+                    (last_id, -1 if chunk_size is None else chunk_size))
+        rows = cur.fetchall()
+        if not rows:
+            return
+
+        ssystems = dict((row[0], _ssys_from_row(row)) for row in rows)
+        first_id, last_id = rows[0][0], rows[-1][0]
+        _hydrate(conn, ssystems, first_id, last_id)
+        yield from ssystems.values()
+        if chunk_size is None:
+            return
+
+def get_ssystems(conn):
+    '''Get all star systems from an open database.'''
+    return list(iter_ssystems(conn, None))
 
 def get_ssys(conn, name):
     '''Get the named star system from an open database.'''
-    ssys = SSystem()
-    ssys.name = name
-
     cur = conn.cursor()
     # Get the basic system data.
-    cur.execute('''SELECT
-                     SSysID, SSysPosX, SSysPosY, SSysRadius, SSysStars
-                   , SSysInterference, SSysNebulaDensity, SSysNebulaVolatility
+    cur.execute('''SELECT {}
                    FROM SSystems
-                   WHERE SSysName = ?''', (name,))
+                   WHERE SSysName = ?'''.format(SSYS_COLUMNS), (name,))
     row = cur.fetchone()
     if row is None:
         # Nothing but a name!
+        ssys = SSystem()
+        ssys.name = name
         return ssys
-    else:
-        ssys_id = row['SSysID']
-        ssys.pos.x, ssys.pos.y = row['SSysPosX'], row['SSysPosY']
-        ssys.radius, ssys.stars = row['SSysRadius'], row['SSysStars']
-        ssys.interference = row['SSysInterference']
-        ssys.nebula.density = row['SSysNebulaDensity']
-        ssys.nebula.volatility = row['SSysNebulaDensity']
-
-    _get_ssys_extras(conn, ssys, ssys_id)
 
+    ssys = _ssys_from_row(row)
+    _hydrate(conn, {row[0]: ssys}, row[0], row[0])
     return ssys
 
-def get_ssys_presence(conn, name):
-    '''Get the faction presences in the named system.'''
+def get_ssys_many(conn, names):
+    '''Get several named star systems from an open database at once.
+
+    The systems are read SSYS_CHUNK_SIZE names at a time, with four
+    queries per chunk, however many systems it holds.
+
+    Keyword arguments:
+        conn -- An open database connection.
+        names -- A sequence of the names of the systems.
+    Returns:
+        A list of the star systems, in the same order as the names. As
+        for get_ssys(), an unknown name gives a system with nothing but
+        a name.
+
+    '''
+    names = list(names)
+    found = {}
+    for start in range(0, len(names), SSYS_CHUNK_SIZE):
+        chunk = names[start:start + SSYS_CHUNK_SIZE]
+        rows = conn.execute('''SELECT {}
+                               FROM SSystems
+                               WHERE SSysName IN ({})'''.format(
+                                   SSYS_COLUMNS, ', '.join('?' * len(chunk))),
+                            chunk).fetchall()
+        if not rows:
+            continue
+        ssystems = dict((row[0], _ssys_from_row(row)) for row in rows)
+        _hydrate(conn, ssystems)
+        found.update((ssys.name, ssys) for ssys in ssystems.values())
+
+    result = []
+    for name in names:
+        ssys = found.get(name)
+        if ssys is None:
+            # Nothing but a name!
+            ssys = SSystem()
+            ssys.name = name
+        result.append(ssys)
+    return result
+
+def get_ssys_presence(conn, name, ids=None):
+    '''Get the faction presences in the named system.
+
+    If an IDMap is given, the system's ID is found through it.
+
+    '''
     presences = defaultdict(float)
-    ssys_id = get_ssys_id(conn, name)
+    ssys_id = get_ssys_id(conn, name, ids)
     cur = conn.cursor()
 
     # Get presence data from concrete assets.
@@ -322,62 +901,978 @@ def get_ssys_presence(conn, name):
 
     return presences
 
-def build_db(filename):
-    '''Create and populate the Naev database.'''
-    with db.connect(filename) as conn:
-        make_db(conn)
-
-        # Store the star systems.
-        ssystems = []
-        for ssysfile in datafiles('SSystems'):
-            ssys = SSystem(ssysfile)
-            ssystems.append(ssys)
-            store_ssys(conn, ssys)
-
-        # Store the assets.
-        assets = []
-        for assetfile in datafiles('Assets'):
-            asset = Asset(assetfile)
-            assets.append(asset)
-
-            asset_ssys = None
-            if not asset.virtual:
-                # Find which system has the asset.
-                for ssys in ssystems:
-                    if asset.name in ssys.assets:
-                        asset_ssys = ssys.name
-                        break
-                if asset_ssys is None:
-                    print("Asset '{}' belongs to no "
-                          "system. Skipped!".format(asset.name),
-                          file=sys.stderr)
-                    continue
-
-            store_asset(conn, asset, asset_ssys)
-
-        # Store the jumps between systems, and the locations of virtual assets.
-        for ssys in ssystems:
-            store_jumps(conn, ssys)
-            for asset_name in ssys.assets:
-                # Find the asset.
-                for asset in assets:
-                    if asset.name == asset_name:
-                        this_asset = asset
+def get_effective_presence(conn, name, ids=None):
+    '''Get the effective faction presences in the named system.
+
+    Unlike get_ssys_presence(), this counts the presence spilled over
+    from nearby systems, as worked out by store_presence().
+
+    If an IDMap is given, the system's ID is found through it.
+
+    Returns:
+        A mapping of faction names to their presence in the system.
+
+    '''
+    ssys_id = get_ssys_id(conn, name, ids)
+    return dict(conn.execute('''SELECT Faction, Presence
+                                FROM SSysPresence
+                                WHERE SSysID = ?''', (ssys_id,)))
+
+def get_faction_presence(conn, faction, limit=None):
+    '''Find where a faction's effective presence is strongest.
+
+    Keyword arguments:
+        conn -- An open database connection.
+        faction -- The name of the faction.
+        limit -- The most systems to list. If omitted, every system
+            where the faction has any presence is listed.
+    Returns:
+        A list of 2-tuples of system names and the faction's presence
+        there, strongest first.
+
+    '''
+    return conn.execute('''SELECT s.SSysName, p.Presence
+                           FROM SSysPresence p JOIN
+                                SSystems s ON s.SSysID = p.SSysID
+                           WHERE p.Faction = ?
+                           ORDER BY p.Presence DESC
+                           LIMIT ?''',
+                        (faction, -1 if limit is None else limit)).fetchall()
+
+def _in_box(conn, rtree, xmin, xmax, ymin, ymax):
+    '''Find the rows indexed by an R-tree that lie within a box.
+
+    Keyword arguments:
+        conn -- An open database connection.
+        rtree -- The entry in RTREES for the R-tree to search.
+        xmin, xmax, ymin, ymax -- The bounds of the box, inclusive.
+    Returns:
+        A list of 3-tuples of names and X and Y coordinates, in order
+        of ID.
+
+    '''
+    name, table, id_col, name_col, x_col, y_col = rtree
+    # An R-tree holds single-precision bounds, rounded outwards, so check
+    # the exact positions as well.
+    return conn.execute('''SELECT t.{name_col}, t.{x}, t.{y}
+                           FROM {rtree} r JOIN
+                                {table} t ON t.{id} = r.{id}
+                           WHERE r.MaxX >= ? AND r.MinX <= ?
+                             AND r.MaxY >= ? AND r.MinY <= ?
+                             AND t.{x} BETWEEN ? AND ?
+                             AND t.{y} BETWEEN ? AND ?
+                           ORDER BY r.{id}'''.format(
+                               name_col=name_col, x=x_col, y=y_col,
+                               rtree=name, table=table, id=id_col),
+                        (xmin, xmax, ymin, ymax) * 2).fetchall()
+
+def _nearest(conn, rtree, x, y, count, radius):
+    '''Find the rows indexed by an R-tree nearest to a point.
+
+    The search starts with a box the given radius around the point,
+    which is doubled until it holds enough rows. If the furthest of the
+    nearest rows found lies outside the circle the box was drawn around,
+    a closer one may lie outside the box, so one last search is made
+    with a box that circle's size.
+
+    Keyword arguments:
+        conn, rtree -- As for _in_box().
+        x, y -- The coordinates of the point.
+        count -- The number of rows to find.
+        radius -- The radius to start searching in.
+    Returns:
+        A list of 3-tuples as for _in_box(), nearest first. There are
+        fewer than count only if the table holds fewer.
+
+    '''
+    def distance(row):
+        return ((row[1] - x) ** 2 + (row[2] - y) ** 2) ** 0.5
+    def search(radius):
+        rows = _in_box(conn, rtree, x - radius, x + radius,
+                       y - radius, y + radius)
+        rows.sort(key=lambda row: (distance(row), row[0]))
+        return rows
+
+    if count < 1:
+        return []
+    total = None
+    while True:
+        rows = search(radius)
+        if len(rows) >= count:
+            furthest = distance(rows[count - 1])
+            if furthest > radius:
+                rows = search(furthest)
+            return rows[:count]
+        if total is None:
+            # Make sure there are enough rows to find.
+            total = conn.execute('SELECT COUNT(*) FROM {}'.format(
+                rtree[0])).fetchone()[0]
+        if len(rows) >= total:
+            return rows
+        radius *= 2
+
+def get_ssystems_in_box(conn, xmin, xmax, ymin, ymax):
+    '''Find the star systems within a box, using the spatial index.
+
+    Keyword arguments:
+        conn -- An open database connection.
+        xmin, xmax, ymin, ymax -- The bounds of the box, inclusive.
+    Returns:
+        A list of 3-tuples of the systems' names and X and Y
+        coordinates.
+
+    '''
+    return _in_box(conn, RTREES[0], xmin, xmax, ymin, ymax)
+
+def get_assets_in_box(conn, xmin, xmax, ymin, ymax):
+    '''Find the concrete assets within a box, using the spatial index.
+
+    Note that an asset's position is relative to its own system.
+
+    Keyword arguments:
+        conn, xmin, xmax, ymin, ymax -- As for get_ssystems_in_box().
+    Returns:
+        A list of 3-tuples of the assets' names and X and Y coordinates.
+
+    '''
+    return _in_box(conn, RTREES[1], xmin, xmax, ymin, ymax)
+
+def get_nearest_ssystems(conn, x, y, count=1, radius=NEAREST_RADIUS):
+    '''Find the star systems nearest a point, using the spatial index.
+
+    Keyword arguments:
+        conn -- An open database connection.
+        x, y -- The coordinates of the point.
+        count -- The number of systems to find. Defaults to 1.
+        radius -- How far around the point to search at first. Defaults
+            to NEAREST_RADIUS. A good guess saves searching again.
+    Returns:
+        A list of 3-tuples of the systems' names and X and Y
+        coordinates, nearest first.
+
+    '''
+    return _nearest(conn, RTREES[0], x, y, count, radius)
+
+def get_nearest_assets(conn, x, y, count=1, radius=NEAREST_RADIUS):
+    '''Find the concrete assets nearest a point, using the spatial index.
+
+    Keyword arguments:
+        conn, x, y, count, radius -- As for get_nearest_ssystems().
+    Returns:
+        A list of 3-tuples of the assets' names and X and Y coordinates,
+        nearest first.
+
+    '''
+    return _nearest(conn, RTREES[1], x, y, count, radius)
+
+# Matches the literal values in a query, so that queries differing only in
+# their parameters can be told apart.
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+
+def _query_plans(conn, accessor):
+    '''Run an accessor, and get the query plan of each query it runs.
+
+    Returns a list of 2-tuples, each holding the SQL of one query (with
+    its parameters filled in) and the details of each step of its plan.
+
+    '''
+    statements = []
+    conn.set_trace_callback(statements.append)
+    try:
+        accessor()
+    finally:
+        conn.set_trace_callback(None)
+    return [(sql, [row[3] for row in conn.execute('EXPLAIN QUERY PLAN ' +
+                                                   sql)])
+            for sql in statements if sql.lstrip().upper().startswith('SELECT')]
+
+def check_query_plans(conn, out=sys.stdout):
+    '''Check that none of the accessors falls back to a full table scan.
+
+    Each accessor is run once, against the first system and assets in
+    the database, and the query plan of every query it runs is checked.
+
+    Keyword arguments:
+        conn -- An open connection to a database built by build_db().
+        out -- A file-like object to report full table scans to.
+            Defaults to standard output.
+    Returns:
+        The number of queries checked and the number of full table
+        scans found, as a 2-tuple.
+
+    '''
+    def first(query):
+        row = conn.execute(query).fetchone()
+        return '' if row is None else row[0]
+    ssys_name = first('SELECT SSysName FROM SSystems LIMIT 1')
+    asset_name = first('SELECT AssetName FROM Assets LIMIT 1')
+    vasset_name = first('SELECT VAssetName FROM VirtualAssets LIMIT 1')
+    faction = first('SELECT Faction FROM SSysPresence LIMIT 1')
+    ssys_x, ssys_y = conn.execute('''SELECT SSysPosX, SSysPosY
+                                     FROM SSystems
+                                     LIMIT 1''').fetchone() or (0, 0)
+
+    accessors = (
+        ('get_ssys_id', lambda: get_ssys_id(conn, ssys_name)),
+        ('get_asset_id', lambda: get_asset_id(conn, asset_name, False)),
+        ('get_asset_id', lambda: get_asset_id(conn, vasset_name, True)),
+        ('get_ssys', lambda: get_ssys(conn, ssys_name)),
+        ('get_ssys_many', lambda: get_ssys_many(conn, [ssys_name])),
+        ('get_ssys_presence', lambda: get_ssys_presence(conn, ssys_name)),
+        ('get_effective_presence',
+         lambda: get_effective_presence(conn, ssys_name)),
+        ('get_faction_presence',
+         lambda: get_faction_presence(conn, faction, 10)),
+        ('get_ssystems_in_box',
+         lambda: get_ssystems_in_box(conn, ssys_x - 1000, ssys_x + 1000,
+                                     ssys_y - 1000, ssys_y + 1000)),
+        ('get_nearest_ssystems',
+         lambda: get_nearest_ssystems(conn, ssys_x, ssys_y, 1)),
+        ('get_nearest_assets', lambda: get_nearest_assets(conn, 0, 0, 1)),
+        ('get_ssystems', lambda: get_ssystems(conn)),
+        ('iter_ssystems', lambda: list(iter_ssystems(conn, 16))),
+    )
+
+    checked = scans = 0
+    for name, accessor in accessors:
+        seen = set()
+        for sql, plan in _query_plans(conn, accessor):
+            # Don't count the same query twice, just because it was run
+            # again for another row.
+            shape = _LITERALS.sub('?', sql)
+            if shape in seen:
+                continue
+            seen.add(shape)
+            checked += 1
+            for step in plan:
+                words = step.split()
+                # A virtual table (i.e. an R-tree) that is given any
+                # constraints reports them after the colon, and searches
+                # its index with them.
+                searched = (step.partition('VIRTUAL TABLE INDEX ')[2]
+                            .partition(':')[2].strip() != '')
+                if words[0] == 'SCAN' and not searched:
+                    scans += 1
+                    print('Full table scan in {}: {}\n    {}'.format(
+                        name, step, ' '.join(shape.split())), file=out)
+    return checked, scans
+
+def check_synthetic_plans(size=200, out=sys.stdout):
+    '''Check the query plans against a database built for the purpose.
+
+    A random universe (see benchmarks.synthetic_universe()) is stored
+    in an in-memory database, which is then checked as for
+    check_query_plans(). No data files or existing database are needed.
+
+    Keyword arguments:
+        size -- The number of star systems in the universe. Defaults to
+            200.
+        out -- As for check_query_plans().
+    Returns:
+        As for check_query_plans().
+
+    '''
+    # Imported here, since the benchmarks depend on this module.
+    from benchmarks import synthetic_universe
+
+    conn = db.connect(':memory:')
+    try:
+        with conn:
+            bulk_load(conn, synthetic_universe(size))
+            store_presence(conn)
+        return check_query_plans(conn, out)
+    finally:
+        conn.close()
+
+def _asset_ssys(universe, asset):
+    '''Find the system that holds a concrete asset.
+
+    Returns the name of the system, or None (after reporting it) if the
+    asset belongs to no system. Virtual assets are in no one system, so
+    None is returned for them silently.
+
+    '''
+    if asset.virtual:
+        return None
+    try:
+        return universe.asset_ssystems[asset.name][0]
+    except KeyError:
+        print("Asset '{}' belongs to no "
+              "system. Skipped!".format(asset.name), file=sys.stderr)
+        return None
+
+def store_universe(conn, universe):
+    '''Store a whole universe in an open database, one row at a time.
+
+    Keyword arguments:
+        conn -- An open connection to a database created by make_db().
+        universe -- The universe.Universe to store.
+
+    '''
+    # Keep track of the IDs of everything stored (and anything already in
+    # the database), so that they needn't be looked up again.
+    ids = IDMap(conn)
+
+    # Store the star systems.
+    for ssys in universe.ssystems:
+        store_ssys(conn, ssys, ids)
+
+    # Store the assets.
+    for asset in universe.assets:
+        asset_ssys = _asset_ssys(universe, asset)
+        if asset_ssys is not None or asset.virtual:
+            store_asset(conn, asset, asset_ssys, ids)
+
+    # Store the jumps between systems, and the locations of virtual assets.
+    for ssys in universe.ssystems:
+        store_jumps(conn, ssys, ids)
+        for asset_name in ssys.assets:
+            # Find the asset, if it exists.
+            this_asset = universe.asset_by_name.get(asset_name)
+            if this_asset is not None and this_asset.virtual:
+                store_vasset_location(conn, ssys, this_asset, ids)
+
+def bulk_load(conn, universe):
+    '''Store a whole universe in a new database in a single transaction.
+
+    The tables are created and filled a table at a time, with the IDs
+    that link them worked out beforehand, and the secondary indexes
+    are only created once all of the rows are in. The BULK_PRAGMAS
+    settings are in force for the duration, and restored afterwards.
+
+    The result is the same as make_db() followed by store_universe(),
+    except that jumps to unknown systems are skipped (and reported)
+    rather than failing.
+
+    Keyword arguments:
+        conn -- An open connection to an empty database.
+        universe -- The universe.Universe to store.
+    Returns:
+        The number of rows stored.
+
+    '''
+    # Work out all of the rows first.
+    ssys_ids = {}
+    ssys_rows = []
+    for ssys in universe.ssystems:
+        ssys_ids[ssys.name] = len(ssys_rows) + 1
+        ssys_rows.append(_ssys_row(ssys, ssys_ids[ssys.name]))
+
+    asset_rows, vasset_rows = [], []
+    vasset_ids = {}
+    for asset in universe.assets:
+        if asset.virtual:
+            vasset_ids[asset.name] = len(vasset_rows) + 1
+            vasset_rows.append(_asset_row(asset, None,
+                                          vasset_ids[asset.name]))
+            continue
+        asset_ssys = _asset_ssys(universe, asset)
+        if asset_ssys is not None:
+            asset_rows.append(_asset_row(asset, ssys_ids[asset_ssys],
+                                         len(asset_rows) + 1))
+
+    jump_rows, location_rows = [], []
+    for ssys in universe.ssystems:
+        from_id = ssys_ids[ssys.name]
+        for jumpdest, jump in ssys.jumps.items():
+            try:
+                jump_rows.append(_jump_row(from_id, ssys_ids[jumpdest], jump))
+            except KeyError:
+                print("Jump from '{}' to unknown system '{}'. "
+                      "Skipped!".format(ssys.name, jumpdest), file=sys.stderr)
+        for asset_name in ssys.assets:
+            if asset_name in vasset_ids:
+                location_rows.append((from_id, vasset_ids[asset_name]))
+
+    # Then store them all at once.
+    saved = [(name, conn.execute('PRAGMA {}'.format(name)).fetchone()[0])
+             for name, value in BULK_PRAGMAS]
+    isolation_level = conn.isolation_level
+    # Manage the transaction by hand, so that it spans the table creation
+    # too.
+    conn.isolation_level = None
+    try:
+        for name, value in BULK_PRAGMAS:
+            conn.execute('PRAGMA {} = {}'.format(name, value))
+        conn.execute('BEGIN')
+        try:
+            make_db(conn, indexes=False)
+            cur = conn.cursor()
+            cur.executemany(SSYS_INSERT, ssys_rows)
+            cur.executemany(ASSET_INSERT, asset_rows)
+            cur.executemany(VASSET_INSERT, vasset_rows)
+            cur.executemany(JUMP_INSERT, jump_rows)
+            cur.executemany(VASSET_LOCATION_INSERT, location_rows)
+            make_indexes(conn)
+            make_rtrees(conn)
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+    finally:
+        for name, value in saved:
+            conn.execute('PRAGMA {} = {}'.format(name, value))
+        conn.isolation_level = isolation_level
+
+    return (len(ssys_rows) + len(asset_rows) + len(vasset_rows) +
+            len(jump_rows) + len(location_rows))
+
+def _fingerprint_sources(source):
+    '''Fingerprint every data file that goes into the database.
+
+    Keyword arguments:
+        source -- The data source, as from dataloader.data_source().
+    Returns:
+        A mapping of the files' absolute paths to 3-tuples of their
+        dataset, their filename (as the data source knows it), and their
+        fingerprint.
+
+    '''
+    current = {}
+    for dataset in SOURCE_DATASETS:
+        for filename in datafiles(dataset, source):
+            try:
+                fprint = source.fingerprint(filename)
+            except OSError:
+                # Vanished since it was listed.
+                continue
+            current[os.path.abspath(filename)] = (dataset, filename, fprint)
+    return current
+
+def _load_sources(naevroot=None, cache=True):
+    '''Load the universe, noting which file each object came from.
+
+    Keyword arguments:
+        naevroot, cache -- As for build_db().
+    Returns:
+        A 2-tuple of the universe.Universe loaded, and a mapping of the
+        absolute paths of the files loaded to the names of the star
+        systems and assets in them.
+
+    '''
+    datasets = []
+    names = {}
+    for dataset in SOURCE_DATASETS:
+        loaded_from = []
+        objects = load_dataset(dataset, naevroot, cache=cache,
+                               loaded_from=loaded_from)
+        names.update((os.path.abspath(filename), obj.name)
+                     for filename, obj in zip(loaded_from, objects))
+        datasets.append(objects)
+    return Universe(*datasets), names
+
+def store_sources(conn, sources, names):
+    '''Record the data files behind an open database.
+
+    Keyword arguments:
+        conn -- An open connection to a database created by make_db().
+        sources -- A mapping of the files to record, as returned by
+            _fingerprint_sources(). Any already recorded are replaced.
+        names -- A mapping of the files' absolute paths to the names of
+            the objects loaded from them. Files missing from it are
+            recorded as not loadable.
+
+    '''
+    conn.executemany(SOURCE_INSERT, [(path, dataset, mtime, size, digest,
+                                      names.get(path))
+                                     for path, (dataset, filename,
+                                                (mtime, size, digest))
+                                     in sources.items()])
+
+def _sync_jumps(conn, jump_rows, from_id=None):
+    '''Replace the jumps in an open database, keeping their IDs.
+
+    A jump already stored between the same two systems keeps its row
+    (and so its ID), updated if need be. Other jumps are inserted, and
+    any stored jumps not given are deleted.
+
+    Keyword arguments:
+        conn -- An open database connection.
+        jump_rows -- The Jumps rows wanted, as from _jump_row().
+        from_id -- If given, only the jumps out of the system with this
+            ID are replaced, and jump_rows should hold only those.
+
+    '''
+    query = '''SELECT JumpID, JumpFromID, JumpToID
+                    , JumpPosX, JumpPosY, JumpHide, JumpIsExitOnly
+                    , JumpIsAutoPos
+               FROM Jumps'''
+    params = ()
+    if from_id is not None:
+        query += ' WHERE JumpFromID = ?'
+        params = (from_id,)
+    stored = dict(((row[1], row[2]), row)
+                  for row in conn.execute(query, params))
+
+    updates, inserts = [], []
+    for row in jump_rows:
+        old_row = stored.pop(row[:2], None)
+        if old_row is None:
+            inserts.append(row)
+        elif old_row[1:] != row:
+            updates.append(row[2:] + (old_row[0],))
+    conn.executemany('DELETE FROM Jumps WHERE JumpID = ?',
+                     [(row[0],) for row in stored.values()])
+    conn.executemany(JUMP_UPDATE, updates)
+    conn.executemany(JUMP_INSERT, inserts)
+
+def _delete_stale(conn, ids, attr, names):
+    '''Delete the rows for names not given from one of an IDMap's tables.
+
+    The names are removed from the IDMap as well.
+
+    '''
+    table, name_col, id_col = IDMap._TABLES[attr]
+    mapping = getattr(ids, attr)
+    stale = [name for name in mapping if name not in names]
+    conn.executemany('DELETE FROM {} WHERE {} = ?'.format(table, id_col),
+                     [(mapping.pop(name),) for name in stale])
+
+def relink_universe(conn, universe, ids=None):
+    '''Bring every row of an open database into line with a universe.
+
+    Star systems and assets are matched to their rows by name, so they
+    keep their IDs. Jumps keep theirs as for _sync_jumps(). Rows for
+    anything no longer in the universe are deleted, and anything new is
+    added. Jumps to unknown systems are skipped (and reported).
+
+    Keyword arguments:
+        conn -- An open connection to a database created by make_db().
+        universe -- The universe.Universe to store.
+        ids -- An IDMap for the database. If omitted, one is preloaded.
+
+    '''
+    if ids is None:
+        ids = IDMap(conn)
+    cur = conn.cursor()
+
+    # Update or add the star systems.
+    for ssys in universe.ssystems:
+        ssys_id = ids.ssystems.get(ssys.name)
+        if ssys_id is None:
+            store_ssys(conn, ssys, ids)
+        else:
+            cur.execute(SSYS_UPDATE, _ssys_row(ssys)[2:] + (ssys_id,))
+    _delete_stale(conn, ids, 'ssystems',
+                  set(ssys.name for ssys in universe.ssystems))
+
+    # Update or add the assets.
+    concrete, virtual = set(), set()
+    for asset in universe.assets:
+        if asset.virtual:
+            virtual.add(asset.name)
+            asset_id = ids.vassets.get(asset.name)
+            if asset_id is None:
+                store_asset(conn, asset, ids=ids)
+            else:
+                cur.execute(VASSET_UPDATE,
+                            _asset_row(asset, None)[2:] + (asset_id,))
+            continue
+        asset_ssys = _asset_ssys(universe, asset)
+        if asset_ssys is None:
+            continue
+        concrete.add(asset.name)
+        asset_id = ids.assets.get(asset.name)
+        if asset_id is None:
+            store_asset(conn, asset, asset_ssys, ids)
+        else:
+            cur.execute(ASSET_UPDATE,
+                        _asset_row(asset, ids.ssystems[asset_ssys])[2:] +
+                        (asset_id,))
+    _delete_stale(conn, ids, 'assets', concrete)
+    _delete_stale(conn, ids, 'vassets', virtual)
+
+    # Relink the jumps and the locations of virtual assets.
+    jump_rows, location_rows = [], set()
+    for ssys in universe.ssystems:
+        from_id = ids.ssystems[ssys.name]
+        for jumpdest, jump in ssys.jumps.items():
+            try:
+                jump_rows.append(_jump_row(from_id, ids.ssystems[jumpdest],
+                                           jump))
+            except KeyError:
+                print("Jump from '{}' to unknown system '{}'. "
+                      "Skipped!".format(ssys.name, jumpdest), file=sys.stderr)
+        location_rows.update((from_id, ids.vassets[asset_name])
+                             for asset_name in ssys.assets
+                             if asset_name in ids.vassets)
+    _sync_jumps(conn, jump_rows)
+    stored = set(cur.execute('SELECT SSysID, VAssetID FROM SSysVAssets'))
+    cur.executemany('''DELETE FROM SSysVAssets
+                       WHERE SSysID = ? AND VAssetID = ?''',
+                    stored - location_rows)
+    cur.executemany(VASSET_LOCATION_INSERT, location_rows - stored)
+
+def _update_in_place(conn, obj, ids):
+    '''Update the rows for one star system or asset, if possible.
+
+    This is only possible for an object already stored under the same
+    name, and (for a star system) with the same jumps and assets, so
+    that no other rows need relinking.
+
+    Keyword arguments:
+        conn -- An open database connection.
+        obj -- The naevdata.SSystem or naevdata.Asset to update.
+        ids -- An IDMap for the database.
+    Returns:
+        True if the rows were updated, or False if relink_universe() is
+        needed instead.
+
+    '''
+    cur = conn.cursor()
+    if isinstance(obj, SSystem):
+        ssys_id = ids.ssystems.get(obj.name)
+        if ssys_id is None:
+            return False
+        cur.execute('''SELECT s.SSysName
+                       FROM Jumps j JOIN
+                            SSystems s ON s.SSysID = j.JumpToID
+                       WHERE j.JumpFromID = ?''', (ssys_id,))
+        dests = set(row[0] for row in cur)
+        cur.execute('''SELECT AssetName
+                       FROM Assets
+                       WHERE SSysID = ?
+                       UNION ALL
+                       SELECT v.VAssetName
+                       FROM SSysVAssets sv JOIN
+                            VirtualAssets v ON v.VAssetID = sv.VAssetID
+                       WHERE sv.SSysID = ?''', (ssys_id, ssys_id))
+        members = set(row[0] for row in cur)
+        if dests != set(obj.jumps) or members != set(obj.assets):
+            return False
+
+        cur.execute(SSYS_UPDATE, _ssys_row(obj)[2:] + (ssys_id,))
+        _sync_jumps(conn, [_jump_row(ssys_id, ids.ssystems[jumpdest], jump)
+                           for jumpdest, jump in obj.jumps.items()], ssys_id)
+    elif obj.virtual:
+        vasset_id = ids.vassets.get(obj.name)
+        if vasset_id is None:
+            return False
+        cur.execute(VASSET_UPDATE, _asset_row(obj, None)[2:] + (vasset_id,))
+    else:
+        asset_id = ids.assets.get(obj.name)
+        if asset_id is None:
+            return False
+        # The system holding the asset is set by the system's file, not
+        # the asset's, so it stays as it is.
+        cur.execute('SELECT SSysID FROM Assets WHERE AssetID = ?',
+                    (asset_id,))
+        ssys_id = cur.fetchone()[0]
+        cur.execute(ASSET_UPDATE, _asset_row(obj, ssys_id)[2:] + (asset_id,))
+    return True
+
+def update_db(filename, cache=True, naevroot=None, autopos=None):
+    '''Bring an existing Naev database up to date with the data files.
+
+    The fingerprints recorded in the database show which data files
+    have been added, changed, or removed since it was built (or last
+    updated). An edit that keeps a file's star system or asset under
+    the same name, and (for a star system) with the same jumps and
+    assets, is applied to its own rows alone, and only the changed files
+    are parsed. Anything else needs the whole database relinked, as
+    for relink_universe(); the unchanged files are then read from the
+    parse cache, if it is in use. Either way, star systems and assets
+    keep their IDs, the effective presences are worked out afresh with
+    store_presence(), and the update is made in a single transaction.
+
+    Keyword arguments:
+        filename -- The name of the database file to update.
+        cache, naevroot -- As for build_db().
+        autopos -- Whether or not to store the positions of
+            autopositioned jumps, as for build_db(). If omitted, they
+            are stored if they were before.
+    Returns:
+        The number of data files added, changed, or removed.
+
+    '''
+    source = data_source(naevroot)
+    current = _fingerprint_sources(source)
+
+    conn = connect(filename, migrate=True)
+    try:
+        with conn:
+            recorded = dict((row[0], row[1:]) for row in conn.execute(
+                'SELECT Path, MTime, Size, Digest, Name FROM SourceFiles'))
+            changed = dict((path, entry) for path, entry in current.items()
+                           if recorded.get(path, (None,) * 4)[:3] != entry[2])
+            removed = set(recorded) - set(current)
+            stored = _autopos_stored(conn)
+            if autopos is None:
+                autopos = stored
+            if not changed and not removed:
+                if autopos != stored:
+                    store_autopos(conn, autopos)
+                return 0
+
+            ids = IDMap(conn)
+            names = {}
+            # Anything added or removed means relinking, whatever else.
+            relink = bool(removed) or any(path not in recorded
+                                          for path in changed)
+            for dataset in SOURCE_DATASETS:
+                if relink:
+                    break
+                paths = sorted(path for path, entry in changed.items()
+                               if entry[0] == dataset)
+                results = parse_files(source, dataset,
+                                      [changed[path][1] for path in paths])
+                for path, (obj, err) in zip(paths, results):
+                    # A file that no longer loads is as good as removed;
+                    # load_dataset() will report it below.
+                    if (err is not None or obj.name != recorded[path][3] or
+                        not _update_in_place(conn, obj, ids)):
+                        relink = True
                         break
-                else:
-                    # The named asset doesn't exist.
-                    continue
-                if this_asset.virtual:
-                    store_vasset_location(conn, ssys, this_asset)
+                    names[path] = obj.name
+
+            if relink:
+                universe, names = _load_sources(source, cache)
+                relink_universe(conn, universe, ids)
+            # Any change can move presence about, not least across jumps.
+            store_presence(conn)
+            # Moving a system moves the autopositioned jumps into it, too.
+            if autopos or stored:
+                store_autopos(conn, autopos)
+
+            store_sources(conn, changed, names)
+            conn.executemany('DELETE FROM SourceFiles WHERE Path = ?',
+                             [(path,) for path in removed])
+    finally:
+        conn.close()
+    return len(changed) + len(removed)
+
+def _spread(adjacency, origin, spill_range):
+    '''Work out how far presence in one system spills over.
+
+    As in the game, presence spills through the jumps out of a system
+    (but not those that can only be exited), as far as its range in
+    jumps, dwindling to 1/(d + 1) of its value d jumps away.
+
+    Keyword arguments:
+        adjacency -- A mapping of each system's ID to a list of the IDs
+            of the systems it can be jumped to from.
+        origin -- The ID of the system the presence is in.
+        spill_range -- How many jumps away the presence reaches.
+    Returns:
+        A list of 2-tuples of system IDs and the fraction of the
+        presence in each, starting with the origin itself.
+
+    '''
+    spread = [(origin, 1.0)]
+    reached = {origin}
+    frontier = [origin]
+    for distance in range(1, spill_range + 1):
+        next_frontier = []
+        for ssys_id in frontier:
+            for dest in adjacency.get(ssys_id, ()):
+                if dest not in reached:
+                    reached.add(dest)
+                    next_frontier.append(dest)
+        if not next_frontier:
+            break
+        spread.extend((ssys_id, 1 / (distance + 1))
+                      for ssys_id in next_frontier)
+        frontier = next_frontier
+    return spread
+
+def store_presence(conn):
+    '''Work out every system's effective presence, and store it.
+
+    The presence of every asset (concrete or virtual) is added to its
+    system, and spilled over to the systems within its range, as for
+    _spread(). The spread from each system is only worked out once for
+    each range, however many assets share it. The SSysPresence table is
+    replaced with the totals.
+
+    Keyword arguments:
+        conn -- An open connection to a database created by make_db(),
+            with its star systems, jumps, and assets already stored.
+    Returns:
+        The number of rows stored.
+
+    '''
+    cur = conn.cursor()
+    adjacency = defaultdict(list)
+    for from_id, to_id in cur.execute('''SELECT JumpFromID, JumpToID
+                                         FROM Jumps
+                                         WHERE NOT JumpIsExitOnly
+                                         ORDER BY JumpID'''):
+        adjacency[from_id].append(to_id)
+
+    totals = defaultdict(float)
+    spreads = {}
+    cur.execute('''SELECT SSysID, AssetFaction
+                        , AssetPresence, AssetPresenceRange
+                   FROM Assets
+                   WHERE AssetFaction IS NOT NULL
+                     AND AssetPresence IS NOT NULL
+                   UNION ALL
+                   SELECT sv.SSysID, v.VAssetFaction
+                        , v.VAssetPresence, v.VAssetPresenceRange
+                   FROM SSysVAssets sv JOIN
+                        VirtualAssets v ON v.VAssetID = sv.VAssetID''')
+    for ssys_id, faction, presence, spill_range in cur.fetchall():
+        key = (ssys_id, spill_range or 0)
+        try:
+            spread = spreads[key]
+        except KeyError:
+            spread = spreads[key] = _spread(adjacency, *key)
+        for dest, fraction in spread:
+            totals[dest, faction] += presence * fraction
+
+    cur.execute('DELETE FROM SSysPresence')
+    cur.executemany('''INSERT INTO SSysPresence (SSysID, Faction, Presence)
+                       VALUES (?, ?, ?)''',
+                    [(ssys_id, faction, presence)
+                     for (ssys_id, faction), presence in totals.items()])
+    return len(totals)
+
+def _autopos_stored(conn):
+    '''Check whether an open database has autopositions stored.'''
+    return conn.execute('''SELECT EXISTS (SELECT 1
+                                          FROM Jumps
+                                          WHERE JumpIsAutoPos
+                                            AND JumpPosX IS NOT NULL)'''
+                        ).fetchone()[0] == 1
+
+def store_autopos(conn, positions=True):
+    '''Store (or clear) the positions of autopositioned jumps.
+
+    The positions are worked out from the stored star systems, all at
+    once, as for autopos.autopositions(). Autopositioned jumps are still
+    marked as such by JumpIsAutoPos, and are read back without their
+    positions, just as they were loaded from the data files.
+
+    Keyword arguments:
+        conn -- An open connection to a database created by make_db(),
+            with its star systems and jumps already stored.
+        positions -- Whether to store the positions (the default) or to
+            clear them.
+    Returns:
+        The number of jumps updated.
+
+    '''
+    if not positions:
+        return conn.execute('''UPDATE Jumps
+                               SET JumpPosX = NULL, JumpPosY = NULL
+                               WHERE JumpIsAutoPos''').rowcount
+    rows = conn.execute('''SELECT j.JumpID
+                                , f.SSysPosX, f.SSysPosY, f.SSysRadius
+                                , t.SSysPosX, t.SSysPosY
+                           FROM
+                             Jumps j JOIN
+                             SSystems f ON f.SSysID = j.JumpFromID JOIN
+                             SSystems t ON t.SSysID = j.JumpToID
+                           WHERE j.JumpIsAutoPos''').fetchall()
+    if not rows:
+        return 0
+    columns = np.array([row[1:] for row in rows], dtype=float).T
+    x, y = autopositions(*columns)
+    conn.executemany('''UPDATE Jumps SET JumpPosX = ?, JumpPosY = ?
+                        WHERE JumpID = ?''',
+                     zip(x.tolist(), y.tolist(), [row[0] for row in rows]))
+    return len(rows)
+
+def build_db(filename, cache=True, naevroot=None, bulk=True,
+             autopos=False):
+    '''Create and populate the Naev database.
+
+    The database is built in a temporary file alongside the target,
+    checked with verify_db(), and then renamed over the target in one
+    step. Anyone reading an older database at the same location keeps
+    reading it undisturbed, and anyone opening it afterwards sees the
+    new one, complete.
+
+    Keyword arguments:
+        filename -- The name of the database file to create. If it
+            already exists, it is replaced.
+        cache -- Whether or not to use the persistent parse cache.
+            Defaults to True.
+        naevroot -- The root of the Naev source tree, or an archive of
+            its data, as for dataloader.datafiles(). If omitted, the
+            current directory is used.
+        bulk -- Whether to store the data with bulk_load() (the
+            default) or row by row with store_universe().
+        autopos -- Whether or not to store the positions of
+            autopositioned jumps, with store_autopos(). Defaults to
+            False.
+
+    '''
+    # Fingerprint the data files before reading them, so that anything
+    # changed during the build is picked up by the next update.
+    sources = _fingerprint_sources(data_source(naevroot))
+    universe, names = _load_sources(naevroot, cache)
+
+    # Build the database in a temporary file of its own, and only put it
+    # in place once it is complete and checked.
+    fd, tempname = temp_file(filename)
+    os.close(fd)
+    try:
+        conn = db.connect(tempname)
+    except BaseException:
+        os.remove(tempname)
+        raise
+    try:
+        with conn:
+            if bulk:
+                bulk_load(conn, universe)
+            else:
+                make_db(conn)
+                store_universe(conn, universe)
+            store_presence(conn)
+            if autopos:
+                store_autopos(conn)
+            store_sources(conn, sources, names)
+        verify_db(conn)
+    except BaseException:
+        conn.close()
+        os.remove(tempname)
+        raise
+    conn.close()
+    os.replace(tempname, filename)
 
 if __name__ == '__main__':
-    # Create the database at the location given on the command line.
+    if '--check-plans' in sys.argv:
+        # Check the query plans in an existing database, if one is named,
+        # or in one built for the purpose.
+        sys.argv.remove('--check-plans')
+        if len(sys.argv) > 1:
+            conn = connect(sys.argv[1])
+            try:
+                checked, scans = check_query_plans(conn)
+            finally:
+                conn.close()
+        else:
+            checked, scans = check_synthetic_plans()
+        print('{} queries checked, {} full table scans.'.format(checked,
+                                                                scans))
+        sys.exit(1 if scans else 0)
+
+    # Create (or update) the database at the location given on the command
+    # line.
+    update = '--update' in sys.argv
+    if update:
+        sys.argv.remove('--update')
+    rebuild = '--rebuild' in sys.argv
+    if rebuild:
+        sys.argv.remove('--rebuild')
+    autopos = '--autopos' in sys.argv
+    if autopos:
+        sys.argv.remove('--autopos')
+    cache = use_cache(sys.argv)
+    naevroot = data_root(sys.argv)
     try:
         filename = sys.argv[1]
     except IndexError:
         filename = 'naev.db'
 
-    if os.path.exists(filename):
-        raise IOError("output file '{}' already exists".format(filename))
-
-    build_db(filename)
+    if update and os.path.exists(filename):
+        count = update_db(filename, cache, naevroot, autopos or None)
+        print('{} data file{} changed.'.format(count,
+                                               '' if count == 1 else 's'),
+              file=sys.stderr)
+    elif os.path.exists(filename) and not rebuild:
+        raise IOError("output file '{}' already exists (pass --rebuild to "
+                      "replace it)".format(filename))
+    else:
+        build_db(filename, cache, naevroot, autopos=autopos)
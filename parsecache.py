@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+
+'''Persistent cache of parsed Naev data files.
+
+Parsing the XML data files is the slowest part of running any of these
+tools, yet between runs only a few of the files usually change. This
+library keeps each parsed object in an SQLite database, keyed by the
+file's path and fingerprint, so that unchanged files need not be parsed
+again.
+
+'''
+
+# Copyright © 2012 Tim Pederick.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Standard library imports.
+import hashlib
+import os
+import pickle
+import sqlite3 as db
+import time
+
+# The version of the cached data format. Bump this whenever the naevdata
+# classes change in a way that would make previously cached objects invalid;
+# any cache written under a different version is discarded when opened.
+CACHE_VERSION = 2
+
+# Where the cache is kept if no filename is given.
+DEFAULT_CACHE_FILE = os.path.join(
+    os.environ.get('XDG_CACHE_HOME',
+                   os.path.join(os.path.expanduser('~'), '.cache')),
+    'puntools', 'parsecache.db')
+
+# The default limit on the total size of the cached data, in bytes.
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+def fingerprint(filename, hash_contents=False):
+    '''Get the fingerprint of a file, for detecting changes to it.
+
+    Keyword arguments:
+        filename -- The file to fingerprint.
+        hash_contents -- Whether or not to include a hash of the file's
+            contents. This catches changes that leave the modification
+            time and size untouched, at the cost of reading the file.
+    Returns:
+        A 3-tuple of the file's modification time (in nanoseconds), its
+        size, and the SHA-1 digest of its contents (or None, if
+        hash_contents is False).
+
+    '''
+    stat = os.stat(filename)
+    digest = None
+    if hash_contents:
+        with open(filename, 'rb') as f:
+            digest = hashlib.sha1(f.read()).digest()
+    return stat.st_mtime_ns, stat.st_size, digest
+
+
+class ParseCache:
+    '''A persistent cache of parsed data files.
+
+    Each entry holds one parsed object (e.g. an instance of SSystem or
+    Asset), pickled, along with the fingerprint of the file it came
+    from. An entry is only used if the file's fingerprint still
+    matches. When the cache grows beyond its size limit, the least
+    recently used entries are evicted.
+
+    Instance attributes:
+        filename -- The location of the cache database.
+        hash_contents -- Whether or not file fingerprints include a
+            hash of the file contents.
+        max_bytes -- The limit on the total size of the cached data.
+
+    '''
+    def __init__(self, filename=None, max_bytes=DEFAULT_MAX_BYTES,
+                 hash_contents=False):
+        '''Open the cache, creating it if necessary.
+
+        Keyword arguments:
+            filename -- The location of the cache database. If omitted,
+                DEFAULT_CACHE_FILE is used.
+            max_bytes, hash_contents -- As the instance attributes.
+
+        '''
+        self.filename = DEFAULT_CACHE_FILE if filename is None else filename
+        self.max_bytes = max_bytes
+        self.hash_contents = hash_contents
+        # Fingerprints taken during lookup, reused when storing.
+        self._fingerprints = {}
+
+        cache_dir = os.path.dirname(self.filename)
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+        self._conn = db.connect(self.filename)
+        version = self._conn.execute('PRAGMA user_version').fetchone()[0]
+        if version != CACHE_VERSION:
+            # An empty or out-of-date cache. Start it afresh.
+            with self._conn:
+                self._conn.execute('DROP TABLE IF EXISTS CacheEntries')
+                self._conn.execute('''CREATE TABLE CacheEntries (
+                                        Dataset TEXT NOT NULL
+                                      , Path TEXT NOT NULL
+                                      , MTime INTEGER NOT NULL
+                                      , Size INTEGER NOT NULL
+                                      , Digest BLOB
+                                      , Data BLOB NOT NULL
+                                      , LastUsed REAL NOT NULL
+                                      , PRIMARY KEY (Dataset, Path)
+                                      )''')
+                self._conn.execute('CREATE INDEX CacheEntriesByLastUsed '
+                                   'ON CacheEntries (LastUsed)')
+                self._conn.execute('PRAGMA user_version = {:d}'.format(
+                    CACHE_VERSION))
+
+    def close(self):
+        '''Close the cache database.'''
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def clear(self):
+        '''Remove every entry from the cache.'''
+        with self._conn:
+            self._conn.execute('DELETE FROM CacheEntries')
+
+    def lookup(self, dataset, filenames, source=None):
+        '''Get any cached objects for a set of data files.
+
+        Keyword arguments:
+            dataset -- The name of the dataset the files belong to, as
+                for dataloader.datafiles().
+            filenames -- A sequence of the data files to look up.
+            source -- The dataloader data source the files come from,
+                which is used to fingerprint them. If omitted, they are
+                taken to be ordinary files.
+        Returns:
+            A mapping of filenames to the objects parsed from them. Any
+            file that isn't cached, or has changed since it was cached,
+            is omitted.
+
+        '''
+        fprint_file = fingerprint if source is None else source.fingerprint
+        entries = {}
+        for row in self._conn.execute('''SELECT Path, MTime, Size, Digest,
+                                                Data
+                                         FROM CacheEntries
+                                         WHERE Dataset = ?''', (dataset,)):
+            entries[row[0]] = row[1:]
+
+        hits = {}
+        used = []
+        for filename in filenames:
+            path = os.path.abspath(filename)
+            try:
+                fprint = fprint_file(filename, self.hash_contents)
+            except OSError:
+                # Vanished since it was listed. Let the parser complain.
+                continue
+            self._fingerprints[path] = fprint
+
+            entry = entries.get(path)
+            if entry is None or tuple(entry[:3]) != fprint:
+                continue
+            try:
+                hits[filename] = pickle.loads(entry[3])
+            except Exception:
+                # A corrupt or incompatible entry; treat it as a miss.
+                continue
+            used.append(path)
+
+        if used:
+            now = time.time()
+            with self._conn:
+                self._conn.executemany('''UPDATE CacheEntries
+                                          SET LastUsed = ?
+                                          WHERE Dataset = ? AND Path = ?''',
+                                       ((now, dataset, path) for path in used))
+        return hits
+
+    def store(self, dataset, items, source=None):
+        '''Add parsed objects to the cache.
+
+        Keyword arguments:
+            dataset -- The name of the dataset the files belong to, as
+                for dataloader.datafiles().
+            items -- An iterable of 2-tuples, each holding a filename
+                and the object parsed from it.
+            source -- As for lookup().
+
+        '''
+        fprint_file = fingerprint if source is None else source.fingerprint
+        now = time.time()
+        rows = []
+        for filename, obj in items:
+            path = os.path.abspath(filename)
+            try:
+                fprint = (self._fingerprints.pop(path, None) or
+                          fprint_file(filename, self.hash_contents))
+            except OSError:
+                continue
+            data = pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
+            rows.append((dataset, path) + fprint + (data, now))
+        if not rows:
+            return
+
+        with self._conn:
+            self._conn.executemany('''INSERT OR REPLACE INTO CacheEntries (
+                                        Dataset, Path, MTime, Size, Digest
+                                      , Data, LastUsed
+                                      ) VALUES (
+                                        ?, ?, ?, ?, ?
+                                      , ?, ?
+                                      )''', rows)
+            self._evict()
+
+    def _evict(self):
+        '''Evict the least recently used entries until under the limit.'''
+        total = self._conn.execute('SELECT TOTAL(LENGTH(Data)) '
+                                   'FROM CacheEntries').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        doomed = []
+        for row in self._conn.execute('''SELECT rowid, LENGTH(Data)
+                                         FROM CacheEntries
+                                         ORDER BY LastUsed'''):
+            if total <= self.max_bytes:
+                break
+            doomed.append((row[0],))
+            total -= row[1]
+        self._conn.executemany('DELETE FROM CacheEntries WHERE rowid = ?',
+                               doomed)
@@ -0,0 +1,409 @@
+#!/usr/bin/env python3
+
+'''Route planning between star systems in the Naev universe.
+
+A RoutePlanner finds the cheapest route between two star systems along
+their jumps, using A* search guided by the straight-line distance
+between the systems. What makes a route cheap is up to a cost function,
+and which jumps may be taken at all is up to constraint functions;
+several of each are provided here.
+
+Cost and constraint functions are called with a jumpgraph.JumpGraph,
+and work out their values for every jump in it at once:
+    cost(graph) -- Returns an array of the (non-negative) cost of taking
+        each jump, in the graph's row order.
+    constraint(graph) -- Returns a boolean array, true for each jump that
+        may be taken.
+
+Run this script from the root directory of your Naev source tree with
+the names of two star systems, to print the routes between them by
+fewest jumps and by shortest distance. Example usage:
+    user@home:~/naev/$ routes Gamma\ Polaris Alteris
+
+'''
+
+# Copyright © 2012 Tim Pederick.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Standard library imports.
+from collections import OrderedDict
+import heapq
+import sys
+
+# Third-party imports.
+import numpy as np
+
+# Local imports.
+from dataloader import data_root, use_cache
+from jumpgraph import JumpGraph
+from snapshot import cached_universe
+
+# The number of routes remembered by a RoutePlanner, by default.
+CACHE_SIZE = 4096
+
+# How much to shrink the heuristic by, so that rounding can't make it
+# overestimate the cost of a route.
+_HEURISTIC_MARGIN = 1 - 1e-9
+
+def jump_lengths(graph):
+    '''Get the straight-line distance covered by each jump in a graph.'''
+    x, y = graph.universe.ssys_x, graph.universe.ssys_y
+    return np.hypot(x[graph.dests] - x[graph.origins],
+                    y[graph.dests] - y[graph.origins])
+
+def hop_cost(graph):
+    '''Cost each jump the same, so that routes take the fewest jumps.'''
+    return np.ones(len(graph.dests))
+
+def distance_cost(graph):
+    '''Cost each jump by the distance between its systems.'''
+    return jump_lengths(graph)
+
+def volatility_cost(weight=1.0, base=distance_cost):
+    '''Make a cost function that penalises volatile nebulae.
+
+    Keyword arguments:
+        weight -- How much to add to the cost of a jump for each unit of
+            nebula volatility in the system it leads to. Defaults to 1.
+        base -- The cost function to add the penalty to. Defaults to
+            distance_cost().
+    Returns:
+        The new cost function.
+
+    '''
+    def cost(graph):
+        volatility = graph.universe.ssys_nebula_volatility[graph.dests]
+        return base(graph) + weight * volatility
+    return cost
+
+def max_volatility(limit):
+    '''Make a constraint that avoids entering volatile nebulae.
+
+    Keyword arguments:
+        limit -- The highest nebula volatility a route may enter. The
+            system a route starts in is not checked.
+    Returns:
+        The new constraint function.
+
+    '''
+    def constraint(graph):
+        return graph.universe.ssys_nebula_volatility[graph.dests] <= limit
+    return constraint
+
+def max_hide(limit):
+    '''Make a constraint that avoids hard-to-find jumps.
+
+    Keyword arguments:
+        limit -- The highest jump "hide" value a route may use.
+    Returns:
+        The new constraint function.
+
+    '''
+    def constraint(graph):
+        return graph.hide <= limit
+    return constraint
+
+
+class RoutePlanner:
+    '''Finds and remembers the cheapest routes between star systems.
+
+    Only usable jumps are followed: an exit-only jump can't be taken
+    from the system it leads out of. The routes are found by A* search,
+    using as the heuristic the straight-line distance to the destination
+    scaled by the lowest cost per unit of distance of any jump, which
+    never overestimates whatever the cost function.
+
+    Routes are given as 2-tuples of their total cost and a tuple of the
+    names of the systems along them, from origin to destination; where
+    there is no route, None is given instead. Systems may be named, or
+    given by their index in the graph.
+
+    Instance attributes:
+        graph -- The jumpgraph.JumpGraph to plan routes through.
+        cost -- The cost function.
+        constraints -- A tuple of the constraint functions.
+            Setting any of these three (when the data has changed, or
+            to plan routes differently) forgets all of the remembered
+            routes.
+        cache_size -- The most routes to remember. The least recently
+            used are forgotten first.
+        hits, misses -- The number of routes answered from memory, and
+            by searching, so far.
+
+    '''
+    def __init__(self, graph, cost=hop_cost, constraints=(),
+                 cache_size=CACHE_SIZE):
+        '''Set up the planner.
+
+        Keyword arguments:
+            graph -- As the instance attribute. A universe.Universe, or
+                a sequence of naevdata.SSystem instances, may be given
+                instead, to make one from.
+            cost -- As the instance attribute. Defaults to hop_cost(),
+                for the fewest jumps.
+            constraints -- As the instance attribute, but any sequence
+                will do. Defaults to no constraints.
+            cache_size -- As the instance attribute. Defaults to
+                CACHE_SIZE.
+
+        '''
+        self.cache_size = cache_size
+        self.hits = self.misses = 0
+        self._cache = OrderedDict()
+        if not isinstance(graph, JumpGraph):
+            graph = JumpGraph(graph)
+        self._prepare(graph, cost, tuple(constraints))
+
+    @property
+    def graph(self):
+        return self._graph
+
+    @graph.setter
+    def graph(self, graph):
+        if not isinstance(graph, JumpGraph):
+            graph = JumpGraph(graph)
+        self._prepare(graph, self._cost, self._constraints)
+
+    @property
+    def cost(self):
+        return self._cost
+
+    @cost.setter
+    def cost(self, cost):
+        self._prepare(self._graph, cost, self._constraints)
+
+    @property
+    def constraints(self):
+        return self._constraints
+
+    @constraints.setter
+    def constraints(self, constraints):
+        self._prepare(self._graph, self._cost, tuple(constraints))
+
+    def _prepare(self, graph, cost, constraints):
+        '''Work out the usable jumps and their costs, and start afresh.
+
+        Nothing is changed if the cost function gives a negative or NaN
+        cost for any allowed jump; ValueError is raised instead.
+
+        '''
+        allowed = ~graph.exit_only
+        for constraint in constraints:
+            allowed &= np.asarray(constraint(graph), dtype=bool)
+        costs = np.asarray(cost(graph), dtype=float)
+        if not (costs[allowed] >= 0).all():
+            raise ValueError('jump costs must not be negative or NaN')
+
+        origins, dests = graph.origins[allowed], graph.dests[allowed]
+        costs = costs[allowed]
+        lengths = jump_lengths(graph)[allowed]
+        moving = lengths > 0
+        scale = (_HEURISTIC_MARGIN *
+                 float((costs[moving] / lengths[moving]).min())
+                 if moving.any() else 0.0)
+
+        # Keep the allowed jumps both ways round, as plain lists, which
+        # the search loop reads fastest.
+        jumps = []
+        for tails, heads in ((origins, dests), (dests, origins)):
+            order = np.argsort(tails, kind='stable')
+            indptr = np.zeros(len(graph) + 1, dtype=np.intp)
+            np.cumsum(np.bincount(tails, minlength=len(graph)),
+                      out=indptr[1:])
+            jumps.append((indptr.tolist(), heads[order].tolist(),
+                          costs[order].tolist()))
+
+        self._graph = graph
+        self._cost = cost
+        self._constraints = constraints
+        self._scale = scale
+        self._jumps = jumps
+        self._cache.clear()
+
+    def clear_cache(self):
+        '''Forget all of the remembered routes.'''
+        self._cache.clear()
+
+    def _heuristic(self, targets):
+        '''Get the heuristic for every system, towards some targets.'''
+        if not self._scale:
+            return [0.0] * len(self._graph)
+        x, y = self._graph.universe.ssys_x, self._graph.universe.ssys_y
+        nearest = np.full(len(self._graph), np.inf)
+        for target in targets:
+            np.minimum(nearest, np.hypot(x - x[target], y - y[target]),
+                       out=nearest)
+        return (self._scale * nearest).tolist()
+
+    def _search(self, source, targets, reverse=False):
+        '''Find the cheapest routes from one system to several others.
+
+        The search stops once every target is reached, so one search
+        serves all of them.
+
+        Keyword arguments:
+            source -- The index of the system to search from.
+            targets -- A collection of the indices of the systems to
+                search for.
+            reverse -- Whether to follow jumps backwards, finding routes
+                to the source rather than from it. Defaults to False.
+        Returns:
+            A dict mapping each target to its route, or to None.
+
+        '''
+        indptr, heads, costs = self._jumps[reverse]
+        estimate = self._heuristic(targets)
+        best = {source: 0.0}
+        previous = {}
+        settled = set()
+        remaining = set(targets)
+        queue = [(estimate[source], 0.0, source)]
+        while queue and remaining:
+            _, cost, node = heapq.heappop(queue)
+            if node in settled:
+                continue
+            settled.add(node)
+            remaining.discard(node)
+            for edge in range(indptr[node], indptr[node + 1]):
+                head = heads[edge]
+                new_cost = cost + costs[edge]
+                if head not in settled and new_cost < best.get(head,
+                                                                np.inf):
+                    best[head] = new_cost
+                    previous[head] = node
+                    heapq.heappush(queue, (new_cost + estimate[head],
+                                           new_cost, head))
+
+        names = self._graph.names
+        routes = {}
+        for target in targets:
+            if target not in settled:
+                routes[target] = None
+                continue
+            path = [target]
+            while path[-1] != source:
+                path.append(previous[path[-1]])
+            if not reverse:
+                path.reverse()
+            routes[target] = (best[target],
+                              tuple(names[node] for node in path))
+        return routes
+
+    def _remember(self, routes):
+        '''Remember routes, keyed by origin and destination index.'''
+        if not self.cache_size:
+            return
+        for key, route in routes.items():
+            self._cache[key] = route
+            self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def route(self, origin, dest):
+        '''Find the cheapest route between two star systems.
+
+        Keyword arguments:
+            origin, dest -- The systems to start and end at, by name or
+                index.
+        Returns:
+            The route, as described for the class, or None if there is
+            none.
+
+        '''
+        return self.routes([(origin, dest)])[0]
+
+    def routes(self, pairs):
+        '''Find the cheapest routes between many pairs of star systems.
+
+        Search work is shared: all of the routes out of one origin (or,
+        if there are fewer destinations than origins, into one
+        destination) are found with a single search.
+
+        Keyword arguments:
+            pairs -- A sequence of 2-tuples of the systems to start and
+                end at, by name or index.
+        Returns:
+            A list of the routes, in the same order as the pairs.
+
+        '''
+        keys = [(self._graph.node(origin), self._graph.node(dest))
+                for origin, dest in pairs]
+        found = {}
+        for key in keys:
+            if key in self._cache:
+                found[key] = self._cache[key]
+                self._cache.move_to_end(key)
+                self.hits += 1
+        missing = [key for key in dict.fromkeys(keys) if key not in found]
+        self.misses += len(missing)
+
+        by_origin, by_dest = {}, {}
+        for origin, dest in missing:
+            by_origin.setdefault(origin, []).append(dest)
+            by_dest.setdefault(dest, []).append(origin)
+        searched = {}
+        if len(by_origin) <= len(by_dest):
+            for origin, dests in by_origin.items():
+                for dest, route in self._search(origin, dests).items():
+                    searched[origin, dest] = route
+        else:
+            for dest, origins in by_dest.items():
+                for origin, route in self._search(dest, origins,
+                                                  reverse=True).items():
+                    searched[origin, dest] = route
+        self._remember(searched)
+        found.update(searched)
+        return [found[key] for key in keys]
+
+def main(origin, dest, cache=True, naevroot=None):
+    '''Print the routes between two star systems.
+
+    Keyword arguments:
+        origin, dest -- The names of the systems to start and end at.
+            If either is unknown, an error is printed and the program
+            exits.
+        cache -- Whether or not to use the cached universe snapshot, as
+            for snapshot.cached_universe(). Defaults to True.
+        naevroot -- The root of the Naev source tree, or an archive of
+            its data, as for dataloader.datafiles(). If omitted, the
+            current directory is used.
+
+    '''
+    graph = JumpGraph(cached_universe(naevroot, cache, assets=False))
+    for name in (origin, dest):
+        try:
+            graph.node(name)
+        except KeyError as err:
+            print(err.args[0], file=sys.stderr)
+            sys.exit(2)
+    for description, cost in (('Fewest jumps', hop_cost),
+                              ('Shortest distance', distance_cost)):
+        route = RoutePlanner(graph, cost).route(origin, dest)
+        if route is None:
+            print('{}: no route.'.format(description))
+        else:
+            print('{}: {} (cost {:g}).'.format(description,
+                                                ' -> '.join(route[1]),
+                                                route[0]))
+
+if __name__ == '__main__':
+    cache = use_cache(sys.argv)
+    naevroot = data_root(sys.argv)
+    try:
+        origin, dest = sys.argv[1:3]
+    except ValueError:
+        print('Usage: routes ORIGIN DESTINATION', file=sys.stderr)
+        sys.exit(2)
+    main(origin, dest, cache, naevroot)
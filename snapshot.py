@@ -0,0 +1,726 @@
+#!/usr/bin/env python3
+
+'''Compiled snapshots of the Naev universe data.
+
+Run this script from the root directory of your Naev source tree. It
+reads the XML files in dat/ssys/ and dat/assets/ and compiles them into
+a single binary snapshot file, which can then be loaded almost
+instantly. Example usage:
+    user@home:~/naev/$ snapshot naev.snap
+
+A snapshot file holds, in order:
+* a header: the magic bytes b'NAEVSNAP', the format version, the number
+  of sections, and a fingerprint of the data files it was compiled
+  from;
+* a section table, giving the byte offset and entry count of each
+  section;
+* the sections themselves, each aligned to 8 bytes: a string table
+  (an array of offsets into a blob of UTF-8 text), a table of string
+  references (for variable-length lists of strings), and fixed-width
+  records for systems, jumps, system-asset memberships, and assets.
+
+All numbers are stored little-endian. Strings are referred to by their
+index in the string table, with NO_STRING standing in for None.
+
+The command-line tools load the universe through cached_universe(),
+which keeps a snapshot of each Naev data location under SNAPSHOT_DIR and
+recompiles it whenever the data files change.
+
+'''
+
+# Copyright © 2012 Tim Pederick.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Standard library imports.
+from functools import cached_property
+import hashlib
+import mmap
+import os
+import struct
+import sys
+
+# Third-party imports.
+import numpy as np
+
+# Local imports.
+from dataloader import (DATA_LOCS, data_root, data_source, datafiles,
+                        temp_file, use_cache)
+from naevdata import Asset, Coords, Jump, Nebula, Presence, Services, SSystem
+from parsecache import DEFAULT_CACHE_FILE
+from universe import Universe
+
+MAGIC = b'NAEVSNAP'
+
+# The version of the snapshot format. Bump this whenever the layout changes;
+# snapshots of any other version are refused.
+SNAPSHOT_VERSION = 1
+
+# Where cached_universe() keeps its snapshots.
+SNAPSHOT_DIR = os.path.dirname(DEFAULT_CACHE_FILE)
+
+# The string reference standing in for None.
+NO_STRING = 0xFFFFFFFF
+
+# The header: magic, version, section count, data fingerprint, padding.
+HEADER = struct.Struct('<8sII20s4x')
+# Each entry in the section table: byte offset, entry count.
+SECTION = struct.Struct('<QQ')
+
+# The sections, in the order they appear in the file, with the record type
+# of each.
+SECTIONS = (
+    ('string_offsets', np.dtype('<u8')),
+    ('string_data', np.dtype('u1')),
+    ('string_refs', np.dtype('<u4')),
+    ('ssystems', np.dtype([('name', '<u4'),
+                           ('x', '<f8'),
+                           ('y', '<f8'),
+                           ('radius', '<f8'),
+                           ('stars', '<i8'),
+                           ('interference', '<f8'),
+                           ('nebula_density', '<f8'),
+                           ('nebula_volatility', '<f8'),
+                           ('jump_start', '<u4'),
+                           ('jump_count', '<u4'),
+                           ('member_start', '<u4'),
+                           ('member_count', '<u4')], align=True)),
+    ('jumps', np.dtype([('from', '<i4'),
+                        ('to', '<i4'),
+                        ('dest', '<u4'),
+                        ('x', '<f8'),
+                        ('y', '<f8'),
+                        ('hide', '<f8'),
+                        ('exit_only', '?')], align=True)),
+    ('members', np.dtype([('ssys', '<i4'),
+                          ('asset', '<i4'),
+                          ('name', '<u4')], align=True)),
+    ('assets', np.dtype([('name', '<u4'),
+                         ('x', '<f8'),
+                         ('y', '<f8'),
+                         ('virtual', '?'),
+                         ('hide', '<f8'),
+                         ('population', '<i8'),
+                         ('faction', '<u4'),
+                         ('presence', '<f8'),
+                         ('presence_range', '<i8'),
+                         ('world_class', '<u4'),
+                         ('description', '<u4'),
+                         ('land', '<u4'),
+                         ('bar', '<u4'),
+                         ('missions', '?'),
+                         ('outfits', '?'),
+                         ('refuel', '?'),
+                         ('shipyard', '?'),
+                         ('has_commodities', '?'),
+                         ('commodity_start', '<u4'),
+                         ('commodity_count', '<u4'),
+                         ('tech_start', '<u4'),
+                         ('tech_count', '<u4'),
+                         ('gfx_start', '<u4'),
+                         ('gfx_count', '<u4')], align=True)),
+)
+
+
+class SnapshotError(Exception):
+    '''Raised when a snapshot file is not valid or not usable.'''
+    pass
+
+def data_fingerprint(naevroot=None):
+    '''Fingerprint the current state of the Naev data files.
+
+    The fingerprint changes if any data file is added, removed, or
+    modified.
+
+    Keyword arguments:
+        naevroot -- The root of the Naev source tree. If omitted, the
+            current directory is used.
+    Returns:
+        A 20-byte SHA-1 digest.
+
+    '''
+    source = data_source(naevroot)
+    digest = hashlib.sha1()
+    for dataset in sorted(DATA_LOCS):
+        for filename in sorted(datafiles(dataset, source)):
+            mtime, size, _ = source.fingerprint(filename)
+            digest.update('{}\0{}\0{}\0{}\0'.format(
+                dataset, os.path.basename(filename), mtime,
+                size).encode('utf-8'))
+    return digest.digest()
+
+def _coord(value):
+    '''Convert a coordinate to a float, with NaN standing in for None.'''
+    return float('nan') if value is None else value
+
+def _uncoord(value):
+    '''Convert a float back to a coordinate, with None for NaN.'''
+    return None if value != value else float(value)
+
+def compile_snapshot(filename, naevroot=None, universe=None, cache=True,
+                     fingerprint=None):
+    '''Compile the Naev data files into a snapshot file.
+
+    The snapshot is written to a temporary file first and then renamed
+    into place, so that readers never see a half-written one.
+
+    Keyword arguments:
+        filename -- The name of the snapshot file to write.
+        naevroot -- The root of the Naev source tree. If omitted, the
+            current directory is used.
+        universe -- A universe.Universe already loaded from the data
+            files, to save loading it again. If omitted, the data files
+            are loaded.
+        cache -- Whether or not to use the persistent parse cache when
+            loading the data files. Defaults to True.
+        fingerprint -- The fingerprint of the data files (see
+            data_fingerprint()), taken before the universe was loaded.
+            If omitted, it is taken now.
+
+    '''
+    # Take the fingerprint first, so that any change made while loading
+    # leaves the snapshot looking stale rather than current. A universe
+    # loaded beforehand needs its fingerprint taken before it, too.
+    data_print = (data_fingerprint(naevroot) if fingerprint is None
+                  else fingerprint)
+    if universe is None:
+        universe = Universe.load(naevroot, cache=cache)
+
+    strings = []
+    string_ids = {}
+    def string_id(text):
+        if text is None:
+            return NO_STRING
+        try:
+            return string_ids[text]
+        except KeyError:
+            string_ids[text] = len(strings)
+            strings.append(text)
+            return string_ids[text]
+    string_refs = []
+    def string_list(texts):
+        start = len(string_refs)
+        string_refs.extend(string_id(text) for text in texts)
+        return start, len(string_refs) - start
+
+    dtypes = dict(SECTIONS)
+    ssys_index = dict((ssys.name, i)
+                      for i, ssys in enumerate(universe.ssystems))
+    asset_index = dict((asset.name, i)
+                       for i, asset in enumerate(universe.assets))
+
+    ssys_rows, jump_rows, member_rows = [], [], []
+    for i, ssys in enumerate(universe.ssystems):
+        jump_start, member_start = len(jump_rows), len(member_rows)
+        for dest, jump in ssys.jumps.items():
+            jump_rows.append((i, ssys_index.get(dest, -1), string_id(dest),
+                              _coord(jump.x), _coord(jump.y), jump.hide,
+                              jump.exit_only))
+        for name in sorted(ssys.assets):
+            member_rows.append((i, asset_index.get(name, -1),
+                                string_id(name)))
+        ssys_rows.append((string_id(ssys.name), ssys.pos.x, ssys.pos.y,
+                          ssys.radius, ssys.stars, ssys.interference,
+                          ssys.nebula.density, ssys.nebula.volatility,
+                          jump_start, len(jump_rows) - jump_start,
+                          member_start, len(member_rows) - member_start))
+
+    asset_rows = []
+    for asset in universe.assets:
+        services = asset.services
+        commodities = services.commodities
+        commodity_span = string_list(sorted(commodities or ()))
+        tech_span = string_list(sorted(getattr(asset, 'techs', ())))
+        gfx_start = len(string_refs)
+        for purpose, image in asset.gfx.items():
+            string_list((purpose, image))
+        asset_rows.append((string_id(asset.name), _coord(asset.pos.x),
+                           _coord(asset.pos.y), asset.virtual, asset.hide,
+                           asset.population,
+                           string_id(asset.presence.faction),
+                           asset.presence.value, asset.presence.range,
+                           string_id(asset.world_class),
+                           string_id(asset.description),
+                           string_id(services.land), string_id(services.bar),
+                           services.missions, services.outfits,
+                           services.refuel, services.shipyard,
+                           commodities is not None) +
+                          commodity_span + tech_span +
+                          (gfx_start, len(asset.gfx)))
+
+    encoded = [text.encode('utf-8') for text in strings]
+    string_offsets = np.zeros(len(encoded) + 1, dtype=dtypes['string_offsets'])
+    np.cumsum([len(data) for data in encoded], out=string_offsets[1:])
+    sections = {
+        'string_offsets': string_offsets,
+        'string_data': np.frombuffer(b''.join(encoded),
+                                     dtype=dtypes['string_data']),
+        'string_refs': np.array(string_refs, dtype=dtypes['string_refs']),
+        'ssystems': np.array(ssys_rows, dtype=dtypes['ssystems']),
+        'jumps': np.array(jump_rows, dtype=dtypes['jumps']),
+        'members': np.array(member_rows, dtype=dtypes['members']),
+        'assets': np.array(asset_rows, dtype=dtypes['assets']),
+    }
+
+    # Lay out the sections after the header and section table.
+    table = []
+    offset = HEADER.size + SECTION.size * len(SECTIONS)
+    for name, dtype in SECTIONS:
+        offset += -offset % 8
+        table.append((offset, len(sections[name])))
+        offset += sections[name].nbytes
+
+    # A uniquely named temporary file, so that concurrent compiles can't
+    # write over each other, with the permissions of a newly created file.
+    fd, tempname = temp_file(filename)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, SNAPSHOT_VERSION, len(SECTIONS),
+                                data_print))
+            for entry in table:
+                f.write(SECTION.pack(*entry))
+            for (name, dtype), (offset, count) in zip(SECTIONS, table):
+                f.write(b'\0' * (offset - f.tell()))
+                f.write(sections[name].tobytes())
+        os.replace(tempname, filename)
+    except BaseException:
+        os.unlink(tempname)
+        raise
+
+
+class Snapshot:
+    '''A compiled snapshot of the universe, mapped into memory.
+
+    The records in the snapshot are exposed as NumPy arrays that view
+    the mapped file directly, without copying or parsing it. The columns
+    share their names with those of universe.Universe, so code that
+    only needs numbers can use a snapshot in place of a universe.
+    SSystem and Asset objects are only built when asked for.
+
+    Instance attributes:
+        fingerprint -- The fingerprint of the data files the snapshot
+            was compiled from (see data_fingerprint()).
+        ssys_x, ssys_y, ssys_radius, ssys_stars, ssys_interference,
+            ssys_nebula_density, ssys_nebula_volatility, jump_from,
+            jump_to, jump_x, jump_y, jump_hide, jump_exit_only,
+            member_ssys, member_asset, asset_x, asset_y, asset_virtual,
+            asset_hide, asset_population, asset_presence,
+            asset_presence_range -- As for universe.Universe.
+
+    '''
+    def __init__(self, filename):
+        '''Map a snapshot file into memory.
+
+        Keyword arguments:
+            filename -- The name of the snapshot file.
+
+        '''
+        with open(filename, 'rb') as f:
+            try:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # An empty file can't be mapped.
+                raise SnapshotError("'{}' is empty".format(filename))
+        if len(self._map) < HEADER.size:
+            raise SnapshotError("'{}' is truncated".format(filename))
+        magic, version, section_count, self.fingerprint = HEADER.unpack_from(
+            self._map)
+        if magic != MAGIC:
+            raise SnapshotError("'{}' is not a snapshot file".format(filename))
+        if version != SNAPSHOT_VERSION or section_count != len(SECTIONS):
+            raise SnapshotError("'{}' is version {} of the snapshot format, "
+                                "not version {}".format(filename, version,
+                                                        SNAPSHOT_VERSION))
+
+        self._sections = {}
+        for i, (name, dtype) in enumerate(SECTIONS):
+            offset, count = SECTION.unpack_from(
+                self._map, HEADER.size + i * SECTION.size)
+            if offset + count * dtype.itemsize > len(self._map):
+                raise SnapshotError("'{}' is truncated".format(filename))
+            self._sections[name] = np.frombuffer(self._map, dtype=dtype,
+                                                 count=count, offset=offset)
+            if name == 'string_data':
+                self._string_base = offset
+
+        ssystems = self._sections['ssystems']
+        jumps = self._sections['jumps']
+        members = self._sections['members']
+        assets = self._sections['assets']
+        self.ssys_x = ssystems['x']
+        self.ssys_y = ssystems['y']
+        self.ssys_radius = ssystems['radius']
+        self.ssys_stars = ssystems['stars']
+        self.ssys_interference = ssystems['interference']
+        self.ssys_nebula_density = ssystems['nebula_density']
+        self.ssys_nebula_volatility = ssystems['nebula_volatility']
+        self.jump_from = jumps['from']
+        self.jump_to = jumps['to']
+        self.jump_x = jumps['x']
+        self.jump_y = jumps['y']
+        self.jump_hide = jumps['hide']
+        self.jump_exit_only = jumps['exit_only']
+        self.member_ssys = members['ssys']
+        self.member_asset = members['asset']
+        self.asset_x = assets['x']
+        self.asset_y = assets['y']
+        self.asset_virtual = assets['virtual']
+        self.asset_hide = assets['hide']
+        self.asset_population = assets['population']
+        self.asset_presence = assets['presence']
+        self.asset_presence_range = assets['presence_range']
+
+    def close(self):
+        '''Release the mapped snapshot file.
+
+        Any arrays obtained from the snapshot still refer to the mapped
+        file, which stays open until they have all been discarded.
+
+        '''
+        mapping = self._map
+        self.__dict__.clear()
+        try:
+            mapping.close()
+        except BufferError:
+            # Some arrays are still in use elsewhere.
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def is_current(self, naevroot=None):
+        '''Check whether the snapshot matches the current data files.
+
+        Keyword arguments:
+            naevroot -- The root of the Naev source tree. If omitted,
+                the current directory is used.
+
+        '''
+        return self.fingerprint == data_fingerprint(naevroot)
+
+    def string(self, index):
+        '''Get a string from the string table (None for NO_STRING).'''
+        if index == NO_STRING:
+            return None
+        offsets = self._sections['string_offsets']
+        start, end = int(offsets[index]), int(offsets[index + 1])
+        return self._map[self._string_base + start:
+                         self._string_base + end].decode('utf-8')
+
+    def _strings(self, start, count):
+        '''Get a list of strings from the string reference table.'''
+        refs = self._sections['string_refs'][start:start + count]
+        return [self.string(ref) for ref in refs.tolist()]
+
+    def __len__(self):
+        '''Get the number of star systems.'''
+        return len(self._sections['ssystems'])
+
+    @property
+    def ssys_names(self):
+        '''A list of the names of the star systems.'''
+        return [self.string(ref)
+                for ref in self._sections['ssystems']['name'].tolist()]
+
+    @property
+    def asset_names(self):
+        '''A list of the names of the assets.'''
+        return [self.string(ref)
+                for ref in self._sections['assets']['name'].tolist()]
+
+    def ssystem(self, index):
+        '''Build the naevdata.SSystem for one star system.'''
+        rec = self._sections['ssystems'][index]
+        ssys = SSystem()
+        ssys.name = self.string(rec['name'])
+        ssys.pos = Coords(float(rec['x']), float(rec['y']))
+        ssys.radius = float(rec['radius'])
+        ssys.stars = int(rec['stars'])
+        ssys.interference = float(rec['interference'])
+        ssys.nebula = Nebula(rec['nebula_density'], rec['nebula_volatility'])
+
+        start = int(rec['jump_start'])
+        jumps = self._sections['jumps'][start:start + int(rec['jump_count'])]
+        for dest, x, y, hide, exit_only in zip(
+                jumps['dest'].tolist(), jumps['x'].tolist(),
+                jumps['y'].tolist(), jumps['hide'].tolist(),
+                jumps['exit_only'].tolist()):
+            ssys.jumps[self.string(dest)] = Jump((_uncoord(x), _uncoord(y)),
+                                                 hide, exit_only)
+
+        start = int(rec['member_start'])
+        members = self._sections['members'][start:
+                                            start + int(rec['member_count'])]
+        ssys.assets = set(self.string(ref)
+                          for ref in members['name'].tolist())
+        ssys._intern()
+        return ssys
+
+    def asset(self, index):
+        '''Build the naevdata.Asset for one asset.'''
+        rec = self._sections['assets'][index]
+        asset = Asset(None)
+        asset.name = self.string(rec['name'])
+        asset.pos = Coords(_uncoord(float(rec['x'])),
+                           _uncoord(float(rec['y'])))
+        asset.virtual = bool(rec['virtual'])
+        asset.hide = float(rec['hide'])
+        asset.population = int(rec['population'])
+        asset.presence = Presence(self.string(rec['faction']),
+                                  rec['presence'], rec['presence_range'])
+        asset.world_class = self.string(rec['world_class'])
+        asset.description = self.string(rec['description'])
+        asset.services = Services(
+            bar=self.string(rec['bar']),
+            commodity=(self._strings(rec['commodity_start'],
+                                     rec['commodity_count'])
+                       if rec['has_commodities'] else None),
+            land=self.string(rec['land']), missions=rec['missions'],
+            outfits=rec['outfits'], refuel=rec['refuel'],
+            shipyard=rec['shipyard'])
+        asset.techs = set(self._strings(rec['tech_start'], rec['tech_count']))
+        gfx = self._strings(rec['gfx_start'], 2 * int(rec['gfx_count']))
+        asset.gfx = dict(zip(gfx[::2], gfx[1::2]))
+        asset._intern()
+        return asset
+
+    def ssystems(self):
+        '''Build a list of naevdata.SSystem for all star systems.'''
+        return [self.ssystem(i) for i in range(len(self))]
+
+    def assets(self):
+        '''Build a list of naevdata.Asset for all assets.'''
+        return [self.asset(i) for i in range(len(self._sections['assets']))]
+
+    def to_universe(self):
+        '''Get a universe.Universe backed by the snapshot.
+
+        See SnapshotUniverse. The snapshot must be left open for as
+        long as the universe is in use.
+
+        '''
+        return SnapshotUniverse(self)
+
+
+class SnapshotUniverse(Universe):
+    '''A universe.Universe whose tables are read from a snapshot.
+
+    The numeric columns view the mapped snapshot directly (apart from
+    the system and asset indices, which are widened to the integer type
+    that universe.Universe uses). Names and other strings are only
+    decoded, and naevdata objects only built, when first used.
+
+    Instance attributes:
+        snapshot -- The Snapshot the tables are read from.
+        (others) -- As for universe.Universe.
+
+    '''
+    def __init__(self, snapshot):
+        '''Set up the tables.
+
+        Keyword arguments:
+            snapshot -- The Snapshot to read from.
+
+        '''
+        self.snapshot = snapshot
+        for column in ('ssys_x', 'ssys_y', 'ssys_radius', 'ssys_stars',
+                       'ssys_interference', 'ssys_nebula_density',
+                       'ssys_nebula_volatility', 'jump_x', 'jump_y',
+                       'jump_hide', 'jump_exit_only', 'asset_x', 'asset_y',
+                       'asset_virtual', 'asset_hide', 'asset_population',
+                       'asset_presence', 'asset_presence_range'):
+            setattr(self, column, getattr(snapshot, column))
+        for column in ('jump_from', 'jump_to', 'member_ssys',
+                       'member_asset'):
+            setattr(self, column, getattr(snapshot, column).astype(np.intp))
+
+    def _section_strings(self, section, field):
+        '''Decode a string field of every record in a section.'''
+        string = self.snapshot.string
+        return [string(ref)
+                for ref in self.snapshot._sections[section][field].tolist()]
+
+    @cached_property
+    def ssys_names(self):
+        return self._section_strings('ssystems', 'name')
+
+    @cached_property
+    def asset_names(self):
+        return self._section_strings('assets', 'name')
+
+    @cached_property
+    def ssystems(self):
+        return self.snapshot.ssystems()
+
+    @cached_property
+    def assets(self):
+        return self.snapshot.assets()
+
+    @cached_property
+    def ssys_by_name(self):
+        return dict(zip(self.ssys_names, self.ssystems))
+
+    @cached_property
+    def asset_by_name(self):
+        return dict(zip(self.asset_names, self.assets))
+
+    @cached_property
+    def asset_ssystems(self):
+        asset_ssystems = {}
+        for origin, name in zip(self.member_ssys.tolist(),
+                                self.member_names()):
+            asset_ssystems.setdefault(name, []).append(
+                self.ssys_names[origin])
+        return asset_ssystems
+
+    @cached_property
+    def jumps_into(self):
+        jumps_into = {}
+        dests = self._section_strings('jumps', 'dest')
+        for origin, dest in zip(self.jump_from.tolist(), dests):
+            jumps_into.setdefault(dest, []).append(self.ssys_names[origin])
+        return jumps_into
+
+    @cached_property
+    def _dangling_jumps(self):
+        string = self.snapshot.string
+        dests = self.snapshot._sections['jumps']['dest']
+        return dict((row, string(dests[row]))
+                    for row in np.flatnonzero(self.jump_to < 0).tolist())
+
+    @cached_property
+    def _dangling_members(self):
+        string = self.snapshot.string
+        names = self.snapshot._sections['members']['name']
+        return dict((row, string(names[row]))
+                    for row in np.flatnonzero(self.member_asset < 0).tolist())
+
+    @cached_property
+    def _faction_table(self):
+        '''The factions list and asset_faction column, built together.'''
+        factions = []
+        faction_index = {}
+        codes = []
+        for faction in self._section_strings('assets', 'faction'):
+            if faction is None:
+                codes.append(-1)
+                continue
+            if faction not in faction_index:
+                faction_index[faction] = len(factions)
+                factions.append(faction)
+            codes.append(faction_index[faction])
+        return factions, np.array(codes, dtype=np.intp)
+
+    @cached_property
+    def factions(self):
+        return self._faction_table[0]
+
+    @cached_property
+    def asset_faction(self):
+        return self._faction_table[1]
+
+    @cached_property
+    def asset_class(self):
+        return self._section_strings('assets', 'world_class')
+
+    @cached_property
+    def asset_description(self):
+        return self._section_strings('assets', 'description')
+
+def load_universe(filename, naevroot=None, update=True, cache=True):
+    '''Load the universe from a snapshot, if it is up to date.
+
+    If the snapshot is missing, unreadable, or stale (i.e. the data
+    files have changed since it was compiled), the universe is loaded
+    from the data files instead.
+
+    Keyword arguments:
+        filename -- The name of the snapshot file.
+        naevroot -- The root of the Naev source tree. If omitted, the
+            current directory is used.
+        update -- Whether or not to recompile the snapshot if it had to
+            be bypassed. Defaults to True.
+        cache -- Whether or not to use the persistent parse cache when
+            loading the data files. Defaults to True.
+    Returns:
+        A universe.Universe instance.
+
+    '''
+    # Fingerprint the data files before loading them, so that a snapshot
+    # compiled from them looks stale if they change in the meantime.
+    data_print = data_fingerprint(naevroot)
+    try:
+        snapshot = Snapshot(filename)
+    except (OSError, SnapshotError):
+        pass
+    else:
+        if snapshot.fingerprint == data_print:
+            return snapshot.to_universe()
+        snapshot.close()
+
+    universe = Universe.load(naevroot, cache=cache)
+    if update:
+        try:
+            compile_snapshot(filename, naevroot, universe,
+                             fingerprint=data_print)
+        except OSError as err:
+            print('Could not compile the snapshot: {}. Continuing without '
+                  'it.'.format(err), file=sys.stderr)
+    return universe
+
+def cached_universe(naevroot=None, cache=True, assets=True):
+    '''Load the universe for a command-line tool.
+
+    With the cache in use, the universe is loaded through a snapshot
+    kept under SNAPSHOT_DIR for the given data location, as for
+    load_universe(). Otherwise, every data file is parsed afresh.
+
+    Keyword arguments:
+        naevroot -- The root of the Naev source tree, or an archive of
+            its data, as for dataloader.datafiles(). If omitted, the
+            current directory is used.
+        cache -- Whether or not to use the snapshot and the persistent
+            parse cache. Defaults to True.
+        assets -- Whether or not the assets are needed. If not, they
+            are left out when the data files are parsed afresh; a
+            snapshot always has them. Defaults to True.
+    Returns:
+        A universe.Universe instance.
+
+    '''
+    if not cache:
+        return Universe.load(naevroot, assets=assets, cache=False)
+    location = os.path.abspath(os.curdir if naevroot is None else naevroot)
+    filename = os.path.join(SNAPSHOT_DIR, 'universe-{}.snap'.format(
+        hashlib.sha1(location.encode('utf-8')).hexdigest()))
+    try:
+        os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    except OSError:
+        # Compiling the snapshot will fail too, and say why.
+        pass
+    return load_universe(filename, naevroot)
+
+if __name__ == '__main__':
+    # Compile the snapshot to the location given on the command line.
+    cache = use_cache(sys.argv)
+    naevroot = data_root(sys.argv)
+    try:
+        filename = sys.argv[1]
+    except IndexError:
+        filename = 'naev.snap'
+
+    compile_snapshot(filename, naevroot, cache=cache)
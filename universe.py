@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+
+'''Columnar tables of Naev universe data.
+
+The naevdata classes model one star system or asset at a time, which
+suits code that looks at them one at a time. Analysis of the whole
+universe is better served by holding each attribute as a column --- a
+NumPy array with one entry per system, jump, or asset --- so that it can
+be computed on with array operations instead of Python loops.
+
+'''
+
+# Copyright © 2012 Tim Pederick.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Standard library imports.
+from functools import cached_property
+
+# Third-party imports.
+import numpy as np
+
+# Local imports.
+from dataloader import load_dataset
+from naevdata import Asset, Coords, Jump, Nebula, SSystem
+
+def _coord(value):
+    '''Convert a coordinate to a float, with NaN standing in for None.'''
+    return float('nan') if value is None else value
+
+def _uncoord(value):
+    '''Convert a float back to a coordinate, with None for NaN.'''
+    return None if np.isnan(value) else float(value)
+
+
+class Universe:
+    '''A columnar table of star systems, jumps, and assets.
+
+    Systems, jumps, and assets are each identified by their row index
+    in the respective columns. Jumps and asset memberships refer to
+    systems and assets by row index, with -1 marking a reference to a
+    system or asset that isn't in the table.
+
+    The naevdata objects that the tables were built from are kept too,
+    along with indexes for finding them by name and by relationship.
+
+    Instance attributes:
+        ssystems, assets -- Lists of the naevdata.SSystem and
+            naevdata.Asset instances in the universe, in row order.
+        ssys_by_name, asset_by_name -- Mappings of names to those
+            naevdata.SSystem and naevdata.Asset instances.
+        asset_ssystems -- A mapping of asset names to lists of the
+            names of the systems that contain them.
+        jumps_into -- A mapping of system names to lists of the names
+            of the systems with jumps leading to them.
+        ssys_names -- A list of the names of the star systems.
+        ssys_x, ssys_y, ssys_radius, ssys_stars, ssys_interference,
+            ssys_nebula_density, ssys_nebula_volatility -- Arrays of
+            the star systems' attributes, as in naevdata.SSystem.
+        jump_from, jump_to -- Arrays of the origin and destination
+            system indices of each jump.
+        jump_x, jump_y, jump_hide, jump_exit_only -- Arrays of the jump
+            points' attributes, as in naevdata.Jump. The coordinates of
+            autopositioned jumps are NaN.
+        member_ssys, member_asset -- Arrays pairing each system with
+            the index of each asset it contains.
+        asset_names -- A list of the names of the assets.
+        asset_x, asset_y, asset_hide, asset_population, asset_virtual
+            -- Arrays of the assets' attributes, as in naevdata.Asset.
+            The coordinates of virtual assets are NaN.
+        asset_faction -- An array of indices into the factions list,
+            giving the faction holding each asset (-1 for none).
+        asset_presence, asset_presence_range -- Arrays of the value and
+            range of each asset's faction presence.
+        asset_class, asset_description, asset_gfx, asset_services,
+            asset_techs -- Lists of the assets' remaining attributes,
+            as in naevdata.Asset.
+        factions -- A list of the names of the factions holding assets.
+
+    The asset columns for attributes that lazily loaded assets don't
+    read up front (see naevdata.Asset) are only built when first used,
+    so that a universe of lazy assets stays lazy until they're needed.
+
+    '''
+    def __init__(self, ssystems=(), assets=()):
+        '''Build the tables from naevdata objects.
+
+        Keyword arguments:
+            ssystems -- A sequence of naevdata.SSystem instances.
+            assets -- A sequence of naevdata.Asset instances.
+
+        '''
+        ssystems = list(ssystems)
+        assets = list(assets)
+        self.ssystems = ssystems
+        self.assets = assets
+
+        # Indexes of the objects.
+        self.ssys_by_name = dict((ssys.name, ssys) for ssys in ssystems)
+        self.asset_by_name = dict((asset.name, asset) for asset in assets)
+        self.asset_ssystems = {}
+        self.jumps_into = {}
+        for ssys in ssystems:
+            for name in ssys.assets:
+                self.asset_ssystems.setdefault(name, []).append(ssys.name)
+            for dest in ssys.jumps:
+                self.jumps_into.setdefault(dest, []).append(ssys.name)
+
+        # Star systems.
+        self.ssys_names = [ssys.name for ssys in ssystems]
+        ssys_index = dict((name, i) for i, name in enumerate(self.ssys_names))
+        self.ssys_x = np.array([ssys.pos.x for ssys in ssystems], dtype=float)
+        self.ssys_y = np.array([ssys.pos.y for ssys in ssystems], dtype=float)
+        self.ssys_radius = np.array([ssys.radius for ssys in ssystems],
+                                    dtype=float)
+        self.ssys_stars = np.array([ssys.stars for ssys in ssystems],
+                                   dtype=np.int64)
+        self.ssys_interference = np.array([ssys.interference
+                                           for ssys in ssystems], dtype=float)
+        self.ssys_nebula_density = np.array([ssys.nebula.density
+                                             for ssys in ssystems],
+                                            dtype=float)
+        self.ssys_nebula_volatility = np.array([ssys.nebula.volatility
+                                                for ssys in ssystems],
+                                               dtype=float)
+
+        # Assets.
+        self.asset_names = [asset.name for asset in assets]
+        asset_index = dict((name, i)
+                           for i, name in enumerate(self.asset_names))
+        self.asset_x = np.array([_coord(asset.pos.x) for asset in assets],
+                                dtype=float)
+        self.asset_y = np.array([_coord(asset.pos.y) for asset in assets],
+                                dtype=float)
+        self.asset_virtual = np.array([asset.virtual for asset in assets],
+                                      dtype=bool)
+        self.factions = []
+        faction_index = {}
+        faction_codes = []
+        for asset in assets:
+            faction = asset.presence.faction
+            if faction is None:
+                faction_codes.append(-1)
+                continue
+            if faction not in faction_index:
+                faction_index[faction] = len(self.factions)
+                self.factions.append(faction)
+            faction_codes.append(faction_index[faction])
+        self.asset_faction = np.array(faction_codes, dtype=np.intp)
+        self.asset_presence = np.array([asset.presence.value
+                                        for asset in assets], dtype=float)
+        self.asset_presence_range = np.array([asset.presence.range
+                                              for asset in assets],
+                                             dtype=np.int64)
+
+        # Jumps and asset memberships, which refer to the rows above. Names
+        # that don't match any row are kept aside, so that the original
+        # objects can be rebuilt faithfully.
+        jump_from, jump_to, jump_x, jump_y, jump_hide, jump_exit_only = (
+            [], [], [], [], [], [])
+        member_ssys, member_asset = [], []
+        self._dangling_jumps = {}
+        self._dangling_members = {}
+        for i, ssys in enumerate(ssystems):
+            for dest, jump in ssys.jumps.items():
+                to = ssys_index.get(dest, -1)
+                if to < 0:
+                    self._dangling_jumps[len(jump_from)] = dest
+                jump_from.append(i)
+                jump_to.append(to)
+                jump_x.append(_coord(jump.x))
+                jump_y.append(_coord(jump.y))
+                jump_hide.append(jump.hide)
+                jump_exit_only.append(jump.exit_only)
+            for name in ssys.assets:
+                index = asset_index.get(name, -1)
+                if index < 0:
+                    self._dangling_members[len(member_ssys)] = name
+                member_ssys.append(i)
+                member_asset.append(index)
+        self.jump_from = np.array(jump_from, dtype=np.intp)
+        self.jump_to = np.array(jump_to, dtype=np.intp)
+        self.jump_x = np.array(jump_x, dtype=float)
+        self.jump_y = np.array(jump_y, dtype=float)
+        self.jump_hide = np.array(jump_hide, dtype=float)
+        self.jump_exit_only = np.array(jump_exit_only, dtype=bool)
+        self.member_ssys = np.array(member_ssys, dtype=np.intp)
+        self.member_asset = np.array(member_asset, dtype=np.intp)
+
+    @classmethod
+    def load(cls, naevroot=None, assets=True, lazy_assets=False,
+             workers=None, cache=True):
+        '''Load the universe from the Naev data files.
+
+        Keyword arguments:
+            naevroot -- The root of the Naev source tree. If omitted,
+                the current directory is used.
+            assets -- Whether or not to load the assets as well as the
+                star systems. Defaults to True.
+            lazy_assets -- Whether or not to load the assets lazily.
+                Defaults to False.
+            workers, cache -- As for dataloader.load_dataset().
+
+        '''
+        ssystems = load_dataset('SSystems', naevroot, workers=workers,
+                                cache=cache)
+        asset_list = (load_dataset('Assets', naevroot, workers=workers,
+                                   cache=cache, lazy=lazy_assets)
+                      if assets else [])
+        return cls(ssystems, asset_list)
+
+    @cached_property
+    def asset_hide(self):
+        return np.array([asset.hide for asset in self.assets], dtype=float)
+
+    @cached_property
+    def asset_population(self):
+        return np.array([asset.population for asset in self.assets],
+                        dtype=np.int64)
+
+    @cached_property
+    def asset_class(self):
+        return [asset.world_class for asset in self.assets]
+
+    @cached_property
+    def asset_description(self):
+        return [asset.description for asset in self.assets]
+
+    @cached_property
+    def asset_gfx(self):
+        return [asset.gfx for asset in self.assets]
+
+    @cached_property
+    def asset_services(self):
+        return [asset.services for asset in self.assets]
+
+    @cached_property
+    def asset_techs(self):
+        return [getattr(asset, 'techs', set()) for asset in self.assets]
+
+    def __len__(self):
+        '''Get the number of star systems.'''
+        return len(self.ssys_names)
+
+    def bounds(self):
+        '''Get the bounds of the star systems' positions.
+
+        Returns:
+            A 4-tuple of x-minimum, x-maximum, y-minimum and y-maximum,
+            or all None if there are no systems.
+
+        '''
+        if not len(self):
+            return (None, None, None, None)
+        return (float(self.ssys_x.min()), float(self.ssys_x.max()),
+                float(self.ssys_y.min()), float(self.ssys_y.max()))
+
+    def jump_counts(self):
+        '''Get an array of the number of jumps out of each system.'''
+        return np.bincount(self.jump_from, minlength=len(self))
+
+    def member_names(self):
+        '''Get a list of the asset names of each membership row.'''
+        names = [None] * len(self.member_asset)
+        for row, index in enumerate(self.member_asset.tolist()):
+            names[row] = (self._dangling_members[row] if index < 0 else
+                          self.asset_names[index])
+        return names
+
+    def to_ssystems(self):
+        '''Rebuild the star systems as a list of naevdata.SSystem.'''
+        ssystems = []
+        columns = zip(self.ssys_names, self.ssys_x.tolist(),
+                      self.ssys_y.tolist(), self.ssys_radius.tolist(),
+                      self.ssys_stars.tolist(),
+                      self.ssys_interference.tolist(),
+                      self.ssys_nebula_density.tolist(),
+                      self.ssys_nebula_volatility.tolist())
+        for (name, x, y, radius, stars, interference, density,
+             volatility) in columns:
+            ssys = SSystem()
+            ssys.name = name
+            ssys.pos = Coords(x, y)
+            ssys.radius = radius
+            ssys.stars = stars
+            ssys.interference = interference
+            ssys.nebula = Nebula(density, volatility)
+            ssystems.append(ssys)
+
+        columns = zip(self.jump_from.tolist(), self.jump_to.tolist(),
+                      self.jump_x.tolist(), self.jump_y.tolist(),
+                      self.jump_hide.tolist(), self.jump_exit_only.tolist())
+        for row, (origin, dest, x, y, hide, exit_only) in enumerate(columns):
+            dest = (self._dangling_jumps[row] if dest < 0 else
+                    self.ssys_names[dest])
+            ssystems[origin].jumps[dest] = Jump((_uncoord(x), _uncoord(y)),
+                                                hide, exit_only)
+
+        for origin, name in zip(self.member_ssys.tolist(),
+                                self.member_names()):
+            ssystems[origin].assets.add(name)
+
+        return ssystems
+
+    def to_assets(self):
+        '''Rebuild the assets as a list of naevdata.Asset.'''
+        assets = []
+        for i, name in enumerate(self.asset_names):
+            asset = Asset(None)
+            asset.name = name
+            asset.pos = Coords(_uncoord(self.asset_x[i]),
+                               _uncoord(self.asset_y[i]))
+            asset.hide = float(self.asset_hide[i])
+            asset.population = int(self.asset_population[i])
+            asset.virtual = bool(self.asset_virtual[i])
+            faction = int(self.asset_faction[i])
+            asset.presence.faction = (None if faction < 0 else
+                                      self.factions[faction])
+            asset.presence.value = float(self.asset_presence[i])
+            asset.presence.range = int(self.asset_presence_range[i])
+            asset.world_class = self.asset_class[i]
+            asset.description = self.asset_description[i]
+            asset.gfx = self.asset_gfx[i]
+            asset.services = self.asset_services[i]
+            asset.techs = self.asset_techs[i]
+            assets.append(asset)
+        return assets